@@ -19,13 +19,13 @@
 
 import collections
 from collections import abc
-import itertools
 from itertools import chain
 import logging
 
 import bpy
 from mathutils import Matrix, Vector
 import bmesh
+import numpy as np
 
 from . import localutils
 from .localutils import utils
@@ -100,6 +100,116 @@ def memo_bb_type(context, bb_type, bb_space, individual_orientation):
     return (bb_type, bb_space, individual_orientation) + key
 
 
+def _apply_matrices(matrices, vecs):
+    """(N, 4, 4)の行列を(N, 3)の座標に適用する"""
+    return (np.einsum('nij,nj->ni', matrices[:, :3, :3], vecs) +
+            matrices[:, :3, 3])
+
+
+def _transform_edit_bones(context, group_matrices, roll=True):
+    """EditBoneのheadとtailに纏めて行列を適用する。
+    同じGroupにheadとtailの両方が有る場合はBoneとして変形し、rollも求める。
+    :type context: bpy.types.Context
+    :param group_matrices: [(EditBoneGroup, Matrix), ...]。global座標系
+    :type roll: bool
+    """
+    ob = context.active_object
+    bone_coords = memocoords.arm_bone_coords(context, ob, Space.GLOBAL)
+    bone_matrices = memocoords.arm_bone_matrices(context, ob, Space.LOCAL)
+    obmat = np.array(ob.matrix_world)
+    obimat = np.linalg.inv(obmat)
+    arrays = vaarm.EditBoneArrays(ob.data)
+
+    # 0: head, 1: tail, 2: head & tail
+    indices = ([], [], [])
+    matrices = ([], [], [])
+    for group, matrix in group_matrices:
+        mat = np.dot(obimat, np.array(matrix.to_4x4()))
+        head_tail = collections.OrderedDict()
+        for name, p in group:
+            head_tail.setdefault(name, set()).add(p)
+        for name, ps in head_tail.items():
+            kind = 2 if len(ps) == 2 else ps.pop()
+            indices[kind].append(arrays.indices[name])
+            matrices[kind].append(mat)
+    indices = [np.array(ls, dtype=int) for ls in indices]
+    matrices = [np.array(ls).reshape(-1, 4, 4) for ls in matrices]
+    heads = np.array([bone_coords[name][0] for name in arrays.names])
+    tails = np.array([bone_coords[name][1] for name in arrays.names])
+
+    arrays.set_heads(indices[0],
+                     _apply_matrices(matrices[0], heads[indices[0]]))
+    arrays.set_tails(indices[1],
+                     _apply_matrices(matrices[1], tails[indices[1]]))
+    index, mats = indices[2], matrices[2]
+    new_heads = _apply_matrices(mats, heads[index])
+    new_tails = _apply_matrices(mats, tails[index])
+    if roll:
+        z_axes = np.array([bone_matrices[arrays.names[i]].col[2][:3]
+                           for i in index]).reshape(-1, 3)
+        z_axes = np.einsum('nij,nj->ni',
+                           np.matmul(mats, obmat)[:, :3, :3], z_axes)
+        arrays.set_bones(index, new_heads, new_tails, z_axes)
+    else:
+        arrays.set_heads(index, new_heads)
+        arrays.set_tails(index, new_tails)
+
+    # 親と子のheadとtailを修正する
+    arrays.update_connected()
+    arrays.write()
+
+
+def _transform_pose_bones(context, group_matrices, translate=False):
+    """PoseBoneの行列に纏めて行列を適用する。
+    親子関係は階層順に一度で解決するので、適用する順番には依存しない。
+    :type context: bpy.types.Context
+    :param group_matrices: [(PoseBoneGroup, Matrix), ...]。global座標系
+    :param translate: 真なら行列の移動成分のみを用いる。use_connectで
+        親と繋がっているものは移動出来ないので除外する。
+    :type translate: bool
+    """
+    ob = context.active_object
+    current_matrices = memocoords.arm_bone_matrices(
+        context, ob, Space.GLOBAL)
+    obimat = np.linalg.inv(np.array(ob.matrix_world))
+    pose_bones = ob.pose.bones
+
+    bone_mat = collections.OrderedDict()  # {name: numpy.ndarray, ...}
+    with vaarm.CustomProperty():
+        for group, matrix in group_matrices:
+            mat = np.array(matrix.to_4x4())
+            for name in group:
+                if translate:
+                    bone = pose_bones[name]
+                    if bone.parent and bone.use_connect:  # 移動不可
+                        continue
+                bone_mat[name] = mat
+    if not bone_mat:
+        return
+    names = list(bone_mat)
+    mats = np.array(list(bone_mat.values()))
+    current = np.array([np.array(current_matrices[name]) for name in names])
+    if translate:
+        new_matrices = current
+        new_matrices[:, :3, 3] += mats[:, :3, 3]
+    else:
+        new_matrices = np.matmul(mats, current)
+    new_matrices = np.matmul(obimat, new_matrices)
+
+    arrays = vaarm.PoseBoneArrays(ob)
+    if arrays.set_matrices([arrays.indices[name] for name in names],
+                           new_matrices):
+        arrays.write()
+    else:
+        # 継承設定が既定でないものが有るので一つずつ設定する
+        name_indices = {name: i for i, name in enumerate(names)}
+        with vaarm.CustomProperty():
+            bones = [pose_bones[name] for name in names]
+            for bone in vaob.sorted_dependency(bones):
+                mat = new_matrices[name_indices[bone.name]]
+                bone.matrix = Matrix(mat.tolist())
+
+
 ###############################################################################
 # Group
 ###############################################################################
@@ -822,84 +932,16 @@ class EditBoneGroup(Group):
         :type context: bpy.types.Context
         :type vec: Vector
         """
-        ob = context.active_object
-        coords = memocoords.arm_bone_coords(context, ob, Space.GLOBAL)
-        obimat = ob.matrix_world.inverted()
-        bones = ob.data.edit_bones
-        with vaarm.CustomProperty():
-            for name, p in self:
-                bone = bones[name]
-                head, tail = coords[name]
-                if p == 0:
-                    bone.head = obimat * (head + vec)
-                    parent = bone.parent
-                    if parent and bone.use_connect:
-                        parent.tail = bone.head
-                        for child in parent.children:
-                            if child != bone and child.use_connect:
-                                child.head = bone.head
-                else:
-                    bone.tail = obimat * (tail + vec)
-                    for child in bone.children:
-                        if child.use_connect:
-                            child.head = bone.tail
+        _transform_edit_bones(context, [(self, Matrix.Translation(vec))])
 
     def transform(self, context, matrix, roll=True):
         """headとtailの両方がselfに存在していた場合のみroll引数が有効になる
         :type context: bpy.types.Context
         :type matrix: Matrix
+        :param roll: 偽ならrollの値を変更しない
         :type roll: bool
         """
-        ob = context.active_object
-        bone_coords = memocoords.arm_bone_coords(context, ob, Space.GLOBAL)
-        bone_matrixes = memocoords.arm_bone_matrices(context, ob, Space.LOCAL)
-        obimat = ob.matrix_world.inverted()
-        bones = ob.data.edit_bones
-        trans_mat_local = obimat * matrix
-
-        # Bone.transform()の為、一旦use_connectを切る
-        use_connect_flags = {bone: bone.use_connect for bone in bones}
-        for bone in bones:
-            bone.use_connect = False
-
-        with vaarm.CustomProperty():
-            for name, p in self:
-                bone = bones[name]
-                head, tail = bone_coords[name]
-                if p == 0:
-                    if (name, 1) in self:
-                        trans_mat_local = obimat * matrix * obmat
-                        bone.matrix = bone_matrixes[name]
-                        m = trans_mat_local * bone.matrix
-                        zvec = m.col[2].to_3d()
-                        bone.transform(trans_mat_local, scale=True,
-                                       roll=roll)
-                        # roll=Trueだけでは不正確になる場合があるので
-                        bone.align_roll(zvec)
-                    else:
-                        bone.head = obimat * matrix * head
-                else:
-                    if (name, 0) in self:
-                        continue
-                    else:
-                        bone.tail = obimat * matrix * tail
-            # 親と子のheadとtailを修正する
-            for name, p in self:
-                bone = bones[name]
-                if p == 0:
-                    parent = bone.parent
-                    if use_connect_flags[bone] and parent:
-                        parent.tail = bone.head
-                        for child in parent.children:
-                            if child != bone and use_connect_flags[child]:
-                                child.head = bone.head
-                else:
-                    for child in bone.children:
-                        if use_connect_flags[child]:
-                            child.head = bone.tail
-            # use_connectを戻す
-            for bone, flag in use_connect_flags.items():
-                bone.use_connect = flag
+        _transform_edit_bones(context, [(self, matrix)], roll)
 
 
 class PoseBoneGroup(Group):
@@ -1010,35 +1052,15 @@ class PoseBoneGroup(Group):
         :type context: bpy.types.Context
         :type vec: Vector
         """
-        ob = context.active_object
-        matrices = memocoords.arm_bone_matrices(context, ob, Space.GLOBAL)
-        obimat = ob.matrix_world.inverted()
-        bones = [ob.pose.bones[name] for name in self]
-        with vaarm.CustomProperty():
-            for bone in vaob.sorted_dependency(bones):
-                parent = bone.parent
-                if parent and bone.use_connect:  # 移動不可
-                    continue
-                loc = matrices[bone.name].col[3].to_3d()
-                bone.matrix.col[3][:3] = obimat * (loc + vec)
+        _transform_pose_bones(context, [(self, Matrix.Translation(vec))],
+                              translate=True)
 
     def transform(self, context, matrix):
         """
         :type context: bpy.types.Context
         :type matrix: Matrix
         """
-        ob = context.active_object
-        matrices = memocoords.arm_bone_matrices(context, ob, Space.GLOBAL)
-        obimat = ob.matrix_world.inverted()
-        bones = [ob.pose.bones[name] for name in self]
-        with vaarm.CustomProperty():
-            for bone in vaob.sorted_dependency(bones):
-                # parent = bone.parent
-                # if parent and bone.use_connect:  # 移動不可
-                #     continue
-                mat = obimat * matrix * matrices[bone.name]
-                for i in range(4):
-                    bone.matrix.col[i][:] = mat.col[i]
+        _transform_pose_bones(context, [(self, matrix)])
 
 
 ###############################################################################
@@ -1330,10 +1352,9 @@ class BMeshGroups(Groups):
                             (i for i, v in enumerate(bm.verts) if v.select))]
 
         elif group_type == GroupType.LINKED:
-            seq = vabm.linked_vertices_list(bm, select=True, hide=False)
-            d = {v: i for i, v in enumerate(bm.verts)}
-            groups = [Group(context, (d[v] for v in verts))
-                      for verts in seq]
+            labels = vabm.linked_vertices_labels(bm, select=True, hide=False)
+            groups = [Group(context, indices)
+                      for indices in utils.groups_from_labels(labels)]
 
         elif group_type == GroupType.GROUP:
             layer = bm.verts.layers.deform.verify()
@@ -1533,75 +1554,15 @@ class EditBoneGroups(Groups):
     def translate(self, context, vectors):
         if isinstance(vectors, list):
             vectors = dict(zip(self, vectors))
-        for group, vec in vectors.items():
-            group.translate(context, vec)
+        _transform_edit_bones(
+            context, [(group, Matrix.Translation(vec))
+                      for group, vec in vectors.items()])
 
     def transform(self, context, matrices, reverse=False, roll=True):
+        """全Groupを纏めて変形するので、reverseは結果に影響しない"""
         if isinstance(matrices, list):
             matrices = dict(zip(self, matrices))
-
-        ob = context.active_object
-        bone_coords = memocoords.arm_bone_coords(context, ob, Space.GLOBAL)
-        bone_matrixes = memocoords.arm_bone_matrices(context, ob, Space.LOCAL)
-        obmat = ob.matrix_world
-        obimat = obmat.inverted()
-        bones = ob.data.edit_bones
-
-        # Bone.transform()の為、一旦use_connectを切る
-        use_connect_flags = {bone: bone.use_connect for bone in bones}
-        for bone in bones:
-            bone.use_connect = False
-
-        used_bones = set()
-        all_keys = []
-        for group in self:
-            for name, p in group:
-                used_bones.add(bones[name])
-                all_keys.append((group, bones[name], p))
-        sorted_bones = vaob.sorted_dependency(list(used_bones))
-        all_keys.sort(key=lambda x: (sorted_bones.index(x[1]), x[2]))
-
-        with vaarm.CustomProperty():
-            for group, bone, p in all_keys:
-                matrix = matrices[group]
-                matrix = matrix.to_4x4()
-                name = bone.name
-                head, tail = bone_coords[name]
-                if p == 0:
-                    if (name, 1) in group:
-                        trans_mat_local = obimat * matrix * obmat
-                        bone.matrix = bone_matrixes[name]
-                        m = trans_mat_local * bone.matrix
-                        zvec = m.col[2].to_3d()
-                        bone.transform(trans_mat_local, scale=True,
-                                       roll=roll)
-                        # roll=Trueだけでは不正確になる場合があるので
-                        bone.align_roll(zvec)
-                    else:
-                        bone.head = obimat * matrix * head
-                else:
-                    if (name, 0) in group:
-                        continue
-                    else:
-                        bone.tail = obimat * matrix * tail
-
-            # 親と子のheadとtailを修正する
-            for name, p in itertools.chain.from_iterable(self):
-                bone = bones[name]
-                if p == 0:
-                    parent = bone.parent
-                    if use_connect_flags[bone] and parent:
-                        parent.tail = bone.head
-                        for child in parent.children:
-                            if child != bone and use_connect_flags[child]:
-                                child.head = bone.head
-                else:
-                    for child in bone.children:
-                        if use_connect_flags[child]:
-                            child.head = bone.tail
-        # use_connectを戻す
-        for bone, flag in use_connect_flags.items():
-            bone.use_connect = flag
+        _transform_edit_bones(context, list(matrices.items()), roll)
 
 
 class PoseBoneGroups(Groups):
@@ -1698,49 +1659,34 @@ class PoseBoneGroups(Groups):
     def translate(self, context, vectors):
         if isinstance(vectors, list):
             vectors = dict(zip(self, vectors))
-
-        ob = context.active_object
-        matrices = memocoords.arm_bone_matrices(context, ob, Space.GLOBAL)
-        obimat = ob.matrix_world.inverted()
-        bones = ob.pose.bones
-
-        bone_vec = {}  # {PoseBone: Vector, ...}
-        for group, vec in vectors.items():
-            for name in group:
-                bone_vec[bones[name]] = vec
-
-        with vaarm.CustomProperty():
-            for bone in vaob.sorted_dependency(bone_vec.keys()):
-                parent = bone.parent
-                if parent and bone.use_connect:  # 移動不可
-                    continue
-                loc = matrices[bone.name].col[3].to_3d()
-                bone.matrix.col[3][:3] = obimat * (loc + bone_vec[bone])
+        _transform_pose_bones(
+            context, [(group, Matrix.Translation(vec))
+                      for group, vec in vectors.items()],
+            translate=True)
 
     def transform(self, context, matrices, reverse=False):
+        """全Groupを纏めて変形するので、reverseは結果に影響しない"""
         if isinstance(matrices, list):
             matrices = dict(zip(self, matrices))
-
-        ob = context.active_object
-        current_matrices = memocoords.arm_bone_matrices(
-            context, ob, Space.GLOBAL)
-        obimat = ob.matrix_world.inverted()
-        bones = ob.pose.bones
-
-        bone_mat = {}  # {PoseBone: Matrix, ...}
-        for group, mat in matrices.items():
-            for name in group:
-                bone_mat[bones[name]] = mat
-
-        with vaarm.CustomProperty():
-            sorted_bones = vaob.sorted_dependency(bone_mat.keys())
-            if reverse:
-                sorted_bones.reverse()
-            for bone in sorted_bones:
-                # parent = bone.parent
-                # if parent and bone.use_connect:  # 移動不可
-                #     continue
-                mat = obimat * bone_mat[bone] * current_matrices[bone.name]
-                # for i in range(4):
-                #     bone.matrix.col[i][:] = mat.col[i]
-                bone.matrix = mat  # スライスだと上手くいかなかった
+        _transform_pose_bones(context, list(matrices.items()))
+
+
+def check_translate_pose_bones(context):
+    """PoseBoneGroup.translate()の確認。bpyが必要なのでBlender内で実行する"""
+    ob = context.active_object
+    if not ob or ob.type != 'ARMATURE' or ob.mode != 'POSE':
+        raise ValueError('ポーズモードのアーマチュアが無いのでテスト不可')
+    bones = ob.pose.bones
+    heads = {b.name: ob.matrix_world * b.head for b in bones}
+    vec = Vector((0.5, -1.0, 2.0))
+    group = PoseBoneGroup(context, [b.name for b in bones])
+    for v, offset in ((vec, vec), (-vec, Vector())):
+        tool_data.memoize.clear()
+        group.translate(context, v)
+        context.scene.update()
+        # 繋がっている子も親と共に移動する
+        for b in bones:
+            head = ob.matrix_world * b.head
+            if (head - (heads[b.name] + offset)).length > 1e-4:
+                raise ValueError('エラー: ' + b.name)
+    print('ok')
@@ -110,6 +110,16 @@ class CheckArgs:
             引数のチェックをしない。wrapと違い関数定義後に変更する事が出来る。
             wrapほどの高速化の効果は無い。
 
+    CheckArgs.enabled:
+        偽にすると全てのCheckArgsでwrapが偽の場合と同じになり、関数を
+        そのまま返す。デコレートの時点で判定するので、対象のモジュールを
+        読み込む前に変更すること。
+        CheckArgs.enabled = False
+
+    ラップした関数では、クラスやNoneの条件は isinstance() 等の式に展開し、
+    引数毎の判定を一つの式にまとめたものを実行する。判定に失敗した場合のみ
+    条件を一つずつ確認してCheckArgsErrorを送出する。
+
     conditions:
         name=condition
         or
@@ -154,6 +164,9 @@ class CheckArgs:
 
     _void = _void
 
+    enabled = True
+    """偽ならデコレートしても関数をそのまま返す"""
+
     def _expand_var_positional(self, options, init=False):
         if init:
             replacement = symbol_table = None
@@ -201,6 +214,7 @@ class CheckArgs:
         arg_condition = _List()
         arg_condition.formatter = None
         arg_condition.source = conditions
+        arg_condition.conditions = []  # 各関数の元になった条件
 
         function_types = (_types.BuiltinFunctionType, _types.BuiltinMethodType,
                           _types.FunctionType, _types.LambdaType,
@@ -294,6 +308,7 @@ class CheckArgs:
             func, formatter = gen(condition, symbol_table)
             if func:
                 arg_condition.append(func)
+                arg_condition.conditions.append(condition)
             if formatter:
                 arg_condition.formatter = formatter
 
@@ -320,6 +335,8 @@ class CheckArgs:
     def _gen_arg_conditions(self, kwargs, signature, symbol_table=None):
         arg_conditions = {}
         for name, conditions in kwargs.items():
+            if name not in signature.parameters:
+                continue
             if not (isinstance(conditions, tuple) and
                     conditions.__class__ == _builtins.tuple):
                 conditions = (conditions,)
@@ -360,7 +377,7 @@ class CheckArgs:
         else:
             kwargs = self.conditions
 
-        if not wrap:
+        if not wrap or not CheckArgs.enabled:
             def wrapper(function):
                 return function
 
@@ -507,26 +524,36 @@ class CheckArgs:
                     seen.add(n)
                     symbol_names[name] = n
 
-                ls = ["'{}': {}".format(n, n) for n in sig.parameters]
-                args_dict = '{' + ' ,'.join(ls) + '}'
-                code_str = (
-                    '@{wraps}({function})\n'
-                    'def {func_name}{args}:\n'
-                    '    if {self}.active:\n'
-                    '        {check_args}({args_dict})\n'
-                    '    return {function}{bind_string}\n'
-                ).format(func_name=func_name,
-                         args=str(sig),
-                         args_dict=args_dict,  # locals()の代わり
-                         bind_string=bind_string,
-                         **symbol_names)
-
                 symbols = {symbol_names['wraps']: wraps,
                            symbol_names['function']: function,
                            symbol_names['self']: self,
                            symbol_names['check_args']: check_args,
                            symbol_names['locals']: _locals
                 }
+                check_string = self._compile_check(
+                    parameters_tuple, arg_conditions, seen, symbols)
+
+                ls = ["'{}': {}".format(n, n) for n in sig.parameters]
+                args_dict = '{' + ' ,'.join(ls) + '}'
+                if check_string:
+                    code_str = (
+                        '@{wraps}({function})\n'
+                        'def {func_name}{args}:\n'
+                        '    if {self}.active and not ({check}):\n'
+                        '        {check_args}({args_dict})\n'
+                        '    return {function}{bind_string}\n')
+                else:
+                    code_str = (
+                        '@{wraps}({function})\n'
+                        'def {func_name}{args}:\n'
+                        '    return {function}{bind_string}\n')
+                code_str = code_str.format(
+                    func_name=func_name,
+                    args=str(sig),
+                    check=check_string,
+                    args_dict=args_dict,  # locals()の代わり
+                    bind_string=bind_string,
+                    **symbol_names)
 
                 result = _utils.exec_local(code_str, symbol_table, symbols)
                 func = result[func_name]
@@ -535,6 +562,55 @@ class CheckArgs:
 
         return wrapper
 
+    @staticmethod
+    def _compile_check(parameters, arg_conditions, seen, symbols):
+        """引数の判定を一つの式の文字列にする。式中で使うオブジェクトは
+        symbolsに追加する。
+        :param parameters: ((name, inspect.Parameter), ...)
+        :param seen: 使用済みの名前。追加した名前もここに加える
+        :type seen: set
+        :type symbols: dict
+        :return: 条件が無ければ空文字
+        :rtype: str
+        """
+        def constant(obj):
+            name = '_condition' + str(len(seen))
+            while name in seen:
+                name += '_'
+            seen.add(name)
+            symbols[name] = obj
+            return name
+
+        texts = []
+        for arg, _param in parameters:
+            if arg not in arg_conditions:
+                continue
+            arg_condition = arg_conditions[arg]
+            exprs = []
+            for con, func in zip(arg_condition.conditions, arg_condition):
+                if con is None:
+                    exprs.append('{} is None'.format(arg))
+                elif isinstance(con, tuple):
+                    classes = tuple([(cls if cls is not None else type(None))
+                                     for cls in con])
+                    exprs.append('isinstance({}, {})'.format(
+                        arg, constant(classes)))
+                elif _inspect.isclass(con):
+                    exprs.append('isinstance({}, {})'.format(
+                        arg, constant(con)))
+                else:
+                    exprs.append('{}({})'.format(constant(func), arg))
+
+            formatter = arg_condition.formatter
+            if not formatter or formatter == 'and':
+                text = ' and '.join(exprs) or 'True'
+            elif formatter == 'or':
+                text = ' or '.join(exprs) or 'False'
+            else:
+                text = '{}({})'.format(constant(formatter), ', '.join(exprs))
+            texts.append('(' + text + ')')
+        return ' and '.join(texts)
+
     @classmethod
     def checkargs(cls, *options, **conditions):
         func = cls(*options, **conditions)()
@@ -585,5 +661,39 @@ def _test():
         # print(a, b, c, d, kwargs)
 
 
+def benchmark(count=100000):
+    """関数呼び出し一回当たりのオーバーヘッドを表示する"""
+    import time
+
+    def plain(a, b, *c, d=0, **kwargs):
+        pass
+
+    def measure(func):
+        t = time.perf_counter()
+        for i in range(count):
+            func(1, 'b', 3, d=4, x=5)
+        return (time.perf_counter() - t) / count
+
+    conditions = dict(a=int, b=(str, None, 'or'), d=((int, float),),
+                      kwargs={'x': int})
+    base = measure(plain)
+    results = [
+        ('checked', CheckArgs(**conditions)()(plain)),
+        ('active=False', CheckArgs(True, False, **conditions)()(plain)),
+        ('wrap=False', CheckArgs(False, **conditions)()(plain)),
+    ]
+    enabled = CheckArgs.enabled
+    CheckArgs.enabled = False
+    try:
+        results.append(('enabled=False', CheckArgs(**conditions)()(plain)))
+    finally:
+        CheckArgs.enabled = enabled
+
+    print('plain: {:.3f} us'.format(base * 1e6))
+    for name, func in results:
+        print('{}: +{:.3f} us'.format(name, (measure(func) - base) * 1e6))
+
+
 if __name__ == '__main__':
     _test()
+    benchmark()
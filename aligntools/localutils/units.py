@@ -17,7 +17,10 @@
 # ##### END GPL LICENSE BLOCK #####
 
 
+import bisect
+import itertools
 import math
+import operator
 import re
 from collections import namedtuple, OrderedDict
 import decimal
@@ -25,13 +28,6 @@ from decimal import Decimal
 D = Decimal
 from fractions import Fraction
 
-# if __name__ == '__main__':
-#     import utils as _utils
-# else:
-#     from . import utils as _utils
-# import localutils.utils as _utils
-from . import utils as _utils
-
 
 class UnitError(ValueError):
     def __init__(self, value=''):
@@ -46,6 +42,40 @@ class _void:
         return False
 
 
+class _LRUCache:
+    """最後に参照された順にmaxsize個まで値を保持する"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 UNIT_NONE = 0
 UNIT_BASE = 1
 #  Use for units that are not used enough to be translated into for common use
@@ -60,6 +90,14 @@ UNIT_TENTH = 1 << 2
 Unit = namedtuple('Unit', ('symbol', 'scalar', 'flag', 'symbol_alt'))
 # _default_unit = Unit('', '', '', None, '', D(1), None)
 
+# {Unitのタプル: 番号, ...}。内容が同じUnitsには同じ番号が振られる。
+# unit_to_num()はpx, buの値が視点毎に異なるUnitsを作るので数を制限する。
+# 番号は再利用しないので、破棄されたUnitsの番号を持つキャッシュの値は
+# 参照されずにexpression_cache, format_cacheから押し出される
+UNITS_KEY_IDS_SIZE = 256
+_units_key_ids = _LRUCache(UNITS_KEY_IDS_SIZE)
+_units_key_counter = itertools.count()
+
 
 class Units(list):
     """
@@ -153,6 +191,17 @@ class Units(list):
         else:
             self.base = None
 
+        # num_to_unit()で使う
+        key = tuple(self)
+        key_id = _units_key_ids.get(key)
+        if key_id is None:
+            key_id = next(_units_key_counter)
+            _units_key_ids.set(key, key_id)
+        self.key_id = key_id
+        self.float_scalars = {symbol: float(unit.scalar)
+                              for symbol, unit in self.all_symbols.items()}
+        self._plans = {}
+
     def copy(self):
         return self.__class__(self)
 
@@ -220,6 +269,71 @@ class Units(list):
             name = symbols[i]
         return name
 
+    def separate_plan(self, start=None, end=None):
+        """num_to_unit()で使う単位の並びを返す。結果はupdate()まで保持する。
+        :param start: symbolかsymbol_alt。SUPPRESSならより小さい単位に変更する
+        :type start: str | None
+        :param end: symbolかsymbol_alt。SUPPRESSならより小さい単位に変更する
+        :type end: str | None
+        :return: (symbolのリスト, floatのscalarのリスト, start, end)
+        :rtype: (list[str], list[float], str | None, str | None)
+        """
+        key = (start, end)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+
+        start = self.symbol(start)
+        end = self.symbol(end)
+        if start:
+            if self.is_basic(start):
+                start_basic = start
+            else:
+                start_basic = self.next_basic(start)
+        else:
+            start_basic = None
+        if end:
+            if self.is_basic(end):
+                end_basic = end
+            else:
+                end_basic = self.next_basic(end)
+        else:
+            end_basic = None
+
+        names = list(self.basic_symbols)
+        if start_basic:
+            i = names.index(start_basic)
+            names = names[i:]
+        if end_basic and end_basic in names:
+            i = names.index(end_basic)
+            names = names[:i + 1]
+
+        scalars = [self.float_scalars[name] for name in names]
+        plan = self._plans[key] = (names, scalars, start_basic, end_basic)
+        return plan
+
+    def single_thresholds(self, eps=None):
+        """_num_to_unit_single()で単位を選ぶ為の閾値を返す。
+        値の絶対値がthresholds[i]以上となる最初のsymbols[i]を使う。
+        :type eps: float | None
+        :return: (symbolのリスト, 閾値のリスト)。何れもscalarの昇順
+        :rtype: (list[str], list[float])
+        """
+        key = ('single', eps)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        symbols = list(reversed(self.basic_symbols))
+        thresholds = []
+        for name in symbols:
+            scalar = self.float_scalars[name]
+            if eps is None:
+                thresholds.append(scalar)
+            else:
+                thresholds.append(scalar - min(abs(eps), scalar / 2))
+        plan = self._plans[key] = (symbols, thresholds)
+        return plan
+
     def unit_to_num(self, string, scale_length=1, use_decimal=False):
         kwargs = dict(locals())
         del kwargs['self']
@@ -313,11 +427,371 @@ def _get_units_from_string(unit_system):
 ###############################################################################
 # unit_to_num()
 ###############################################################################
+class UnitSyntaxError(UnitError):
+    """unit_to_num()に渡された文字列が解析出来ない"""
+
+    def __init__(self, message, position):
+        """
+        :type message: str
+        :param position: 文字列中の問題の箇所
+        :type position: int
+        """
+        super().__init__(message)
+        self.position = position
+
+    def __str__(self):
+        return '{} (position {})'.format(self.value, self.position)
+
+
+_NUMBER_PATTERN = re.compile(r'(\d+\.?\d*|\d*\.\d+)([eE][+-]?\d+)?')
+_NAME_PATTERN = re.compile(r'[^\W\d]\w*')
+_UNIT_END_PATTERN = re.compile(r'[a-zA-Z_]')
+_OPERATORS = ('**', '//', '+', '-', '*', '/', '%', '(', ')', ',')
+
+_BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '//': operator.floordiv,
+    '%': operator.mod,
+    '**': operator.pow,
+}
+
+_CONSTANTS = {
+    'pi': math.pi,
+    'tau': math.pi * 2,
+    'e': math.e,
+}
+
+_FUNCTIONS = {name: getattr(math, name) for name in (
+    'sqrt', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2',
+    'radians', 'degrees', 'floor', 'ceil', 'log', 'log10', 'exp', 'hypot')}
+_FUNCTIONS.update({'abs': abs, 'min': min, 'max': max, 'round': round})
+
+
+def _tokenize(string, unit_symbols):
+    """
+    :param unit_symbols: 長い順に並べたsymbolとsymbol_alt
+    :return: [(種類, 値, 位置), ...]。種類は 'num', 'unit', 'name', 'op',
+        'end' の何れか
+    :rtype: list[(str, str, int)]
+    """
+    tokens = []
+    i = 0
+    length = len(string)
+    while True:
+        while i < length and string[i].isspace():
+            i += 1
+        if i == length:
+            tokens.append(('end', '', i))
+            return tokens
+
+        # 単位は数値か閉じ括弧の直後のみ
+        if tokens and (tokens[-1][0] == 'num' or tokens[-1][1] == ')'):
+            for symbol in unit_symbols:
+                if string.startswith(symbol, i):
+                    j = i + len(symbol)
+                    if j == length or not _UNIT_END_PATTERN.match(string, j):
+                        tokens.append(('unit', symbol, i))
+                        i = j
+                        break
+            else:
+                symbol = None
+            if symbol is not None:
+                continue
+
+        match = _NUMBER_PATTERN.match(string, i)
+        if match:
+            tokens.append(('num', match.group(0), i))
+            i = match.end()
+            continue
+        match = _NAME_PATTERN.match(string, i)
+        if match:
+            tokens.append(('name', match.group(0), i))
+            i = match.end()
+            continue
+        for op in _OPERATORS:
+            if string.startswith(op, i):
+                tokens.append(('op', op, i))
+                i += len(op)
+                break
+        else:
+            raise UnitSyntaxError(
+                "invalid character '{}'".format(string[i]), i)
+
+
+class _Parser:
+    """再帰下降構文解析。
+    expr   := term (('+' | '-') term)*
+    term   := factor (('*' | '/' | '//' | '%') factor)*
+    factor := ('+' | '-') factor | power
+    power  := units ('**' factor)?
+    units  := atom (unit (atom unit)*)?    連続する単位付きの値は合計する
+    atom   := number | '(' expr ')' | name '(' args ')' | name
+    ノードはタプルで表す。
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    @property
+    def token(self):
+        return self.tokens[self.index]
+
+    def next(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def error(self, message, token=None):
+        if token is None:
+            token = self.token
+        return UnitSyntaxError(message, token[2])
+
+    def expect(self, value):
+        token = self.next()
+        if token[1] != value or token[0] != 'op':
+            raise self.error("'{}' expected".format(value), token)
+
+    def parse(self):
+        node = self.expr()
+        if self.token[0] != 'end':
+            raise self.error("unexpected '{}'".format(self.token[1]))
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.token[0] == 'op' and self.token[1] in ('+', '-'):
+            op = self.next()[1]
+            node = ('bin', op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.token[0] == 'op' and self.token[1] in ('*', '/', '//',
+                                                          '%'):
+            op = self.next()[1]
+            node = ('bin', op, node, self.factor())
+        return node
+
+    def factor(self):
+        if self.token[0] == 'op' and self.token[1] in ('+', '-'):
+            op = self.next()[1]
+            node = self.factor()
+            return ('neg', node) if op == '-' else node
+        return self.power()
+
+    def power(self):
+        node = self.units()
+        if self.token[0] == 'op' and self.token[1] == '**':
+            self.next()
+            node = ('bin', '**', node, self.factor())
+        return node
+
+    def units(self):
+        node = self.atom()
+        if self.token[0] != 'unit':
+            return node
+        terms = [('unit', node, self.next()[1])]
+        while self.token[0] == 'num' or self.token[1] == '(':
+            node = self.atom()
+            if self.token[0] != 'unit':
+                raise self.error('unit expected')
+            terms.append(('unit', node, self.next()[1]))
+        if len(terms) == 1:
+            return terms[0]
+        return ('sum', terms)
+
+    def atom(self):
+        token = self.next()
+        kind, value, _pos = token
+        if kind == 'num':
+            return ('num', value)
+        elif kind == 'op' and value == '(':
+            node = self.expr()
+            self.expect(')')
+            return node
+        elif kind == 'name':
+            if self.token[1] == '(' and self.token[0] == 'op':
+                if value not in _FUNCTIONS:
+                    raise self.error(
+                        "unknown function '{}'".format(value), token)
+                self.next()
+                args = []
+                if self.token[1] != ')':
+                    args.append(self.expr())
+                    while self.token[1] == ',':
+                        self.next()
+                        args.append(self.expr())
+                self.expect(')')
+                return ('call', value, args)
+            if value not in _CONSTANTS:
+                raise self.error("unknown name '{}'".format(value), token)
+            return ('const', value)
+        elif kind == 'end':
+            raise self.error('unexpected end of input', token)
+        else:
+            raise self.error("unexpected '{}'".format(value), token)
+
+
+def _compile_node(node, use_decimal):
+    """ノードを env=(scalars, scale_length) を引数とする関数に変換する"""
+    kind = node[0]
+    if kind == 'num':
+        text = node[1]
+        if '.' in text or 'e' in text or 'E' in text:
+            value = float(text)
+            if use_decimal:
+                value = Decimal(str(value))
+        else:
+            value = int(text)
+        return lambda env: value
+    elif kind == 'const':
+        value = _CONSTANTS[node[1]]
+        return lambda env: value
+    elif kind == 'unit':
+        func = _compile_node(node[1], use_decimal)
+        symbol = node[2]
+        return lambda env: func(env) * env[0][symbol] / env[1]
+    elif kind == 'sum':
+        funcs = [_compile_node(n, use_decimal) for n in node[1]]
+
+        def func_sum(env):
+            result = funcs[0](env)
+            for f in funcs[1:]:
+                result = result + f(env)
+            return result
+        return func_sum
+    elif kind == 'neg':
+        func = _compile_node(node[1], use_decimal)
+        return lambda env: -func(env)
+    elif kind == 'bin':
+        op = _BINARY_OPERATORS[node[1]]
+        func1 = _compile_node(node[2], use_decimal)
+        func2 = _compile_node(node[3], use_decimal)
+        return lambda env: op(func1(env), func2(env))
+    else:  # 'call'
+        function = _FUNCTIONS[node[1]]
+        funcs = [_compile_node(n, use_decimal) for n in node[2]]
+        return lambda env: function(*[f(env) for f in funcs])
+
+
+def _collect_symbols(node, symbols):
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            _collect_symbols(child, symbols)
+        elif isinstance(child, list):
+            for n in child:
+                _collect_symbols(n, symbols)
+    if node[0] == 'unit':
+        symbols.add(node[2])
+    return symbols
+
+
+def _literal_decimal(value):
+    """str(value)を数値リテラルとして解釈した時の値をDecimalで返す。
+    Decimal('1E+3') -> Decimal('1000.0'), 2 -> Decimal('2')
+    :rtype: Decimal
+    """
+    text = str(value)
+    if '.' in text or 'e' in text or 'E' in text:
+        return Decimal(str(float(text)))
+    return Decimal(text)
+
+
+class UnitExpression:
+    """unit_to_num()の文字列を解析した結果。
+    expr = compile_unit_expression('1m 2cm * 3', 'metric')
+    expr.evaluate(scale_length=2)
+    """
+
+    def __init__(self, string, units, use_decimal=False):
+        """
+        :type string: str
+        :type units: Units
+        :type use_decimal: bool
+        :raises UnitSyntaxError: 解析に失敗した
+        """
+        self.string = string
+        self.use_decimal = use_decimal
+        unit_symbols = sorted(units.all_symbols, key=len, reverse=True)
+        tokens = _tokenize(string, unit_symbols)
+        self.node = _Parser(tokens).parse()
+        # 解析時点の値を保持するので、後でunitsを変更しても影響しない
+        self.scalars = {symbol: units.scalar(symbol)
+                        for symbol in _collect_symbols(self.node, set())}
+        self._func = _compile_node(self.node, use_decimal)
+
+    def evaluate(self, scale_length=1):
+        """
+        :param scale_length: 単位はscale_lengthで割られる
+        :type scale_length: int | float | Decimal | str | list | tuple
+        :rtype: int | float | complex | Decimal | Fraction
+        :raises ArithmeticError, TypeError, ValueError: 計算に失敗した
+        """
+        if self.use_decimal:
+            if isinstance(scale_length, (list, tuple)):
+                scale = Decimal(scale_length)
+            else:
+                scale = _literal_decimal(scale_length)
+            scalars = {symbol: _literal_decimal(scalar)
+                       for symbol, scalar in self.scalars.items()}
+        else:
+            if isinstance(scale_length, (int, float)):
+                scale = scale_length
+            else:
+                scale = float(Decimal(scale_length))
+            scalars = {symbol: float(scalar)
+                       for symbol, scalar in self.scalars.items()}
+        return self._func((scalars, scale))
+
+
+# {(string, Units.key_id, use_decimal): UnitExpression | (message, position)}
+expression_cache = _LRUCache(256)
+
+
+def compile_unit_expression(string, unit_system='mixed', use_decimal=False):
+    """文字列を解析したUnitExpressionを返す。結果はexpression_cacheに
+    保持する。
+    :type string: str
+    :param unit_system: 'metric' or 'imperial' or 'mixed' or Units.
+        それ以外なら単位を使用しない
+    :type unit_system: str | Units
+    :type use_decimal: bool
+    :rtype: UnitExpression
+    :raises UnitSyntaxError: 解析に失敗した
+    """
+    if isinstance(unit_system, str):
+        units = _get_units_from_string(unit_system)
+    elif isinstance(unit_system, Units):
+        units = unit_system
+    else:
+        units = empty_units
+    key = (string, units.key_id, use_decimal)
+    result = expression_cache.get(key)
+    if result is None:
+        try:
+            result = UnitExpression(string, units, use_decimal)
+        except UnitSyntaxError as err:
+            # 例外を使い回すと__traceback__が伸び続けるので、毎回作り直す
+            result = (err.value, err.position)
+        expression_cache.set(key, result)
+    if isinstance(result, tuple):
+        raise UnitSyntaxError(*result)
+    return result
+
+
 def unit_to_num(string, unit_system='mixed', scale_length=1, use_decimal=False):
-    """単位付きの文字列を数値に変換する。失敗したらNoneを返す
+    """単位付きの文字列を数値に変換する。失敗したらNoneを返す。
+    四則演算と'//', '%', '**'、括弧、_CONSTANTSの定数と_FUNCTIONSの関数が
+    使える。数値か括弧の直後に単位を付けた物が空白だけを挟んで続く場合は
+    それらを合計する。'1m 2cm * 3' -> (1m + 2cm) * 3
+    解析結果はcompile_unit_expression()で再利用される。
     :type string: str
     :param unit_system: 'metric' or 'imperial' or 'mixed'(両方有効) or Units.
-        それ以外だと単位の置換を行わず、文字列をそのままeval()に渡す
+        それ以外だと単位を使用しない
     :type unit_system: str | Units
     :param scale_length: 単位はscale_lengthで割られる。この引数はDecimalの引数
         として有効な値が使える。
@@ -325,21 +799,14 @@ def unit_to_num(string, unit_system='mixed', scale_length=1, use_decimal=False):
         unit_to_num('2m', scale_length=2) -> 1
         unit_to_num('10bu', units={'bu': 2}, scale_length=2) -> 10
     :type scale_length: int | float | Decimal | str| list | tuple
-    :param use_decimal: decimalモジュールを使用する。浮動小数点数の箇所を
-        Decimal()で囲う。
+    :param use_decimal: decimalモジュールを使用する。小数点か指数を含む数値と
+        単位をDecimalで表す。
         '1m 2.3cm 4e-5mm'
-        -> 1m (Decimal(str(2.3)))cm (Decimal(str(4e-5)))mm
-        -> (1 * Decimal(str(1)) / Decimal(str(1)) + \
-           (Decimal(str(2.3))) * Decimal(str(0.01)) / Decimal(str(1)) + \
-           (Decimal(str(4e-5))) * Decimal(str(0.001)) / Decimal(str(1)))
+        -> (1 * Decimal('1') / Decimal('1') +
+            Decimal('2.3') * Decimal('0.01') / Decimal('1') +
+            Decimal('0.00004') * Decimal('0.001') / Decimal('1'))
         -> 1.02300004
         但し、演算結果が浮動小数点数になる場合はエラーとなる。
-        '1m (2 / 3)cm'
-        -> (1 * Decimal(str(1)) / Decimal(str(1)) + \
-           (2 / 3) * Decimal(str(0.01)) / Decimal(str(1)))
-        この場合は、Decimal型を渡すことでエラーを回避できる。
-        '1m (Decimal((0, (2,), 0)) / 3)cm'
-        ※ ' " はinch, foot に使われるので Decimal('2') とは出来無い
     :type use_decimal: bool
     :rtype int | float | Decimal | None
     """
@@ -347,103 +814,10 @@ def unit_to_num(string, unit_system='mixed', scale_length=1, use_decimal=False):
     if not isinstance(scale_length, (int, float, Decimal, str, list, tuple)):
         raise TypeError()
 
-    if isinstance(unit_system, str):
-        units = _get_units_from_string(unit_system)
-    elif isinstance(unit_system, Units):
-        units = unit_system
-    else:
-        units = empty_units
-    unit_names = units.all_symbols.copy()
-
-    if use_decimal:
-        pattern = '(^|(?<=[^a-zA-Z_]))' + \
-                  '(?P<float>(\d+\.?\d*|\d*\.\d+)(?P<e>[eE][+-]?\d+|))'# + \
-                  # '(?=[^a-zA-Z_]|$)'
-        def func(match):
-            float_string = match.group('float')
-            if '.' in float_string or match.group('e'):
-                return '(Decimal(str(' + float_string + ')))'
-            else:
-                return float_string
-        string = re.sub(pattern, func, string)
-
-    bracket_indices = _utils.find_brackets(string, quotations=[], old_style=True)
-    for st, ed in bracket_indices:
-        if st is None or ed is None:
-            bracket_indices = None
-            break
-
-    unit_spans = []  # [[match, start, end], ...]
-    if unit_names:
-        pattern = '(^|(?<=[^a-zA-Z_]))(?P<unit>' + \
-                  '|'.join(unit_names.keys()) + ')(?=[^a-zA-Z_]|$)'
-        unit_matches = list(re.finditer(pattern, string))
-        for i, unit_match in enumerate(unit_matches):
-            part_string = string[:unit_match.start()]
-            match = re.match('(.*?)(\d+\.?\d*|\d*\.\d+)([eE][+-]?\d+|)\s*$',
-                             part_string)
-            if match:
-                # 単位の直前(スペースの有無は問わず)が数字
-                unit_spans.append([unit_match, match.start(2), match.end(3)])
-            elif bracket_indices:
-                match = re.match('.*?(\))\s*$', part_string)
-                # 単位の直前(スペースの有無は問わず)が括弧
-                if match:
-                    bracket_close = match.start(1)
-                    for st, ed in bracket_indices:
-                        if ed - 1 == bracket_close:
-                            unit_spans.append([unit_match, st, ed])
-                            break
-
-    replaces = []
-    connected_unit_spans = []  # temp
-    for i, elem in enumerate(unit_spans):
-        connected_unit_spans.append(elem)
-
-        match, _start, _end = elem
-
-        # 次のマッチとの間に文字が無ければ繋がっていると見做し、
-        # connected_unit_spansに要素を追加していく
-        if i == len(unit_spans) - 1:
-            connected_next = False
-        else:
-            next_start = unit_spans[i + 1][1]
-            connected_next = not bool(string[match.end(): next_start].strip())
-        if connected_next:
-            continue
-
-        # connected_unit_spansを処理する
-        unit_string = '('
-        for j, (match, start, end) in enumerate(connected_unit_spans):
-            if j != 0:
-                unit_string += ' + '
-            scalar = units.scalar(match.group('unit'))
-            unit_string += string[start: end] + ' * '
-            if use_decimal:
-                unit_string += 'Decimal(str(' + str(scalar) + ')) / ' \
-                             'Decimal(str(' + str(scale_length) + '))'
-            else:
-                unit_string += str(scalar) + ' / ' + str(scale_length)
-        unit_string += ')'
-
-        replace_start = connected_unit_spans[0][1]
-        replace_end = connected_unit_spans[-1][0].end()
-        replaces.append([replace_start, replace_end, unit_string])
-        connected_unit_spans.clear()
-
-    # 置換。string -> eval_string
-    length = len(string)
-    eval_string = string
-    for start, end, unit_string in replaces:
-        offset = len(eval_string) - length
-        head = eval_string[:start + offset]
-        tail = eval_string[end + offset:]
-        eval_string = head + unit_string + tail
-
-    # eval()
     try:
-        result = eval(eval_string)
-    except Exception:
+        expr = compile_unit_expression(string, unit_system, use_decimal)
+        result = expr.evaluate(scale_length)
+    except (UnitSyntaxError, ArithmeticError, TypeError, ValueError):
         result = None
     if not isinstance(result, (int, float, complex, D, Fraction)):
         result = None
@@ -453,6 +827,15 @@ def unit_to_num(string, unit_system='mixed', scale_length=1, use_decimal=False):
 ###############################################################################
 # float用関数
 ###############################################################################
+_ROUNDING_HALF = {decimal.ROUND_HALF_EVEN, decimal.ROUND_HALF_UP,
+                  decimal.ROUND_HALF_DOWN}
+
+# 10 ** rounding_expでの割り算の誤差を含む相対誤差
+_FLOAT_ROUNDING_TOLERANCE = 8 * 2.0 ** -52
+
+# repr()したfloatを丸めずにDecimalで表す為の精度
+_DECIMAL_EXACT_PREC = 400
+
 def _rounded_float_mantissa(value, rounding_exp=None,
                             rounding=decimal.ROUND_HALF_EVEN):
     """expで指定した指数でvalueを丸め、その数値の仮数部をintで返す。
@@ -475,10 +858,24 @@ def _rounded_float_mantissa(value, rounding_exp=None,
     """
     if rounding_exp is None:
         rounding_exp = 0
+    original = value
     value /= 10 ** rounding_exp
 
     if not rounding:
         rounding = decimal.ROUND_HALF_EVEN
+
+    # 割り算の誤差で丸めの境界を跨ぐ可能性がある場合のみDecimalで求める
+    if rounding in _ROUNDING_HALF:
+        boundary = 0.5
+    else:
+        boundary = 0.0
+    f = abs(value) % 1.0
+    tol = abs(value) * _FLOAT_ROUNDING_TOLERANCE + 1e-300
+    if (abs(f - boundary) <= tol or
+            boundary == 0.0 and abs(f - 1.0) <= tol) and \
+            not math.isinf(value) and not math.isnan(value):
+        return _rounded_decimal_mantissa(original, rounding_exp, rounding)
+
     if rounding == decimal.ROUND_HALF_EVEN:
         val = round(value)
     elif rounding == decimal.ROUND_HALF_UP:
@@ -510,6 +907,16 @@ def _rounded_float_mantissa(value, rounding_exp=None,
     return int(val)
 
 
+def _rounded_decimal_mantissa(value, rounding_exp, rounding):
+    """_rounded_float_mantissa()の境界付近で用いる。floatをrepr()での
+    表記通りにDecimalへ変換してから丸める。0.15 -> Decimal('0.15')
+    :rtype: int
+    """
+    ctx = decimal.Context(prec=_DECIMAL_EXACT_PREC, rounding=rounding)
+    d = ctx.scaleb(Decimal(repr(float(value))), -rounding_exp)
+    return int(d.quantize(Decimal(1), rounding=rounding, context=ctx))
+
+
 def _mantissa_exp_to_str(mantissa, exp, normalize=False):
     """floatを表す仮数部と指数部を文字列に変換する。
     :param mantissa: floatを表す仮数部
@@ -730,6 +1137,16 @@ def _num_to_unit_single(
                         break
                     quot = 0.0
 
+        elif not use_decimal:
+            symbols, thresholds = units.single_thresholds(eps)
+            i = bisect.bisect_right(thresholds, abs(value)) - 1
+            unit_name = symbols[max(i, 0)]
+            scalar = units.float_scalars[unit_name]
+            quot = value / scalar
+            if eps is not None:
+                div, mod = _divmod_eps(value, scalar, eps)
+                if mod == 0:
+                    quot = div
         else:
             last_symbol = list(units.basic_symbols)[-1]
             for name in units.basic_symbols:
@@ -767,11 +1184,17 @@ def _num_to_unit_single(
     return s + unit_name
 
 
+# num_to_unit()の結果
+FORMAT_CACHE_SIZE = 2048
+format_cache = _LRUCache(FORMAT_CACHE_SIZE)
+
+
 def num_to_unit(
         value, unit_system='metric', scale_length=1, use_separate=True,
         start=None, end='mm', verbose=False, rounding_exp=None, rounding=None,
         normalize=False, eps=None, use_decimal=False):
-    """
+    """値を単位付きの文字列に変換する。
+    結果はformat_cacheに保持し、同じ引数なら再利用する。
     :param value: Decimalの引数として有効な値である事
     :type value: int | float | str | tuple | Decimal
     :param unit_system: 'metric' or 'imperial' or Units
@@ -813,9 +1236,34 @@ def num_to_unit(
     :type eps: float | str | tuple | Decimal | None
     """
 
+    if isinstance(unit_system, str):
+        units = _get_units_from_string(unit_system)
+    else:
+        units = unit_system
+    if isinstance(verbose, list):
+        verbose = tuple(verbose)
+    key = (value, type(value), units.key_id, scale_length, type(scale_length),
+           use_separate, start, end, verbose, rounding_exp, rounding,
+           normalize, eps, use_decimal)
+    try:
+        result = format_cache.get(key)
+    except TypeError:  # unhashable
+        key = result = None
+    if result is None:
+        result = _num_to_unit(
+            value, units, scale_length, use_separate, start, end, verbose,
+            rounding_exp, rounding, normalize, eps, use_decimal)
+        if key is not None:
+            format_cache.set(key, result)
+    return result
+
+
+def _num_to_unit(
+        value, units, scale_length, use_separate, start, end, verbose,
+        rounding_exp, rounding, normalize, eps, use_decimal):
     if not use_separate:
         return _num_to_unit_single(
-            value, unit_system, start, scale_length, rounding_exp, rounding,
+            value, units, start, scale_length, rounding_exp, rounding,
             normalize, eps, use_decimal)
 
     if use_decimal:
@@ -827,34 +1275,8 @@ def num_to_unit(
         if eps is not None:
             eps = abs(float(eps))
 
-    if isinstance(unit_system, str):
-        units = _get_units_from_string(unit_system)
-    else:
-        units = unit_system
-    start = units.symbol(start)
-    end = units.symbol(end)
-    if start:
-        if units.is_basic(start):
-            start_basic = start
-        else:
-            start_basic = units.next_basic(start)
-    else:
-        start_basic = None
-    if end:
-        if units.is_basic(end):
-            end_basic = end
-        else:
-            end_basic = units.next_basic(end)
-    else:
-        end_basic = None
-
-    unit_names_clipped = list(units.basic_symbols)
-    if start_basic:
-        i = unit_names_clipped.index(start_basic)
-        unit_names_clipped = unit_names_clipped[i:]
-    if end_basic and end_basic in unit_names_clipped:
-        i = unit_names_clipped.index(end_basic)
-        unit_names_clipped = unit_names_clipped[:i + 1]
+    unit_names_clipped, float_scalars, start_basic, end_basic = \
+        units.separate_plan(start, end)
 
     separated_values = []
 
@@ -877,9 +1299,10 @@ def num_to_unit(
     else:
         val = abs(value)
         for i, name in enumerate(unit_names_clipped):
-            scalar = units.scalar(name)
-            if not use_decimal:
-                scalar = float(scalar)
+            if use_decimal:
+                scalar = units.scalar(name)
+            else:
+                scalar = float_scalars[i]
             div, mod = _divmod_eps(val, scalar, eps)
 
             end_loop = i == len(unit_names_clipped) - 1
@@ -973,6 +1396,25 @@ def test():
 
     def test_unit_to_num():
         eq_(unit_to_num('10m', scale_length=2), 5)
+        eq_(unit_to_num('1m 2cm * 3'), 1.02 * 3)
+        eq_(unit_to_num('(1 + 2)cm (3)mm', use_decimal=True), D('0.033'))
+        eq_(unit_to_num('__import__("os")'), None)
+        eq_(unit_to_num('1m +'), None)
+        errors = []
+        for i in range(2):
+            try:
+                compile_unit_expression('1m + * 2')
+            except UnitSyntaxError as err:
+                eq_(err.position, 5)
+                errors.append(err)
+            else:
+                ok_(False)
+        ok_(errors[0] is not errors[1])
+        eq_(str(errors[0]), str(errors[1]))
+        expression_cache.clear()
+        unit_to_num('1m 2cm')
+        unit_to_num('1m 2cm', scale_length=2)
+        eq_((expression_cache.hits, expression_cache.misses), (1, 1))
         # eq_(unit_to_num('2m 10bu', units={'bu': 2}, scale_length=2), 11)
 
     def test_round_float():
@@ -990,7 +1432,11 @@ def test():
         eq_(_rounded_float_mantissa(-2.5, 0, decimal.ROUND_CEILING), -2)
         eq_(_rounded_float_mantissa(-2.5, 0, decimal.ROUND_FLOOR), -3)
 
-        eq_(_rounded_float_mantissa(-0.16, -1, decimal.ROUND_HALF_EVEN), -2)  # -0.15は誤差が出る
+        eq_(_rounded_float_mantissa(-0.16, -1, decimal.ROUND_HALF_EVEN), -2)
+        # 境界付近はDecimalで求める
+        eq_(_rounded_float_mantissa(-0.15, -1, decimal.ROUND_HALF_EVEN), -2)
+        eq_(_rounded_float_mantissa(2.675, -2, decimal.ROUND_HALF_UP), 268)
+        eq_(_rounded_float_mantissa(-0.0005, -3, decimal.ROUND_HALF_EVEN), 0)
 
     def test_mantissa_exp_to_str():
         eq_(_mantissa_exp_to_str(1234, 2), '123400')
@@ -1042,6 +1488,31 @@ def test():
                         use_separate=False),
             '0m')
 
+    def test_num_to_unit_float():
+        eq_(num_to_unit(1.5, 'metric', use_separate=False), '1.5m')
+        eq_(num_to_unit(0.9999999999999, 'metric', use_separate=False,
+                        eps=1e-10), '1.0m')
+        eq_(num_to_unit(1234.5, 'metric', end='cm', rounding_exp='cm'),
+            '1km 234m 50cm')
+        format_cache.clear()
+        num_to_unit(12.34, 'metric')
+        num_to_unit(12.34, 'metric')
+        eq_((format_cache.hits, format_cache.misses), (1, 1))
+        units = metric_units.copy()
+        units.extend([['bu', 2.0]])
+        units.update()
+        ok_(units.key_id != metric_units.key_id)
+        units[-1:] = []
+        units.update()
+        eq_(units.key_id, metric_units.key_id)
+        # 視点毎にpxの値が変わっても番号の表は大きくならない
+        for i in range(UNITS_KEY_IDS_SIZE * 2):
+            units = metric_units.copy()
+            units.extend([['px', 1.0 + i]])
+            units.update()
+        ok_(len(_units_key_ids) <= UNITS_KEY_IDS_SIZE)
+        ok_(units.key_id != metric_units.key_id)
+
     def test_divmod_eps():
         eq_(_divmod_eps(10.1, 1, 0.05), (divmod(10.1, 1)))
         eq_(_divmod_eps(10.1, 1, 1), (10.0, 0.0))
@@ -1057,6 +1528,7 @@ def test():
     test_rounding_exp_from_string()
     test_unit_to_num()
     test_num_to_unit()
+    test_num_to_unit_float()
     test_divmod_eps()
 
 
@@ -19,6 +19,7 @@
 
 from collections import deque
 import collections
+import heapq
 import itertools
 # import types
 # import builtins
@@ -34,7 +35,8 @@ except:
 import tempfile, os, cProfile, pstats
 
 
-__all__ = ('flatten', 'groupwith', 'xproperty', 'find_brackets',
+__all__ = ('flatten', 'groupwith', 'connected_components',
+           'groups_from_labels', 'xproperty', 'find_brackets',
            'generate_signature_bind_function',
            'generate_signature_bind_string',
            'generate_function',
@@ -172,6 +174,69 @@ def groupwith(iterable, key=None, data=None, order=None):
     return [[seq[i] for i in group] for group in indices]
 
 
+def connected_components(num, pairs):
+    """Union-Findで連結成分を求め、要素毎のラベルを返す。
+    groupwith()と違い総当たりの比較を行わないので要素数と組の数に対して線形。
+    ラベルは各成分の最小インデックスの昇順に0から振られる。
+    :param num: 要素数
+    :type num: int
+    :param pairs: 接続している二つのインデックスの組。
+        e.g. [(0, 1), (3, 2), ...]
+    :type pairs: collections.abc.Iterable
+    :return: 長さnumのラベルのリスト
+    :rtype: list[int]
+
+    connected_components(5, [(0, 3), (4, 1), (3, 1)])
+    >> [0, 0, 1, 0, 0]
+    """
+    parent = list(range(num))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]  # path halving
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        ri = find(i)
+        rj = find(j)
+        if ri != rj:
+            # 根は常に成分内の最小インデックスとする
+            if ri < rj:
+                parent[rj] = ri
+            else:
+                parent[ri] = rj
+
+    labels = [0] * num
+    roots = {}
+    for i in range(num):
+        root = find(i)
+        if root not in roots:
+            roots[root] = len(roots)
+        labels[i] = roots[root]
+    return labels
+
+
+def groups_from_labels(labels):
+    """connected_components()等で得たラベルからインデックスの二次元リストを
+    生成する。負のラベルは無視する。
+    :type labels: collections.abc.Iterable
+    :return: ラベル順に並んだインデックスの二次元リスト
+    :rtype: list[list[int]]
+
+    groups_from_labels([0, 0, 1, -1, 0])
+    >> [[0, 1, 4], [2]]
+    """
+    groups = {}
+    for i, label in enumerate(labels):
+        if label >= 0:
+            if label in groups:
+                groups[label].append(i)
+            else:
+                groups[label] = [i]
+    return [groups[label] for label in sorted(groups)]
+
+
 def find_brackets(text, brackets=(('(', ')'), ('[', ']'), ('{', '}')),
                   quotations=("'''", '"""', "'", '"'),
                   old_style=False):
@@ -736,51 +801,98 @@ def profile(column='time', list=5):
     return _profile
 
 
-def _solve_dependency(element, depend_on, returned, cyclic_check=None):
-    if element not in returned:
-        if cyclic_check is None:
-            cyclic_check = []
-        cyclic_check.append(element)
-        for elem in depend_on(element):
-            if elem in cyclic_check:
-                # raise ValueError('cyclic! {}'.format(element))
-                msg = 'Dependency cycle detected: {}'.format(element)
-                warnings.warn(msg)
-                cyclic_check.pop()
-                yield element
-                return
-            for e in _solve_dependency(elem, depend_on, returned,
-                                       cyclic_check):
-                if e not in returned:
-                    yield e
-        cyclic_check.pop()
-        yield element
+def _cycle_members(remaining, depends, dependents):
+    """トポロジカルソートで残った要素から、依存される側を持たない物を
+    繰り返し取り除き、循環に含まれる要素を求める。
+    :type remaining: set
+    :rtype: set
+    """
+    remaining = set(remaining)
+    counts = {i: sum(1 for j in dependents[i] if j in remaining)
+              for i in remaining}
+    queue = deque(i for i, n in counts.items() if n == 0)
+    while queue:
+        i = queue.popleft()
+        remaining.discard(i)
+        for j in depends[i]:
+            if j in remaining:
+                counts[j] -= 1
+                if counts[j] == 0:
+                    queue.append(j)
+    return remaining
 
 
 def sorted_dependency(elements, depend_on, all=False):
-    """依存関係を解決した並び順で返す
+    """依存関係を解決した並び順で返す。
+    Kahnのアルゴリズムを用いる。依存関係に無い要素同士はelementsでの順番
+    (elementsに含まれない物は見つかった順)を保つ。
+    循環が有った場合はその要素を警告に含め、最も前の要素から順に
+    依存関係を無視して並べる。
     :param elements: シーケンス
     :type elements: abc.Iterable
     :param depend_on: 引数を１つ取り、それが依存するオブジェクトのリストを
-                      返す関数。返り値の最初の要素から再帰的に探索する。
+                      返す関数。
     :type depend_on: types.FunctionType
     :param all: 依存関係にあるがelementsに含まれないものも返り値に含める。
     :return: elementsを並び替えたリスト
     :rtype: list
     """
-    elements = tuple(elements)
-    returned = set()
-    result = []
-    for element in elements:
-        for elem in _solve_dependency(element, depend_on, returned):
-            returned.add(elem)
-            result.append(elem)
-
-    if not all:
-        elems = set(elements)
-        return [elem for elem in result if elem in elems]
+    nodes = []
+    indices = {}
+    for elem in elements:
+        if elem not in indices:
+            indices[elem] = len(nodes)
+            nodes.append(elem)
+    num_elements = len(nodes)
+
+    # 依存先を幅優先で辿り、番号を振る
+    depends = []
+    i = 0
+    while i < len(nodes):
+        deps = []
+        for elem in depend_on(nodes[i]):
+            if elem not in indices:
+                indices[elem] = len(nodes)
+                nodes.append(elem)
+            j = indices[elem]
+            if j not in deps:
+                deps.append(j)
+        depends.append(deps)
+        i += 1
+
+    num = len(nodes)
+    dependents = [[] for _ in range(num)]
+    counts = [len(deps) for deps in depends]
+    for i, deps in enumerate(depends):
+        for j in deps:
+            dependents[j].append(i)
+
+    heap = [i for i in range(num) if counts[i] == 0]
+    heapq.heapify(heap)
+    placed = [False] * num
+    order = []
+    while len(order) < num:
+        if not heap:
+            remaining = {i for i in range(num) if not placed[i]}
+            cycle = _cycle_members(remaining, depends, dependents)
+            msg = 'Dependency cycle detected: {}'.format(
+                [nodes[i] for i in sorted(cycle)])
+            warnings.warn(msg)
+            heap.append(min(cycle))
+        i = heapq.heappop(heap)
+        if placed[i]:
+            continue
+        placed[i] = True
+        order.append(i)
+        for j in dependents[i]:
+            counts[j] -= 1
+            if counts[j] == 0 and not placed[j]:
+                heapq.heappush(heap, j)
+
+    if all:
+        return [nodes[i] for i in order]
     else:
-        return result
+        return [nodes[i] for i in order if i < num_elements]
 
 
 def mro(obj, function=None, _cyclic_check=None):
@@ -961,7 +1073,7 @@ def test_solve_dependence():
        c   d
        |   |
        e   h
-    :return: a, b, f, g, d, h, c, e
+    :return: a, b, c, e, f, g, d, h
     """
     class Node:
         def __init__(self, name):
@@ -988,15 +1100,24 @@ def test_solve_dependence():
     f.depend.append(a)
     h.depend.append(d)
 
-    # cyclic test
-    # g.depend.append(h)
-
     elements = [h, a, b, c, d, e, f, g]
 
     result = sorted_dependency(elements, lambda node: node.depend)
-    print(result)
-    # [Node('a'), Node('b'), Node('f'), Node('g'), Node('d'), Node('h'),
-    #  Node('c'), Node('e')]
+    assert [str(node) for node in result] == list('abcefgdh')
+    result = sorted_dependency([h, e], lambda node: node.depend)
+    assert [str(node) for node in result] == list('eh')
+    result = sorted_dependency([h, e], lambda node: node.depend, all=True)
+    assert [str(node) for node in result] == list('gabcefdh')
+
+    # cyclic test
+    g.depend.append(h)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        result = sorted_dependency(elements, lambda node: node.depend)
+    assert len(caught) == 1
+    msg = str(caught[0].message)
+    assert all(name in msg for name in 'dgh') and 'Node(\'a\')' not in msg
+    assert [str(node) for node in result] == list('abcefhgd')
 
 
 
@@ -1029,6 +1150,21 @@ def test_groupwith():
     eq_(groupwith(ls, func, data), [[0, 1, 2, 3]])
 
 
+def test_connected_components():
+    eq_(connected_components(0, []), [])
+    eq_(connected_components(5, [(0, 3), (4, 1), (3, 1)]), [0, 0, 1, 0, 0])
+    eq_(connected_components(4, [(3, 2), (2, 3), (1, 1)]), [0, 1, 2, 2])
+    eq_(groups_from_labels([0, 0, 1, -1, 0]), [[0, 1, 4], [2]])
+
+    # groupwith()と結果が一致する
+    data = {0: [2], 1: [4], 2: [0, 5], 3: [], 4: [1], 5: [2]}
+    def func(a, b, data):
+        return a in data[b] or b in data[a]
+    pairs = [(i, j) for i, ls in data.items() for j in ls]
+    eq_(groups_from_labels(connected_components(len(data), pairs)),
+        groupwith(range(len(data)), func, data))
+
+
 def test_generate_signature_bind_string():
     import inspect
     def hoge(a, b=100, *c, d=0, **e):
@@ -1050,6 +1186,7 @@ def test_exec_local():
 def test():
     test_solve_dependence()
     # test_groupwith()
+    test_connected_components()
     # test_generate_signature_bind_string()
     # test_exec_local()
     mro_test()
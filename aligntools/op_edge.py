@@ -31,6 +31,7 @@ import bgl
 import mathutils
 from mathutils import Matrix, Vector
 from mathutils import geometry as geom
+import numpy as np
 
 from . import utils
 from . import localutils
@@ -51,6 +52,7 @@ from .va import unitsystem
 from .va import manipulatormatrix
 from .va import vaview3d as vav
 from .va import vabmesh as vabm
+from .va import segments as vaseg
 from .enums import *
 from .op_template import *
 from . import custom_icons
@@ -248,6 +250,12 @@ class OperatorEdgeIntersect(OperatorTemplate, bpy.types.Operator):
         name='Merge',
         default=False
     )
+    all_edges = bpy.props.BoolProperty(
+        name='All Selected Edges',
+        description='Edgeの組が二つでない場合、選択Edge同士の交点を全て求める'
+                    '(Add Verts, Add Verts & Edgesのみ)',
+        default=False
+    )
 
     def execute(self, context):
         actob = context.active_object
@@ -387,10 +395,102 @@ class OperatorEdgeIntersect(OperatorTemplate, bpy.types.Operator):
                         if eve6:
                             eve6.select = True
 
+        elif self.all_edges and self.mode in ('add', 'subdivide'):
+            self.intersect_edges(context, bm, mat)
+
         bm.normal_update()
         bmesh.update_edit_mesh(actob.data, True, True)
         return {'FINISHED'}
 
+    def intersect_edges(self, context, bm, mat):
+        """選択辺同士の交点で辺を分割、若しくは頂点を追加する。
+        交点はvaseg.intersect_segments()で纏めて求め、BMeshへは最後に
+        一度だけ反映する。二組の場合と異なり直線ではなく線分同士の交点で、
+        3Dでは最近点間の距離がEPS以下の物に限る。
+        """
+        edges = [eed for eed in bm.edges if eed.select and not eed.hide]
+        if len(edges) < 2:
+            return
+        verts = list({eve for eed in edges for eve in eed.verts})
+        vert_indices = {eve: i for i, eve in enumerate(verts)}
+        edge_verts = np.array([[vert_indices[eve] for eve in eed.verts]
+                               for eed in edges])
+        coords = np.array([eve.co for eve in verts])  # local
+        use_view = bool(self.use_view and context.region_data)
+        if use_view:
+            m = np.array(context.region_data.view_matrix * mat)
+            cos = (np.dot(coords, m[:3, :3].T) + m[:3, 3])[:, :2]
+        else:
+            cos = coords
+        result = vaseg.intersect_segments(
+            cos[edge_verts[:, 0]], cos[edge_verts[:, 1]], EPS, edge_verts)
+        if not len(result):
+            return
+
+        # 視点座標系への変換はアフィン変換なので、交点の位置はそのまま使える
+        starts = coords[edge_verts[:, 0]]
+        vecs = coords[edge_verts[:, 1]] - starts
+        lengths = np.linalg.norm(vecs, axis=1)
+        i, j = result.pairs[:, 0], result.pairs[:, 1]
+        centers = (starts[i] + vecs[i] * result.factors1[:, None] +
+                   starts[j] + vecs[j] * result.factors2[:, None]) / 2
+        merge = self.merge
+        isect_verts = [[None, None] for _ in range(len(result))]
+
+        for ei, items in sorted(result.segment_factors(len(edges)).items()):
+            eed = edges[ei]
+            eve1, eve2 = eed.verts
+            prev_vert = eve1
+            prev_f = 0.0
+            for k, f in items:
+                side = 0 if result.pairs[k, 0] == ei else 1
+                co = Vector(starts[ei] + vecs[ei] * f)
+                if self.mode == 'add':
+                    if merge:
+                        if side == 1:
+                            continue
+                        co = Vector(centers[k])
+                    eve = bm.verts.new(co)
+                elif f * lengths[ei] <= EPS:
+                    eve = eve1
+                elif (1.0 - f) * lengths[ei] <= EPS:
+                    eve = eve2
+                elif (f - prev_f) * lengths[ei] <= EPS:
+                    eve = prev_vert
+                else:
+                    fac = (f - prev_f) / (1.0 - prev_f)
+                    new_eed, eve = bmesh.utils.edge_split(eed, prev_vert, fac)
+                    eve.co = co
+                    # 残りの分割はeve2側の辺に対して行う
+                    if eve2 in new_eed.verts:
+                        eed = new_eed
+                    prev_vert = eve
+                    prev_f = f
+                eve.select = True
+                isect_verts[k][side] = eve
+
+        if self.mode != 'subdivide' or not merge:
+            return
+
+        # 交点毎に二辺上の頂点を結合する
+        targetmap = {}
+
+        def find(eve):
+            while eve in targetmap:
+                eve = targetmap[eve]
+            return eve
+
+        for k, (eve_a, eve_b) in enumerate(isect_verts):
+            eve_a = find(eve_a)
+            eve_b = find(eve_b)
+            if eve_a != eve_b:
+                targetmap[eve_b] = eve_a
+                if use_view:
+                    eve_a.co = Vector(centers[k])
+        targetmap = {eve: find(eve) for eve in targetmap}
+        if targetmap:
+            bmesh.ops.weld_verts(bm, targetmap=targetmap)
+
     def check(self, context):
         return True
 
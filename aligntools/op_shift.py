@@ -24,13 +24,15 @@ import bpy
 from mathutils import Matrix, Vector
 import mathutils.geometry as geom
 import bmesh
+import numpy as np
 
 from .va import vaprops as vap
 from .va import vamath as vam
 from .va import vabmesh as vabm
 from .va import vaoperator as vaop
 from .va import modalmouse
-from .va.looptris import LoopTris
+from .va.looptris import LoopTris, vert_tangents_array
+from .va.topology import CSR, Topology
 
 from . import tooldata
 
@@ -41,6 +43,17 @@ memoize = tool_data.memoize
 EPS = 1e-5
 
 
+def _normalized(vecs):
+    """(N, 3)の配列を正規化する。長さ0のものは(0, 0, 0)のまま。
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    length = np.sqrt((vecs * vecs).sum(axis=1))
+    result = np.zeros_like(vecs)
+    nonzero = length > 0.0
+    result[nonzero] = vecs[nonzero] / length[nonzero, np.newaxis]
+    return result, nonzero
+
+
 ###############################################################################
 # BMesh: Shift (Shift Outline & Solidify)
 ###############################################################################
@@ -225,6 +238,31 @@ class OperatorShift(vaop.OperatorTemplate, bpy.types.Operator):
                 flag = self.BORDER
             vflags[eve] = flag
 
+        # calc_vert_tangents()で用いる配列。インデックスはindex_update()済み
+        loop_tris.topology = Topology(bm)
+        loop_tris.coords = np.array([eve.co[:] for eve in bm.verts],
+                                    dtype=float).reshape(-1, 3)
+        loop_tris.vflag_array = np.array([vflags[eve] for eve in bm.verts],
+                                         dtype=int)
+        loop_tris.eflag_array = np.array([eflags[eed] for eed in bm.edges],
+                                         dtype=int)
+        loop_tris.edge_select = np.array([eed.select for eed in bm.edges],
+                                         dtype=bool)
+        loop_tris.edge_hide = np.array([eed.hide for eed in bm.edges],
+                                       dtype=bool)
+        loop_tris.face_select = np.array([efa.select for efa in bm.faces],
+                                         dtype=bool)
+        loop_tris.face_hide = np.array([efa.hide for efa in bm.faces],
+                                       dtype=bool)
+        loop_tris.tri_verts = np.array(
+            [[loop.vert.index for loop in tri] for tri in loop_tris],
+            dtype=int).reshape(-1, 3)
+        loop_tris.tri_faces = np.array(
+            [tri[0].face.index for tri in loop_tris], dtype=int)
+        loop_tris.vert_tris = CSR.from_pairs(
+            len(bm.verts), loop_tris.tri_verts.ravel(),
+            np.repeat(np.arange(len(loop_tris)), 3))
+
         # --- Solidify ---
         # 頂点のhideとtriの面積により、法線計算に使えるか否かのフラグを付ける
         for eve in bm.verts:
@@ -255,6 +293,8 @@ class OperatorShift(vaop.OperatorTemplate, bpy.types.Operator):
 
     def calc_vert_tangents(self):
         """self.loop_tris.bmのBORDERフラグが立っている頂点のtangentを計算。
+        init()で作成した配列を用いてまとめて計算し、交点が求まらなかった
+        頂点だけcalc_vert_tangent()で個別に計算する。
         :return: キーがBMVert, 値が[tangent, tangent(min), tangent(max)]の
             辞書を返す。tangentはself.align_edgesが偽の場合に、tangent(min)と
             tangent(max)はself.align_edgesが真の場合に利用する。
@@ -265,73 +305,164 @@ class OperatorShift(vaop.OperatorTemplate, bpy.types.Operator):
         BORDER = self.BORDER
 
         loop_tris = self.loop_tris
-        vert_dict = loop_tris.vert_dict()
-
+        topo = loop_tris.topology
+        coords = loop_tris.coords
+        use_selected = self.tangent_calculation in ('selected', 'individual')
+
+        verts = np.flatnonzero(loop_tris.vflag_array & BORDER)
+        if len(verts) == 0:
+            return {}
+        query = np.full(topo.num_verts, -1, dtype=int)
+        query[verts] = np.arange(len(verts))
+
+        # 頂点に接続する辺。rowsは昇順
+        vert_edges = topo.vert_edges
+        rows = query[vert_edges.rows]
+        edges = vert_edges.indices
+        valid = rows != -1
+        rows = rows[valid]
+        edges = edges[valid]
+        edge_verts = topo.edge_verts[edges]
+        others = edge_verts[:, 0] + edge_verts[:, 1] - verts[rows]
+        eflags = loop_tris.eflag_array[edges]
+
+        # eveに接続する二頂点(vert_next, vert_prev)。BORDERの辺は必ず二本
+        is_border = (eflags & BORDER) != 0
+        verts_next, verts_prev = others[is_border].reshape(-1, 2).T
+
+        # tangent (used when self.align_edges is False)
+        vert_tris = loop_tris.vert_tris
+        tri_rows = query[vert_tris.rows]
+        tris = vert_tris.indices
+        faces = loop_tris.tri_faces[tris]
+        valid = ((tri_rows != -1) & ~loop_tris.face_hide[faces] &
+                 (loop_tris.face_select[faces] == use_selected))
+        tangents, found = vert_tangents_array(
+            coords, verts, verts_prev, verts_next,
+            tri_rows[valid], tris[valid], loop_tris.tri_verts,
+            LoopTris.ANGLE_THRESHOLD)
+
+        # tangent_min, tangent_max (used when self.align_edges is True)
+        # 条件を満たす辺が一本だけの頂点が対象
+        valid = (~loop_tris.edge_hide[edges] &
+                 ((eflags & (WIRE | BORDER)) == 0) &
+                 (loop_tris.edge_select[edges] == use_selected))
+        counts = np.bincount(rows[valid], minlength=len(verts))
+        valid &= counts[rows] == 1
+        vec = np.zeros((len(verts), 3))
+        vec[rows[valid]] = (coords[others[valid]] -
+                            coords[verts[rows[valid]]])
+        vec, single = _normalized(vec)
+        min_max = []  # [(vectors, valid), ...]
+        for verts_side in (verts_prev, verts_next):
+            vec_side, nonzero = _normalized(coords[verts_side] -
+                                            coords[verts])
+            cross = np.cross(vec_side, vec)
+            f = np.sqrt((cross * cross).sum(axis=1))
+            ok = single & nonzero & (f > EPS)
+            v = np.zeros_like(vec)
+            v[ok] = vec[ok] / f[ok, np.newaxis]
+            min_max.append((v, ok))
+        (t1, ok1), (t2, ok2) = min_max
+        # 長さでソート。片方しか無い場合はそれを両方に使う
+        swap = ok1 & ok2 & ((t2 * t2).sum(axis=1) < (t1 * t1).sum(axis=1))
+        tmp = t1[swap]
+        t1[swap] = t2[swap]
+        t2[swap] = tmp
+        t1[~ok1 & ok2] = t2[~ok1 & ok2]
+        t2[ok1 & ~ok2] = t1[ok1 & ~ok2]
+        has_min_max = ok1 | ok2
+
+        bm_verts = loop_tris.bm.verts
+        bm_verts.ensure_lookup_table()
+        vert_dict = None
         vert_tangents = {}  # eve: Vector
-
-        for eve in loop_tris.bm.verts:
-            if not loop_tris.vflags[eve] & BORDER:
+        for i, index in enumerate(verts.tolist()):
+            eve = bm_verts[index]
+            if not found[i]:
+                # 縮退等で交点が求まらない頂点は個別に計算する
+                if vert_dict is None:
+                    vert_dict = loop_tris.vert_dict()
+                vert_tangents[eve] = self.calc_vert_tangent(eve, vert_dict)
                 continue
-
-            # eveに接続する二頂点(vert_next, vert_prev)を求める
-            eve_next, eve_prev = [eed.other_vert(eve) for eed in eve.link_edges
-                                  if loop_tris.eflags[eed] & BORDER]
-
-            # tangent (used when self.align_edges is False)
-            tris = []
-            for tri in vert_dict[eve]:
-                efa = tri[0].face
-                if not efa.hide:
-                    # if not self.use_outside_calculation and efa.select or \
-                    #    self.use_outside_calculation and not efa.select:
-                    #     tris.append(tri)
-                    if self.tangent_calculation in ('selected', 'individual') and efa.select or \
-                       self.tangent_calculation == 'deselected' and not efa.select:
-                        tris.append(tri)
-            tangent = LoopTris.vert_tangent(
-                eve, eve_prev, eve_next, tris, fallback=Vector((0, 0, 0)))
-
-            # tangent_min, tangent_max (used when self.align_edges is True)
-            edges = []
-            for eed in eve.link_edges:
-                if eed.hide or loop_tris.eflags[eed] & (WIRE | BORDER):
-                    continue
-                # if not self.use_outside_calculation and eed.select or \
-                #    self.use_outside_calculation and not eed.select:
-                #     edges.append(eed)
-                if self.tangent_calculation in ('selected', 'individual') and eed.select or \
-                   self.tangent_calculation == 'deselected' and not eed.select:
-                    edges.append(eed)
-            tangent_min_max = []
-            if len(edges) == 1:
-                eed = edges[0]
-                vec = eed.other_vert(eve).co - eve.co
-                if vec.length > 0:
-                    vec.normalize()
-                    vec1 = eve_prev.co - eve.co
-                    if vec1.length > 0:
-                        vec1.normalize()
-                        f1 = vec1.cross(vec).length
-                        if f1 > EPS:
-                            tangent_min_max.append(vec / f1)
-                    vec2 = eve_next.co - eve.co
-                    if vec2.length > 0:
-                        vec2.normalize()
-                        f2 = vec2.cross(vec).length
-                        if f2 > EPS:
-                            tangent_min_max.append(vec / f2)
-            tangent_min_max.sort(key=lambda v: v.length)
-
-            if len(tangent_min_max) == 0:
-                tangents = [tangent] * 3
-            elif len(tangent_min_max) == 1:
-                tangents = [tangent] + tangent_min_max * 2
+            tangent = Vector(tangents[i])
+            if has_min_max[i]:
+                vert_tangents[eve] = [tangent, Vector(t1[i]), Vector(t2[i])]
             else:
-                tangents = [tangent] + tangent_min_max
-            vert_tangents[eve] = tangents
+                vert_tangents[eve] = [tangent] * 3
 
         return vert_tangents
 
+    def calc_vert_tangent(self, eve, vert_dict):
+        """calc_vert_tangents()の一頂点分。
+        :type eve: BMVert
+        :param vert_dict: self.loop_tris.vert_dict()
+        :type vert_dict: dict[BMVert, list[LoopTri]]
+        :return: [tangent, tangent(min), tangent(max)]
+        :rtype: list[Vector]
+        """
+        WIRE = self.WIRE
+        BORDER = self.BORDER
+
+        loop_tris = self.loop_tris
+
+        # eveに接続する二頂点(vert_next, vert_prev)を求める
+        eve_next, eve_prev = [eed.other_vert(eve) for eed in eve.link_edges
+                              if loop_tris.eflags[eed] & BORDER]
+
+        # tangent (used when self.align_edges is False)
+        tris = []
+        for tri in vert_dict[eve]:
+            efa = tri[0].face
+            if not efa.hide:
+                # if not self.use_outside_calculation and efa.select or \
+                #    self.use_outside_calculation and not efa.select:
+                #     tris.append(tri)
+                if self.tangent_calculation in ('selected', 'individual') and efa.select or \
+                   self.tangent_calculation == 'deselected' and not efa.select:
+                    tris.append(tri)
+        tangent = LoopTris.vert_tangent(
+            eve, eve_prev, eve_next, tris, fallback=Vector((0, 0, 0)))
+
+        # tangent_min, tangent_max (used when self.align_edges is True)
+        edges = []
+        for eed in eve.link_edges:
+            if eed.hide or loop_tris.eflags[eed] & (WIRE | BORDER):
+                continue
+            # if not self.use_outside_calculation and eed.select or \
+            #    self.use_outside_calculation and not eed.select:
+            #     edges.append(eed)
+            if self.tangent_calculation in ('selected', 'individual') and eed.select or \
+               self.tangent_calculation == 'deselected' and not eed.select:
+                edges.append(eed)
+        tangent_min_max = []
+        if len(edges) == 1:
+            eed = edges[0]
+            vec = eed.other_vert(eve).co - eve.co
+            if vec.length > 0:
+                vec.normalize()
+                vec1 = eve_prev.co - eve.co
+                if vec1.length > 0:
+                    vec1.normalize()
+                    f1 = vec1.cross(vec).length
+                    if f1 > EPS:
+                        tangent_min_max.append(vec / f1)
+                vec2 = eve_next.co - eve.co
+                if vec2.length > 0:
+                    vec2.normalize()
+                    f2 = vec2.cross(vec).length
+                    if f2 > EPS:
+                        tangent_min_max.append(vec / f2)
+        tangent_min_max.sort(key=lambda v: v.length)
+
+        if len(tangent_min_max) == 0:
+            tangents = [tangent] * 3
+        elif len(tangent_min_max) == 1:
+            tangents = [tangent] + tangent_min_max * 2
+        else:
+            tangents = [tangent] + tangent_min_max
+        return tangents
+
     def calc_vert_tangents_wire(self, obmat, viewmat):
         """self.loop_tris.bmのWIREフラグが立っている頂点のtangentを計算。
         """
@@ -20,11 +20,10 @@
 import math
 import collections
 from collections import defaultdict
-from functools import reduce
 from itertools import chain
 
-import bpy
 import bmesh
+import numpy as np
 import mathutils
 from mathutils import Vector
 from mathutils import geometry as geom
@@ -32,6 +31,7 @@ from mathutils import geometry as geom
 from ..localutils.memoize import Memoize
 
 from . import vamath as vam
+from .topology import CSR
 
 
 class _Void:
@@ -180,74 +180,22 @@ class LoopTris(list):
             return
 
         if isinstance(bmesh_or_looptris, bmesh.types.BMesh):
+            # 一時的なMeshを作らずにBMeshのloopから直接三角形分割する
             bm = bmesh_or_looptris
-            vert_indices = [v.index for v in bm.verts]
-            face_indices = [f.index for f in bm.faces]
-            self.index_update(bm, verts=True, edges=False, faces=True,
-                              loops=False)
-
-            # 頂点と面のインデックスからLoopを求める辞書
-            vi_fi_to_loop = {}
-            for face in bm.faces:
-                for loop in face.loops:
-                    vi_fi_to_loop[(loop.vert.index, face.index)] = loop
-
-            # bmeshからmesh生成後、tessfaceを計算
-            mesh = bpy.data.meshes.new("tmp")
-            bm.to_mesh(mesh)
-            for polygon in mesh.polygons:
-                polygon.select = False
-            mesh.calc_tessface()  # Cubeを分割して8万ポリにしても0.003s
-
-            polygons = tuple(mesh.polygons)
-
-            # 頂点インデックスから面インデックスを参照する辞書
-            vi_polys = defaultdict(set)
-            for i, polygon in enumerate(polygons):
-                for vi in polygon.vertices:
-                    vi_polys[vi].add(i)
-
-            for index, tessface in enumerate(mesh.tessfaces):
-                # ３つの頂点を共有するpolyを求める
-                seq = (vi_polys[i] for i in tessface.vertices)
-                poly_indices = reduce(lambda a, b: a & b, seq)
-
-                if len(poly_indices) == 1:
-                    poly_index = poly_indices.pop()
-                else:
-                    # tessfaceがどのpolyに属するか求める
-                    for poly_index in poly_indices:
-                        polygons[poly_index].select = True
-                        mesh.calc_tessface()
-                        polygons[poly_index].select = False
-                        if mesh.tessfaces[index].select:
-                            break
-                loops = []
-                for vert_index in tessface.vertices:
-                    loop = vi_fi_to_loop.get((vert_index, poly_index))
-                    if loop:
-                        loops.append(loop)
-                    else:
-                        print('Error')  # 原因不明
-                # NOTE: vertices_rawの長さはは必ず4。末尾が0ならverticesの
-                # 長さは3となる。
-                normal = tessface.normal
-                area = tessface.area
-                if len(loops) == 3:
-                    self.append(LoopTri(loops, normal, area))  # sort不要
-                elif len(loops) == 4:
-                    t1, t2 = self.tessellate(loops)
-                    self.append(LoopTri([loops[i] for i in t1]))
-                    self.append(LoopTri([loops[i] for i in t2]))
-
-            # indexの復帰
-            for v, i in zip(bm.verts, vert_indices):
-                v.index = i
-            for f, i in zip(bm.faces, face_indices):
-                f.index = i
-
-            # meshを削除
-            bpy.data.meshes.remove(mesh)
+            tris = []
+            for face, looptris in self._tessellate_bmesh(bm):
+                if len(looptris) == 2 and len(face.loops) == 4:
+                    # 四角形はtessellate()の分割方法に合わせる
+                    loops = face.loops
+                    looptris = [[loops[i] for i in tri]
+                                for tri in self.tessellate(loops)]
+                tris.extend(looptris)
+            coords = np.array([[loop.vert.co[:] for loop in tri]
+                               for tri in tris], dtype=float).reshape(-1, 3, 3)
+            normals, areas = self.calc_normals_areas(coords)
+            for tri, normal, area in zip(tris, normals.tolist(),
+                                         areas.tolist()):
+                self.append(LoopTri(tri, normal, area))  # sort不要
 
         else:
             looptris = bmesh_or_looptris
@@ -272,6 +220,41 @@ class LoopTris(list):
                                  for tri in tri_indices])
         return cls(triloop_list)
 
+    @staticmethod
+    def _tessellate_bmesh(bm):
+        """BMesh.calc_tessellation()の結果を面毎に纏めたジェネレータ。
+        calc_tessellation()は面の順に連続して三角形を返す。
+        :rtype: collections.abc.Iterator[(BMFace, list[(BMLoop, BMLoop, BMLoop)])]
+        """
+        face = None
+        looptris = []
+        for tri in bm.calc_tessellation():
+            if tri[0].face != face:
+                if looptris:
+                    yield face, looptris
+                face = tri[0].face
+                looptris = []
+            looptris.append(tri)
+        if looptris:
+            yield face, looptris
+
+    @staticmethod
+    def calc_normals_areas(coords):
+        """三角形の法線と面積をまとめて計算する。
+        geom.normal()と同様に、面積が0なら法線は(0, 0, 0)となる。
+        :param coords: (N, 3, 3)の配列
+        :type coords: numpy.ndarray
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3, 3)
+        cross = np.cross(coords[:, 1] - coords[:, 0],
+                         coords[:, 2] - coords[:, 0])
+        length = np.sqrt((cross * cross).sum(axis=1))
+        normals = np.zeros_like(cross)
+        valid = length > 0.0
+        normals[valid] = cross[valid] / length[valid, np.newaxis]
+        return normals, length / 2
+
     # Tessellate Polyline -----------------------------------------------------
     @classmethod
     def tessellate(cls, polyline, correct=False):
@@ -655,19 +638,29 @@ class LoopTris(list):
 
     def loop_tangents(self, fallback=Vector((0, 0, 0))):
         """全loopのtangentを計算してその辞書を返す。
+        LoopTriArraysを用いてまとめて計算する。
         :type fallback: Vector
         :rtype: dict[BMLoop, list[Vector | object]]
         """
-        loop_dict = self.loop_dict()
+        arrays = self.arrays()
+        vecs, found = arrays.loop_tangents(self.ANGLE_THRESHOLD)
         tangents = {}
-        for loop in self.loops:
-            vert = loop.vert
-            vert_prev = loop.link_loop_prev.vert
-            vert_next = loop.link_loop_next.vert
-            tangents[loop] = self.vert_tangent(vert, vert_prev, vert_next,
-                                               loop_dict[loop], fallback)
+        for loop, vec, f in zip(arrays.loops, vecs.tolist(), found.tolist()):
+            if f:
+                tangents[loop] = Vector(vec)
+            elif isinstance(fallback, Vector):
+                tangents[loop] = fallback.copy()
+            else:
+                tangents[loop] = fallback
         return tangents
 
+    @memoize()
+    def arrays(self):
+        """配列表現を返す。
+        :rtype: LoopTriArrays
+        """
+        return LoopTriArrays(self)
+
     # 各キーからLoopTriを参照する辞書 -----------------------------------------
     @memoize()
     def vert_dict(self):
@@ -788,3 +781,226 @@ class LoopTris(list):
             ((loop for loop in tri) for tri in self))))
         ls.sort(key=lambda l: l.index)
         return ls
+
+
+#==============================================================================
+# LoopTriArrays
+#==============================================================================
+def vert_tangents_array(coords, verts, verts_prev, verts_next,
+                        rows, tri_indices, tri_verts,
+                        angle_threshold=LoopTris.ANGLE_THRESHOLD):
+    """LoopTris.vert_tangent()を配列でまとめて計算する。
+    i番目の頂点verts[i]に対して、rows == iとなるtri_indicesの三角形を
+    その並び順で調べ、最初に見つかった交点を用いる。
+    :param coords: (V, 3) 頂点座標
+    :param verts: (Q,) 計算する頂点のインデックス
+    :param verts_prev: (Q,)
+    :param verts_next: (Q,)
+    :param rows: (K,) verts側のインデックス。昇順であること。
+    :param tri_indices: (K,) rowsに対応する三角形のインデックス
+    :param tri_verts: (T, 3) 三角形の頂点インデックス
+    :return: (tangents, found)。tangentsは(Q, 3)の配列で、foundが偽のものは
+        (0, 0, 0)となる。vert_tangent()がfallbackを返す場合にfoundは偽になる。
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    coords = np.asarray(coords, dtype=float)
+    verts = np.asarray(verts, dtype=int)
+    rows = np.asarray(rows, dtype=int)
+    tri_indices = np.asarray(tri_indices, dtype=int)
+    tri_verts = np.asarray(tri_verts, dtype=int).reshape(-1, 3)
+    num = len(verts)
+    tangents = np.zeros((num, 3))
+    found = np.zeros(num, dtype=bool)
+    if num == 0:
+        return tangents, found
+
+    def normalized(vecs):
+        length = np.sqrt((vecs * vecs).sum(axis=-1))
+        result = np.zeros_like(vecs)
+        valid = length > 0.0
+        result[valid] = vecs[valid] / length[valid, np.newaxis]
+        return result, valid
+
+    co = coords[verts]
+    v_prev, valid_prev = normalized(coords[verts_prev] - co)
+    v_next, valid_next = normalized(coords[verts_next] - co)
+    valid = valid_prev & valid_next
+
+    # 両ベクトルの向きが同じ
+    same = valid & np.all(v_prev == v_next, axis=1)
+    tangents[same] = v_next[same]
+    found[same] = True
+
+    no, _ = normalized(v_next - v_prev)
+
+    # 各(頂点, 三角形)の組で、頂点の対辺と平面の交点を求める
+    use = valid[rows] & ~same[rows]
+    rows = rows[use]
+    tri_indices = tri_indices[use]
+    tv = tri_verts[tri_indices]
+    head = np.argmax(tv == verts[rows, np.newaxis], axis=1)
+    k = np.arange(len(rows))
+    p1 = coords[tv[k, (head + 1) % 3]]
+    p2 = coords[tv[k, (head + 2) % 3]]
+    c = co[rows]
+    n = no[rows]
+    d1 = ((p1 - c) * n).sum(axis=1)
+    d2 = ((p2 - c) * n).sum(axis=1)
+    den = d1 - d2
+    hit = (np.any(p1 != p2, axis=1) & (d1 * d2 <= 0.0) &
+           (np.abs(den) > 1e-12))
+    if not np.any(hit):
+        return tangents, found
+    rows = rows[hit]
+    t = (d1[hit] / den[hit])[:, np.newaxis]
+    inter = p1[hit] + (p2[hit] - p1[hit]) * t
+
+    # 頂点毎に最初の交点を採用する
+    first = np.concatenate(([True], rows[1:] != rows[:-1]))
+    rows = rows[first]
+    v, nonzero = normalized(inter[first] - c[hit][first])
+
+    # 長さ調整
+    vp = v_prev[rows]
+    vn = v_next[rows]
+    a1 = np.arccos(np.clip((v * vp).sum(axis=1), -1.0, 1.0))
+    a2 = np.arccos(np.clip((v * vn).sum(axis=1), -1.0, 1.0))
+    f = np.abs(np.sin((a1 + a2) / 2))
+    scale = nonzero & (f > math.sin(angle_threshold))
+    v[scale] /= f[scale, np.newaxis]
+
+    tangents[rows] = v
+    found[rows] = True
+    return tangents, found
+
+
+class LoopTriArrays:
+    """LoopTrisの配列表現。
+    BMLoop, BMVert, BMEdgeはLoopTrisに出現した順に番号を振り、
+    loops, verts, edgesのリストで元の要素を参照する。
+        tri_loops: (T, 3) 三角形を構成するloopのインデックス
+        tri_verts: (T, 3) 同じく頂点のインデックス
+        tri_edges: (T, 3) tri[i]-tri[i + 1]が面の辺ならそのインデックス。
+                   そうでないなら-1
+        loop_verts, loop_prev_verts, loop_next_verts: (L,)
+        coords: (V, 3)
+        normals: (T, 3)
+        areas: (T,)
+        vert_tris, edge_tris, loop_tris: topology.CSR
+    """
+
+    def __init__(self, looptris):
+        """
+        :type looptris: LoopTris | list[LoopTri]
+        """
+        self.loops = []
+        self.verts = []
+        self.edges = []
+        loop_index = {}
+        vert_index = {}
+        edge_index = {}
+
+        def index(d, ls, ele):
+            i = d.get(ele)
+            if i is None:
+                i = d[ele] = len(ls)
+                ls.append(ele)
+            return i
+
+        tri_loops = []
+        tri_edges = []
+        for tri in looptris:
+            for i in range(3):
+                loop = tri[i]
+                loop_next = tri[(i + 1) % 3]
+                tri_loops.append(index(loop_index, self.loops, loop))
+                if loop.link_loop_next == loop_next:
+                    tri_edges.append(index(edge_index, self.edges, loop.edge))
+                elif loop.link_loop_prev == loop_next:
+                    tri_edges.append(
+                        index(edge_index, self.edges, loop_next.edge))
+                else:
+                    tri_edges.append(-1)
+
+        self.loop_verts = np.array(
+            [index(vert_index, self.verts, loop.vert)
+             for loop in self.loops], dtype=int)
+        self.loop_prev_verts = np.array(
+            [index(vert_index, self.verts, loop.link_loop_prev.vert)
+             for loop in self.loops], dtype=int)
+        self.loop_next_verts = np.array(
+            [index(vert_index, self.verts, loop.link_loop_next.vert)
+             for loop in self.loops], dtype=int)
+
+        self.tri_loops = np.array(tri_loops, dtype=int).reshape(-1, 3)
+        self.tri_verts = self.loop_verts[self.tri_loops]
+        self.tri_edges = np.array(tri_edges, dtype=int).reshape(-1, 3)
+
+        tris = np.repeat(np.arange(len(self.tri_loops)), 3)
+        self.vert_tris = CSR.from_pairs(len(self.verts),
+                                        self.tri_verts.ravel(), tris)
+        self.loop_tris = CSR.from_pairs(len(self.loops),
+                                        self.tri_loops.ravel(), tris)
+        valid = self.tri_edges.ravel() >= 0
+        self.edge_tris = CSR.from_pairs(len(self.edges),
+                                        self.tri_edges.ravel()[valid],
+                                        tris[valid])
+
+        self.coords = np.zeros((0, 3))
+        self.normals = np.zeros((0, 3))
+        self.areas = np.zeros(0)
+        self.update_coords()
+
+    def update_coords(self, coords=None):
+        """頂点座標を読み直し、法線と面積を再計算する。
+        :param coords: Noneならverts[i].coを用いる。
+        :type coords: numpy.ndarray | None
+        """
+        if coords is None:
+            coords = [v.co[:] for v in self.verts]
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        self.normals, self.areas = LoopTris.calc_normals_areas(
+            self.coords[self.tri_verts])
+
+    def loop_tangents(self, angle_threshold=LoopTris.ANGLE_THRESHOLD):
+        """全loopのtangentを計算する。LoopTris.loop_tangents()の配列版。
+        :return: (tangents, found) 共にloopsの並び順
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        return vert_tangents_array(
+            self.coords, self.loop_verts, self.loop_prev_verts,
+            self.loop_next_verts, self.loop_tris.rows,
+            self.loop_tris.indices, self.tri_verts, angle_threshold)
+
+
+def test():
+    """vert_tangents_array()とLoopTris.vert_tangent()の結果を比べる。
+    Blender内で実行する。
+    """
+    bm = bmesh.new()
+    bmesh.ops.create_grid(bm, x_segments=4, y_segments=3, size=1.0)
+    bmesh.ops.create_cube(bm, size=1.0,
+                          matrix=mathutils.Matrix.Translation((3, 0, 0)))
+    # 平面にならないように歪ませる
+    for i, v in enumerate(bm.verts):
+        v.co.z += math.sin(v.co.x * 2.0 + i) * 0.3
+    # 多角形を含める
+    bmesh.ops.dissolve_edges(bm, edges=[e for e in bm.edges
+                                        if e.is_manifold][:2])
+    bm.verts.index_update()
+    bm.faces.index_update()
+    try:
+        looptris = LoopTris(bm)
+        arrays = looptris.arrays()
+        vecs, found = arrays.loop_tangents()
+        loop_dict = looptris.loop_dict()
+        for loop, vec, f in zip(arrays.loops, vecs, found):
+            v = LoopTris.vert_tangent(
+                loop.vert, loop.link_loop_prev.vert,
+                loop.link_loop_next.vert, loop_dict[loop], fallback=None)
+            if v is None:
+                assert not f
+            else:
+                assert f and (v - Vector(vec)).length < 1e-5
+    finally:
+        bm.free()
@@ -0,0 +1,596 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+線形八分木(Linear Octree)による空間分割。
+
+各要素はAABBの最小点と最大点のモートン番号から、AABBを完全に含む最も
+小さい空間に登録される。空間のインデックスは
+    (8 ** level - 1) // 7 + モートン番号
+で、これでソートした配列を保持する。
+
+octree = LinearOctree.from_triangles(tris)  # (N, 3, 3)
+ids = octree.find_aabb((0, 0, 0), (1, 1, 1))
+ids, dists = octree.ray_candidates(origin, direction)
+index, dist = octree.find_nearest(co)
+
+bpyに依存しない。
+"""
+
+
+import numpy as np
+
+
+__all__ = ('morton_encode_3d', 'morton_decode_3d', 'LinearOctree')
+
+
+MAX_LEVEL = 21  # 21bit * 3 = 63bit
+
+
+#==============================================================================
+# Morton
+#==============================================================================
+def _part1by2(n):
+    """各ビットの間に2ビットの間隔を開ける。vamath.bit_saparete_for_3d()の
+    配列版で、21ビットまで対応する。
+    """
+    n = np.asarray(n, dtype=np.int64) & 0x1fffff
+    n = (n | n << 32) & 0x1f00000000ffff
+    n = (n | n << 16) & 0x1f0000ff0000ff
+    n = (n | n << 8) & 0x100f00f00f00f00f
+    n = (n | n << 4) & 0x10c30c30c30c30c3
+    n = (n | n << 2) & 0x1249249249249249
+    return n
+
+
+def _compact1by2(n):
+    """_part1by2()の逆"""
+    n = np.asarray(n, dtype=np.int64) & 0x1249249249249249
+    n = (n | n >> 2) & 0x10c30c30c30c30c3
+    n = (n | n >> 4) & 0x100f00f00f00f00f
+    n = (n | n >> 8) & 0x1f0000ff0000ff
+    n = (n | n >> 16) & 0x1f00000000ffff
+    n = (n | n >> 32) & 0x1fffff
+    return n
+
+
+def morton_encode_3d(x, y, z):
+    """整数座標の配列からモートン番号の配列を求める。
+    vamath.get_3d_morton_number()と同じ値になる。
+    :rtype: numpy.ndarray
+    """
+    return _part1by2(x) | _part1by2(y) << 1 | _part1by2(z) << 2
+
+
+def morton_decode_3d(m):
+    """:rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)"""
+    m = np.asarray(m, dtype=np.int64)
+    return _compact1by2(m), _compact1by2(m >> 1), _compact1by2(m >> 2)
+
+
+def _level_offset(level):
+    """そのレベルの空間の線形インデックスの開始位置"""
+    return (8 ** np.asarray(level, dtype=np.int64) - 1) // 7
+
+
+def _ray_aabb(origin, direction, mins, maxs, max_dist):
+    """スラブ法。交差しないものはinf
+    :rtype: numpy.ndarray
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv = 1.0 / direction
+        t1 = (mins - origin) * inv
+        t2 = (maxs - origin) * inv
+    # direction成分が0の軸はoriginがスラブ内にあるかどうかだけで決まる
+    zero = direction == 0.0
+    inside = (origin >= mins) & (origin <= maxs)
+    tmin = np.where(zero, np.where(inside, -np.inf, np.inf),
+                    np.minimum(t1, t2))
+    tmax = np.where(zero, np.where(inside, np.inf, -np.inf),
+                    np.maximum(t1, t2))
+    near = np.maximum(tmin.max(axis=-1), 0.0)
+    far = np.minimum(tmax.min(axis=-1), max_dist)
+    return np.where(near <= far, near, np.inf)
+
+
+def _expand_ranges(items, first, last):
+    """items[first[i]:last[i]]を連結する
+    :return: (何番目の範囲か, 要素)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    counts = last - first
+    rep = np.repeat(np.arange(len(counts)), counts)
+    pos = np.repeat(first - np.cumsum(counts) + counts, counts) + \
+        np.arange(int(counts.sum()))
+    return rep, items[pos]
+
+
+class _CellGroups:
+    """要素を空間毎にまとめ、空間内ではAABBの最小点のx座標でソートしたもの。
+    空間とx座標の範囲で要素を絞り込むのに使う。
+    """
+
+    def __init__(self, ids, cells, mins, maxs):
+        order = np.lexsort((mins[:, 0], cells))
+        cells = cells[order]
+        x = mins[order, 0]
+        if len(cells):
+            starts = np.flatnonzero(np.concatenate(
+                ([True], cells[1:] != cells[:-1])))
+            self.width = np.maximum.reduceat(maxs[order, 0] - x, starts)
+            self.x_min = x.min()
+            self.span = x.max() - self.x_min + 1.0
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+            self.width = np.zeros(0)
+            self.x_min = 0.0
+            self.span = 1.0
+        self.cells = cells[starts]
+        self.starts = np.append(starts, len(cells))
+        self.items = ids[order]
+        # 空間毎に区切られた単調増加の値にしてsearchsorted出来るようにする
+        group = np.repeat(np.arange(len(starts)), np.diff(self.starts))
+        self.keys = group * (self.span * 2) + (x - self.x_min)
+
+    def find(self, cells, x_min, x_max):
+        """空間がcellsで、最小点のx座標がx_min - 空間内の最大幅からx_maxの
+        範囲にある要素を返す(余裕を持たせるので厳密ではない)。
+        :return: (何番目のcellsか, 要素番号)
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if len(self.cells) == 0:
+            return empty, empty
+        idx = np.searchsorted(self.cells, cells)
+        idx[idx == len(self.cells)] = 0
+        found = np.flatnonzero(self.cells[idx] == cells)
+        idx = idx[found]
+        eps = self.span * 1e-9
+        base = idx * (self.span * 2)
+        lo = np.clip(x_min[found] - self.width[idx] - self.x_min - eps,
+                     0.0, self.span)
+        hi = np.clip(x_max[found] - self.x_min + eps, 0.0, self.span)
+        first = np.maximum(np.searchsorted(self.keys, base + lo),
+                           self.starts[idx])
+        last = np.minimum(np.searchsorted(self.keys, base + hi, 'right'),
+                          self.starts[idx + 1])
+        last = np.maximum(first, last)
+        rep, items = _expand_ranges(self.items, first, last)
+        return found[rep], items
+
+
+def _point_aabb_distance(co, mins, maxs):
+    d = np.maximum(np.maximum(mins - co, co - maxs), 0.0)
+    return np.sqrt((d * d).sum(axis=-1))
+
+
+#==============================================================================
+# LinearOctree
+#==============================================================================
+class LinearOctree:
+    """AABBを要素とする線形八分木。
+    要素は追加された順に0から番号が振られ、remove()しても番号は変わらない。
+    追加・削除・更新の後は最初の検索時にソート済み配列を再構築する。
+    bbox外の要素も登録出来るが、その場合はルート空間に置かれる。
+    """
+
+    def __init__(self, bbox_min, bbox_max, level=4):
+        """
+        :param bbox_min: 分割する空間の最小点
+        :param bbox_max: 分割する空間の最大点
+        :param level: 分割レベル。0 <= level <= MAX_LEVEL
+        :type level: int
+        """
+        if not 0 <= level <= MAX_LEVEL:
+            raise ValueError('level must be in range [0, {}]'.format(
+                MAX_LEVEL))
+        self.level = level
+        self.bbox_min = np.array(bbox_min, dtype=float)
+        self.bbox_max = np.array(bbox_max, dtype=float)
+        size = self.bbox_max - self.bbox_min
+        size[size <= 0.0] = 1.0
+        self.unit = size / 2 ** level  # 最深レベルの空間の大きさ
+
+        self.mins = np.zeros((0, 3))
+        self.maxs = np.zeros((0, 3))
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.triangles = None  # from_triangles()で生成した場合のみ
+        self._dirty = True
+
+        # 再構築されるもの
+        self._order = None  # cellsでソートした生存要素のインデックス
+        self._cell_ids = None  # 要素が存在する空間の線形インデックス
+        self._cell_starts = None  # _orderにおける空間毎の開始位置
+        self._cell_mins = None  # 空間内要素の和集合のAABB
+        self._cell_maxs = None
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    # Build -------------------------------------------------------------------
+    @classmethod
+    def from_points(cls, points, level=4):
+        """
+        :param points: (N, 3)
+        :rtype: LinearOctree
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        inst = cls(*cls._bounds(points), level=level)
+        inst.insert(points, points)
+        return inst
+
+    @classmethod
+    def from_triangles(cls, triangles, level=4):
+        """
+        :param triangles: (N, 3, 3)。四角形等の(N, M, 3)でもよい。
+        :rtype: LinearOctree
+        """
+        triangles = np.asarray(triangles, dtype=float)
+        mins = triangles.min(axis=1)
+        maxs = triangles.max(axis=1)
+        inst = cls(*cls._bounds(np.concatenate((mins, maxs))), level=level)
+        inst.insert(mins, maxs)
+        inst.triangles = triangles
+        return inst
+
+    @staticmethod
+    def _bounds(points):
+        if len(points) == 0:
+            return np.zeros(3), np.ones(3)
+        return points.min(axis=0), points.max(axis=0)
+
+    def calc_cells(self, mins, maxs):
+        """AABBが属する空間の線形インデックスを求める
+        :rtype: numpy.ndarray
+        """
+        n = 2 ** self.level
+        lo = np.floor((mins - self.bbox_min) / self.unit).astype(np.int64)
+        hi = np.floor((maxs - self.bbox_min) / self.unit).astype(np.int64)
+        outside = ((mins < self.bbox_min) |
+                   (maxs > self.bbox_max)).any(axis=-1)
+        lo = np.clip(lo, 0, n - 1)
+        hi = np.clip(hi, 0, n - 1)
+        mlo = morton_encode_3d(lo[:, 0], lo[:, 1], lo[:, 2])
+        mhi = morton_encode_3d(hi[:, 0], hi[:, 1], hi[:, 2])
+        xor = mlo ^ mhi
+        # 共通の上位ビットを持たない3ビットの組の数だけ上のレベルになる
+        up = np.zeros(len(xor), dtype=np.int64)
+        for i in range(self.level):
+            up[(xor >> (3 * i)) != 0] = i + 1
+        up[outside] = self.level
+        level = self.level - up
+        return _level_offset(level) + (mlo >> (3 * up))
+
+    def cell_level(self, cells):
+        """線形インデックスからレベルを求める
+        :rtype: numpy.ndarray
+        """
+        cells = np.asarray(cells, dtype=np.int64)
+        level = np.zeros(len(cells), dtype=np.int64)
+        for lv in range(1, self.level + 1):
+            level[cells >= _level_offset(lv)] = lv
+        return level
+
+    def cell_bounds(self, cells):
+        """空間のAABBを返す
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        cells = np.asarray(cells, dtype=np.int64)
+        level = self.cell_level(cells)
+        x, y, z = morton_decode_3d(cells - _level_offset(level))
+        size = self.unit * (2 ** (self.level - level))[:, np.newaxis]
+        mins = self.bbox_min + np.column_stack((x, y, z)) * size
+        return mins, mins + size
+
+    # Update ------------------------------------------------------------------
+    def insert(self, mins, maxs=None):
+        """要素を追加する。
+        :param mins: (N, 3)。点ならmaxsは省略出来る。
+        :param maxs: (N, 3)
+        :return: 追加した要素の番号
+        :rtype: numpy.ndarray
+        """
+        mins = np.asarray(mins, dtype=float).reshape(-1, 3)
+        maxs = mins if maxs is None else \
+            np.asarray(maxs, dtype=float).reshape(-1, 3)
+        start = len(self.mins)
+        self.mins = np.concatenate((self.mins, mins))
+        self.maxs = np.concatenate((self.maxs, maxs))
+        self.cells = np.concatenate((self.cells, self.calc_cells(mins, maxs)))
+        self.alive = np.concatenate((self.alive,
+                                     np.ones(len(mins), dtype=bool)))
+        self._dirty = True
+        return np.arange(start, len(self.mins))
+
+    def remove(self, ids):
+        self.alive[ids] = False
+        self._dirty = True
+
+    def update(self, ids, mins, maxs=None):
+        """要素のAABBを変更する。移動した要素だけ空間を再計算する。"""
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        mins = np.asarray(mins, dtype=float).reshape(-1, 3)
+        maxs = mins if maxs is None else \
+            np.asarray(maxs, dtype=float).reshape(-1, 3)
+        self.mins[ids] = mins
+        self.maxs[ids] = maxs
+        cells = self.calc_cells(mins, maxs)
+        if np.any(self.cells[ids] != cells):
+            self.cells[ids] = cells
+            self._dirty = True
+        elif len(ids):
+            # 空間は変わらないがその空間のAABBは更新が必要
+            self._dirty = True
+
+    def _rebuild(self):
+        if not self._dirty:
+            return
+        ids = np.flatnonzero(self.alive)
+        order = ids[np.argsort(self.cells[ids], kind='mergesort')]
+        cells = self.cells[order]
+        if len(cells):
+            starts = np.flatnonzero(np.concatenate(
+                ([True], cells[1:] != cells[:-1])))
+            self._cell_mins = np.minimum.reduceat(self.mins[order], starts)
+            self._cell_maxs = np.maximum.reduceat(self.maxs[order], starts)
+        else:
+            starts = np.zeros(0, dtype=np.int64)
+            self._cell_mins = np.zeros((0, 3))
+            self._cell_maxs = np.zeros((0, 3))
+        self._order = order
+        self._cell_ids = cells[starts]
+        self._cell_starts = np.append(starts, len(order))
+        self._dirty = False
+
+    def _items_of_cells(self, cell_indices):
+        """_cell_idsのインデックスの配列からそこに属する要素番号を返す"""
+        cell_indices = np.asarray(cell_indices, dtype=np.int64)
+        return _expand_ranges(self._order, self._cell_starts[cell_indices],
+                              self._cell_starts[cell_indices + 1])[1]
+
+    def _ancestor_pairs(self, query_ids, query_cells, query_mins, query_maxs,
+                        groups, strict):
+        """query_cellsの空間とその祖先の空間に属する要素の内、x方向で
+        重なり得るものとの組を返す。
+        :type groups: _CellGroups
+        :param strict: Trueなら同じ空間は含めない
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        level = self.cell_level(query_cells)
+        morton = query_cells - _level_offset(level)
+        result_q = []
+        result_t = []
+        for up in range(1 if strict else 0, self.level + 1):
+            valid = np.flatnonzero(level >= up)
+            if len(valid) == 0:
+                break
+            anc = _level_offset(level[valid] - up) + (morton[valid] >> 3 * up)
+            rep, targets = groups.find(anc, query_mins[valid, 0],
+                                       query_maxs[valid, 0])
+            result_q.append(query_ids[valid[rep]])
+            result_t.append(targets)
+        if result_q:
+            return np.concatenate(result_q), np.concatenate(result_t)
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Query -------------------------------------------------------------------
+    def find_aabb(self, bbox_min, bbox_max):
+        """AABBが重なる要素を返す。
+        :return: 要素番号の配列(昇順)
+        :rtype: numpy.ndarray
+        """
+        self._rebuild()
+        bbox_min = np.asarray(bbox_min, dtype=float)
+        bbox_max = np.asarray(bbox_max, dtype=float)
+        hit = np.all((self._cell_mins <= bbox_max) &
+                     (self._cell_maxs >= bbox_min), axis=1)
+        ids = self._items_of_cells(np.flatnonzero(hit))
+        hit = np.all((self.mins[ids] <= bbox_max) &
+                     (self.maxs[ids] >= bbox_min), axis=1)
+        return np.sort(ids[hit])
+
+    def find_aabb_pairs(self, other=None):
+        """AABBが重なる要素の組を返す。otherがNoneなら自身の要素同士。
+        重なり得るのは同じ空間か祖先・子孫の空間の要素だけなので、
+        自身の空間分割で両方を空間毎にまとめて組を作る。
+        :type other: LinearOctree | None
+        :return: (N, 2)の配列。自身同士の場合は i < j となる。
+            otherを指定した場合は(otherの要素番号, 自身の要素番号)。
+        :rtype: numpy.ndarray
+        """
+        self._rebuild()
+        ids = self._order
+        cells = self.cells[ids]
+        mins = self.mins[ids]
+        maxs = self.maxs[ids]
+        groups = _CellGroups(ids, cells, mins, maxs)
+        if other is None:
+            # 同じ空間と祖先の空間の要素だけで全ての組が現れる。
+            # 同じ空間の組は両方向に現れるので i < j に限る
+            a, b = self._ancestor_pairs(ids, cells, mins, maxs, groups, False)
+            keep = (self.cells[a] != self.cells[b]) | (a < b)
+            a, b = np.minimum(a[keep], b[keep]), np.maximum(a[keep], b[keep])
+            src = self
+        else:
+            other._rebuild()
+            src_ids = other._order
+            src_mins = other.mins[src_ids]
+            src_maxs = other.maxs[src_ids]
+            src_cells = self.calc_cells(src_mins, src_maxs)
+            a1, b1 = self._ancestor_pairs(src_ids, src_cells, src_mins,
+                                          src_maxs, groups, False)
+            b2, a2 = self._ancestor_pairs(
+                ids, cells, mins, maxs,
+                _CellGroups(src_ids, src_cells, src_mins, src_maxs), True)
+            a = np.concatenate((a1, a2))
+            b = np.concatenate((b1, b2))
+            src = other
+        hit = np.all((src.mins[a] <= self.maxs[b]) &
+                     (src.maxs[a] >= self.mins[b]), axis=1)
+        a = a[hit]
+        b = b[hit]
+        order = np.lexsort((b, a))
+        return np.column_stack((a[order], b[order])).astype(np.int64)
+
+    def ray_candidates(self, origin, direction, max_dist=np.inf):
+        """レイとAABBが交差する要素を、AABBに入る距離の昇順で返す。
+        directionは正規化しなくてもよいが、その場合距離はその長さ単位となる。
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        self._rebuild()
+        origin = np.asarray(origin, dtype=float)
+        direction = np.asarray(direction, dtype=float)
+        t = _ray_aabb(origin, direction, self._cell_mins, self._cell_maxs,
+                      max_dist)
+        ids = self._items_of_cells(np.flatnonzero(np.isfinite(t)))
+        t = _ray_aabb(origin, direction, self.mins[ids], self.maxs[ids],
+                      max_dist)
+        hit = np.isfinite(t)
+        ids = ids[hit]
+        t = t[hit]
+        order = np.argsort(t, kind='mergesort')
+        return ids[order], t[order]
+
+    def find_nearest(self, co, max_dist=np.inf, distance=None):
+        """最も近い要素を返す。
+        :param distance: 引数(要素番号の配列, co)を取って距離の配列を返す関数。
+            NoneならAABBとの距離を用いる(点なら正確な距離になる)。
+            AABBとの距離以上の値を返す必要がある。
+        :return: (要素番号, 距離)。見つからないなら(None, inf)
+        :rtype: (int | None, float)
+        """
+        self._rebuild()
+        co = np.asarray(co, dtype=float)
+        if distance is None:
+            def distance(ids, co):
+                return _point_aabb_distance(co, self.mins[ids],
+                                            self.maxs[ids])
+        lower = _point_aabb_distance(co, self._cell_mins, self._cell_maxs)
+        best_index = None
+        best_dist = max_dist
+        for i in np.argsort(lower, kind='mergesort'):
+            if lower[i] > best_dist:
+                break
+            ids = self._items_of_cells(np.array([i]))
+            dists = distance(ids, co)
+            j = int(np.argmin(dists))
+            if dists[j] <= best_dist:
+                best_index = int(ids[j])
+                best_dist = float(dists[j])
+        if best_index is None:
+            return None, np.inf
+        return best_index, best_dist
+
+
+#==============================================================================
+# Test
+#==============================================================================
+def test():
+    rng = np.random.RandomState(0)
+
+    # vamath.get_3d_morton_number()と同じ値
+    def get_3d_morton_number(x, y, z):
+        def sep(n):
+            n = (n | n << 8) & 0x0000f00f
+            n = (n | n << 4) & 0x000c30c3
+            n = (n | n << 2) & 0x00249249
+            return n
+        return sep(x) | sep(y) << 1 | sep(z) << 2
+    xyz = rng.randint(0, 256, (100, 3))
+    m = morton_encode_3d(xyz[:, 0], xyz[:, 1], xyz[:, 2])
+    assert m.tolist() == [get_3d_morton_number(*v) for v in xyz.tolist()]
+    assert np.all(np.column_stack(morton_decode_3d(m)) == xyz)
+
+    points = rng.uniform(-1, 1, (500, 3))
+    octree = LinearOctree.from_points(points, level=5)
+
+    # AABB
+    ids = octree.find_aabb((-0.2, -0.3, 0.0), (0.4, 0.1, 0.5))
+    expected = np.flatnonzero(np.all((points >= (-0.2, -0.3, 0.0)) &
+                                     (points <= (0.4, 0.1, 0.5)), axis=1))
+    assert ids.tolist() == expected.tolist()
+
+    # 空間は要素を完全に含む
+    mins, maxs = octree.cell_bounds(octree.cells)
+    assert np.all(mins <= points + 1e-9) and np.all(maxs >= points - 1e-9)
+
+    # nearest
+    co = np.array([0.1, 0.2, -0.3])
+    index, dist = octree.find_nearest(co)
+    dists = np.linalg.norm(points - co, axis=1)
+    assert index == int(np.argmin(dists))
+    assert abs(dist - dists.min()) < 1e-12
+
+    # update, remove, insert
+    octree.update([index], [5.0, 5.0, 5.0])  # bbox外へ
+    index2, _ = octree.find_nearest(co)
+    assert index2 != index
+    octree.remove([index2])
+    new = octree.insert([co])
+    assert octree.find_nearest(co)[0] == new[0]
+    assert len(octree) == 500
+
+    # ray
+    tris = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]],
+                     [[0, 0, 2], [1, 0, 2], [0, 1, 2]],
+                     [[5, 5, 5], [6, 5, 5], [5, 6, 5]]], dtype=float)
+    octree = LinearOctree.from_triangles(tris, level=3)
+    ids, t = octree.ray_candidates((0.2, 0.2, -1.0), (0.0, 0.0, 1.0))
+    assert ids.tolist() == [0, 1] and np.allclose(t, [1.0, 3.0])
+
+    # direction成分が0でAABBの最大側の面上を通るレイ
+    ids, t = octree.ray_candidates((1.0, 0.5, 3.0), (0.0, 0.0, -1.0))
+    assert ids.tolist() == [1, 0] and np.allclose(t, [1.0, 3.0])
+    ids, t = octree.ray_candidates((1.5, 0.5, 3.0), (0.0, 0.0, -1.0))
+    assert len(ids) == 0
+
+    # pairs
+    pairs = octree.find_aabb_pairs()
+    assert pairs.shape == (0, 2)
+
+    def brute_pairs(mins1, maxs1, mins2, maxs2):
+        hit = np.all((mins1[:, np.newaxis] <= maxs2[np.newaxis]) &
+                     (maxs1[:, np.newaxis] >= mins2[np.newaxis]), axis=2)
+        return np.argwhere(hit)
+
+    mins = rng.uniform(-1, 1, (300, 3))
+    maxs = mins + rng.uniform(0, 0.3, (300, 3))
+    octree = LinearOctree(mins.min(axis=0), maxs.max(axis=0), level=4)
+    octree.insert(mins, maxs)
+    octree.update([0], [3.0, 3.0, 3.0], [3.5, 3.5, 3.5])  # bbox外
+    octree.remove([1])
+    mins = octree.mins
+    maxs = octree.maxs
+    expected = brute_pairs(mins, maxs, mins, maxs)
+    expected = expected[(expected[:, 0] < expected[:, 1]) &
+                        np.all(expected != 1, axis=1)]
+    assert octree.find_aabb_pairs().tolist() == expected.tolist()
+
+    mins2 = rng.uniform(-1.5, 1.5, (200, 3))
+    maxs2 = mins2 + rng.uniform(0, 0.5, (200, 3))
+    other = LinearOctree(mins2.min(axis=0), maxs2.max(axis=0), level=3)
+    other.insert(mins2, maxs2)
+    expected = brute_pairs(mins2, maxs2, mins, maxs)
+    expected = expected[expected[:, 1] != 1]
+    assert octree.find_aabb_pairs(other).tolist() == expected.tolist()
+
+
+if __name__ == '__main__':
+    test()
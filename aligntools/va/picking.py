@@ -0,0 +1,389 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+レイと三角形の交差判定によるピッキング。
+
+全ての三角形を一つの配列にまとめ、Möller–Trumboreの方法でまとめて
+交差判定する。三角形が多い場合はLinearOctreeで候補を絞り込む。
+
+picker = TrianglePicker.from_objects(context.scene, objects)
+hit = picker.ray_cast(origin, direction)
+if hit:
+    ob = objects[hit.object_index]
+    polygon_index = hit.polygon_index
+
+from_objects()以外はbpyに依存しない。
+"""
+
+
+import numpy as np
+
+from .octree import LinearOctree
+
+
+__all__ = ('ray_triangles', 'triangulate_polygons', 'PickResult',
+           'TrianglePicker')
+
+
+EPSILON = 1e-12
+
+
+def ray_triangles(origin, direction, v0, v1, v2, cull_backface=False,
+                  eps=EPSILON):
+    """Möller–Trumbore。一本のレイと(N, 3)の三角形群の交差判定。
+    :param origin: (3,)
+    :param direction: (3,)。正規化しない場合、距離はその長さ単位となる
+    :param v0: (N, 3)
+    :param cull_backface: 真なら裏面(v0, v1, v2が時計回りに見える面)を除外
+    :return: (t, u, v, hit)。交点は v0 + (v1 - v0) * u + (v2 - v0) * v
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    origin = np.asarray(origin, dtype=float)
+    direction = np.asarray(direction, dtype=float)
+    e1 = v1 - v0
+    e2 = v2 - v0
+    p = np.cross(direction, e2)
+    det = np.einsum('ij,ij->i', e1, p)
+    if cull_backface:
+        valid = det > eps
+    else:
+        valid = np.abs(det) > eps
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        s = origin - v0
+        u = np.einsum('ij,ij->i', s, p) * inv_det
+        q = np.cross(s, e1)
+        v = np.dot(q, direction) * inv_det
+        t = np.einsum('ij,ij->i', e2, q) * inv_det
+    hit = (valid & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) &
+           (t >= 0.0))
+    return t, u, v, hit
+
+
+def triangulate_polygons(loop_starts, loop_totals, loop_verts):
+    """ポリゴンを扇状に三角形分割する。凹ポリゴンは正しく分割されない。
+    :param loop_starts: (P,)。Mesh.polygonsのloop_start
+    :param loop_totals: (P,)。Mesh.polygonsのloop_total
+    :param loop_verts: (L,)。Mesh.loopsのvertex_index
+    :return: 三角形の頂点番号(T, 3)と、元のポリゴン番号(T,)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    loop_starts = np.asarray(loop_starts, dtype=np.int64)
+    loop_totals = np.asarray(loop_totals, dtype=np.int64)
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    num_tris = np.maximum(loop_totals - 2, 0)
+    polygons = np.repeat(np.arange(len(loop_starts)), num_tris)
+    # ポリゴン内での三角形の番号
+    offsets = np.cumsum(num_tris) - num_tris
+    local = np.arange(len(polygons)) - np.repeat(offsets, num_tris)
+    starts = loop_starts[polygons]
+    tris = np.column_stack((starts, starts + local + 1, starts + local + 2))
+    return loop_verts[tris], polygons
+
+
+class PickResult:
+    """TrianglePicker.ray_cast()の結果。
+    index: 三角形の番号
+    object_index, polygon_index: 三角形の元になったオブジェクトとポリゴン
+    location: 交点
+    distance: レイの始点からの距離
+    barycentric: (w, u, v)。location = v0 * w + v1 * u + v2 * v
+    """
+
+    __slots__ = ('index', 'object_index', 'polygon_index', 'location',
+                 'distance', 'barycentric', 'normal')
+
+    def __init__(self, index, object_index, polygon_index, location,
+                 distance, barycentric, normal):
+        self.index = index
+        self.object_index = object_index
+        self.polygon_index = polygon_index
+        self.location = location
+        self.distance = distance
+        self.barycentric = barycentric
+        self.normal = normal
+
+    def __repr__(self):
+        return '<PickResult index={} distance={:.6g}>'.format(
+            self.index, self.distance)
+
+
+class TrianglePicker:
+    """三角形の配列に対してレイを飛ばす。
+    三角形数がOCTREE_THRESHOLD以上なら八分木を作って候補を絞り込む。
+    """
+
+    OCTREE_THRESHOLD = 512
+
+    def __init__(self, triangles, object_indices=None, polygon_indices=None,
+                 use_octree=None, level=5):
+        """
+        :param triangles: (N, 3, 3)
+        :param object_indices: (N,)。省略時は全て0
+        :param polygon_indices: (N,)。省略時は三角形の番号
+        :param use_octree: Noneなら三角形数で決める
+        :type level: int
+        """
+        self.triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+        num = len(self.triangles)
+        if object_indices is None:
+            object_indices = np.zeros(num, dtype=np.int64)
+        if polygon_indices is None:
+            polygon_indices = np.arange(num)
+        self.object_indices = np.asarray(object_indices, dtype=np.int64)
+        self.polygon_indices = np.asarray(polygon_indices, dtype=np.int64)
+
+        self.v0 = self.triangles[:, 0]
+        self.v1 = self.triangles[:, 1]
+        self.v2 = self.triangles[:, 2]
+
+        if use_octree is None:
+            use_octree = num >= self.OCTREE_THRESHOLD
+        if use_octree and num:
+            self.octree = LinearOctree.from_triangles(self.triangles, level)
+        else:
+            self.octree = None
+
+    def __len__(self):
+        return len(self.triangles)
+
+    @classmethod
+    def from_mesh_arrays(cls, vert_coords, loop_starts, loop_totals,
+                         loop_verts, matrix=None, **kwargs):
+        """
+        :param vert_coords: (V, 3)
+        :param matrix: (4, 4)。頂点座標に適用する
+        :rtype: TrianglePicker
+        """
+        coords = np.asarray(vert_coords, dtype=float).reshape(-1, 3)
+        if matrix is not None:
+            matrix = np.asarray(matrix, dtype=float)
+            coords = np.dot(coords, matrix[:3, :3].T) + matrix[:3, 3]
+        tris, polygons = triangulate_polygons(loop_starts, loop_totals,
+                                              loop_verts)
+        return cls(coords[tris], None, polygons, **kwargs)
+
+    @classmethod
+    def from_objects(cls, scene, objects, apply_modifiers=True,
+                     settings='PREVIEW', **kwargs):
+        """モディファイア適用後のメッシュからワールド座標の三角形を集める。
+        :type scene: bpy.types.Scene
+        :type objects: collections.abc.Sequence
+        :rtype: TrianglePicker
+        """
+        import bpy
+
+        triangles = []
+        object_indices = []
+        polygon_indices = []
+        for i, ob in enumerate(objects):
+            if ob.type not in {'MESH', 'CURVE', 'SURFACE', 'META', 'FONT'}:
+                continue
+            mesh = ob.to_mesh(scene, apply_modifiers, settings)
+            try:
+                coords = np.zeros(len(mesh.vertices) * 3)
+                mesh.vertices.foreach_get('co', coords)
+                loop_starts = np.zeros(len(mesh.polygons), dtype=np.int32)
+                loop_totals = np.zeros(len(mesh.polygons), dtype=np.int32)
+                mesh.polygons.foreach_get('loop_start', loop_starts)
+                mesh.polygons.foreach_get('loop_total', loop_totals)
+                loop_verts = np.zeros(len(mesh.loops), dtype=np.int32)
+                mesh.loops.foreach_get('vertex_index', loop_verts)
+            finally:
+                bpy.data.meshes.remove(mesh)
+            coords = coords.reshape(-1, 3)
+            matrix = np.array(ob.matrix_world)
+            coords = np.dot(coords, matrix[:3, :3].T) + matrix[:3, 3]
+            tris, polygons = triangulate_polygons(loop_starts, loop_totals,
+                                                  loop_verts)
+            triangles.append(coords[tris])
+            object_indices.append(np.full(len(tris), i, dtype=np.int64))
+            polygon_indices.append(polygons)
+        if triangles:
+            return cls(np.concatenate(triangles),
+                       np.concatenate(object_indices),
+                       np.concatenate(polygon_indices), **kwargs)
+        return cls(np.zeros((0, 3, 3)), **kwargs)
+
+    def _candidates(self, origin, direction, max_dist):
+        if self.octree is None:
+            return None
+        ids, _ = self.octree.ray_candidates(origin, direction, max_dist)
+        return ids
+
+    def intersect(self, origin, direction, max_dist=np.inf,
+                  cull_backface=False):
+        """レイと交差する全ての三角形を距離の昇順で返す。
+        :return: (三角形番号, t, u, v)
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        ids = self._candidates(origin, direction, max_dist)
+        if ids is None:
+            v0, v1, v2 = self.v0, self.v1, self.v2
+            ids = np.arange(len(self))
+        else:
+            v0, v1, v2 = self.v0[ids], self.v1[ids], self.v2[ids]
+        t, u, v, hit = ray_triangles(origin, direction, v0, v1, v2,
+                                     cull_backface)
+        hit &= t <= max_dist
+        # 距離が同じなら番号順。八分木の有無で結果を変えない
+        order = np.lexsort((ids[hit], t[hit]))
+        return ids[hit][order], t[hit][order], u[hit][order], v[hit][order]
+
+    def _result(self, index, origin, direction, t, u, v):
+        index = int(index)
+        v0, v1, v2 = self.triangles[index]
+        location = np.asarray(origin, dtype=float) + \
+            np.asarray(direction, dtype=float) * t
+        normal = np.cross(v1 - v0, v2 - v0)
+        length = np.linalg.norm(normal)
+        if length > 0.0:
+            normal /= length
+        return PickResult(index, int(self.object_indices[index]),
+                          int(self.polygon_indices[index]), location,
+                          float(t), (1.0 - u - v, float(u), float(v)),
+                          normal)
+
+    def ray_cast(self, origin, direction, max_dist=np.inf,
+                 cull_backface=False):
+        """最も近い交点を返す。
+        :rtype: PickResult | None
+        """
+        ids, t, u, v = self.intersect(origin, direction, max_dist,
+                                      cull_backface)
+        if not len(ids):
+            return None
+        return self._result(ids[0], origin, direction, t[0], u[0], v[0])
+
+    def ray_cast_many(self, origins, directions, max_dist=np.inf,
+                      cull_backface=False):
+        """複数のレイに対してray_cast()を行う。
+        :param origins: (R, 3)
+        :param directions: (R, 3)
+        :return: 三角形番号(見つからなければ-1), t, u, v。各(R,)
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+        num = len(origins)
+        indices = np.full(num, -1, dtype=np.int64)
+        ts = np.full(num, np.inf)
+        us = np.zeros(num)
+        vs = np.zeros(num)
+        for i in range(num):
+            ids, t, u, v = self.intersect(origins[i], directions[i],
+                                          max_dist, cull_backface)
+            if len(ids):
+                indices[i] = ids[0]
+                ts[i] = t[0]
+                us[i] = u[0]
+                vs[i] = v[0]
+        return indices, ts, us, vs
+
+
+#==============================================================================
+# Test
+#==============================================================================
+def _grid_mesh(size):
+    """size * size の四角形からなるXY平面上のグリッド"""
+    xs, ys = np.meshgrid(np.arange(size + 1), np.arange(size + 1))
+    coords = np.column_stack((xs.ravel(), ys.ravel(),
+                              np.zeros(xs.size))).astype(float)
+    i, j = np.meshgrid(np.arange(size), np.arange(size))
+    a = (j * (size + 1) + i).ravel()
+    loop_verts = np.column_stack((a, a + 1, a + size + 2, a + size + 1))
+    loop_totals = np.full(size * size, 4)
+    loop_starts = np.arange(size * size) * 4
+    return coords, loop_starts, loop_totals, loop_verts.ravel()
+
+
+def test():
+    # 単一の三角形
+    tri = np.array([[[0, 0, 0], [1, 0, 0], [0, 1, 0]]], dtype=float)
+    t, u, v, hit = ray_triangles((0.25, 0.25, 1), (0, 0, -1),
+                                 tri[:, 0], tri[:, 1], tri[:, 2])
+    assert hit[0] and np.isclose(t[0], 1.0)
+    assert np.allclose([u[0], v[0]], [0.25, 0.25])
+    _, _, _, hit = ray_triangles((0.25, 0.25, -1), (0, 0, 1),
+                                 tri[:, 0], tri[:, 1], tri[:, 2],
+                                 cull_backface=True)
+    assert not hit[0]
+    _, _, _, hit = ray_triangles((1, 1, 1), (0, 0, -1),
+                                 tri[:, 0], tri[:, 1], tri[:, 2])
+    assert not hit[0]
+
+    # 扇状分割
+    tris, polygons = triangulate_polygons([0, 3], [3, 5],
+                                          [0, 1, 2, 3, 4, 5, 6, 7])
+    assert tris.tolist() == [[0, 1, 2], [3, 4, 5], [3, 5, 6], [3, 6, 7]]
+    assert polygons.tolist() == [0, 1, 1, 1]
+
+    # グリッド: 八分木の有無で同じ結果
+    coords, starts, totals, verts = _grid_mesh(30)
+    mat = np.identity(4)
+    mat[2, 3] = 2.0
+    pickers = [TrianglePicker.from_mesh_arrays(
+        coords, starts, totals, verts, mat, use_octree=use)
+        for use in (False, True)]
+    assert pickers[1].octree is not None
+    rng = np.random.RandomState(0)
+    origins = np.column_stack((rng.uniform(-1, 31, (50, 2)),
+                               np.full(50, 5.0)))
+    directions = np.tile((0.0, 0.0, -1.0), (50, 1))
+    directions[:, :2] += rng.uniform(-0.1, 0.1, (50, 2))
+    results = [p.ray_cast_many(origins, directions) for p in pickers]
+    for a, b in zip(*results):
+        assert np.allclose(a, b)
+    for i in range(50):
+        hit = pickers[1].ray_cast(origins[i], directions[i])
+        if hit is None:
+            assert results[0][0][i] == -1
+            continue
+        assert np.isclose(hit.location[2], 2.0)
+        x, y = np.floor(hit.location[:2]).astype(int)
+        assert hit.polygon_index == y * 30 + x
+        w, u, v = hit.barycentric
+        tri = pickers[1].triangles[hit.index]
+        assert np.allclose(tri[0] * w + tri[1] * u + tri[2] * v,
+                           hit.location)
+
+    # 軸に平行なレイ。bboxの最大側の境界上も総当たりと同じ結果
+    origins = np.array([[30, 15.5, 5], [15.5, 30, 5], [30, 30, 5],
+                        [0, 0, 5], [0, 15.5, 5], [12, 7, 5]], dtype=float)
+    origins = np.concatenate(
+        (origins, np.column_stack((rng.randint(0, 31, (30, 2)),
+                                   np.full(30, 5.0)))))
+    directions = np.tile((0.0, 0.0, -1.0), (len(origins), 1))
+    results = [p.ray_cast_many(origins, directions) for p in pickers]
+    assert np.all(results[0][0] != -1)
+    for a, b in zip(*results):
+        assert np.allclose(a, b)
+
+    # 手前の面が優先される
+    tris = np.array([[[-1, -1, 0], [1, -1, 0], [0, 1, 0]],
+                     [[-1, -1, 1], [1, -1, 1], [0, 1, 1]]], dtype=float)
+    picker = TrianglePicker(tris, object_indices=[0, 1])
+    hit = picker.ray_cast((0, 0, 5), (0, 0, -1))
+    assert hit.object_index == 1 and np.isclose(hit.distance, 4.0)
+    assert picker.ray_cast((0, 0, 5), (0, 0, -1), max_dist=3.0) is None
+
+
+if __name__ == '__main__':
+    test()
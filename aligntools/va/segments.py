@@ -0,0 +1,248 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+線分同士の交差判定。
+
+AABBを線形八分木に登録して候補の組を絞り込み、候補の組については
+線分間の最近点をまとめて計算する。
+
+result = intersect_segments(starts, ends, threshold=1e-5)
+for i, j, s, t in zip(result.pairs[:, 0], result.pairs[:, 1],
+                      result.factors1, result.factors2):
+    ...
+
+bpyに依存しない。
+"""
+
+
+import numpy as np
+
+from .octree import LinearOctree
+
+
+__all__ = ('closest_points_segments', 'SegmentIntersections',
+           'intersect_segments')
+
+
+def closest_points_segments(p1, q1, p2, q2, eps=1e-12):
+    """線分p1-q1と線分p2-q2の最近点を求める。各引数は(N, 3)又は(N, 2)。
+    平行な場合はp1側の端点から求めた点の一つを返す。
+    :return: (s, t, c1, c2, parallel)。
+        c1 = p1 + (q1 - p1) * s, c2 = p2 + (q2 - p2) * t
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray,
+             numpy.ndarray)
+    """
+    p1 = np.asarray(p1, dtype=float)
+    q1 = np.asarray(q1, dtype=float)
+    p2 = np.asarray(p2, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.einsum('ij,ij->i', d1, d1)
+    e = np.einsum('ij,ij->i', d2, d2)
+    f = np.einsum('ij,ij->i', d2, r)
+    c = np.einsum('ij,ij->i', d1, r)
+    b = np.einsum('ij,ij->i', d1, d2)
+    denom = a * e - b * b
+
+    point1 = a <= eps
+    point2 = e <= eps
+    parallel = denom <= eps * np.maximum(a * e, eps)
+    parallel &= ~point1 & ~point2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 一般の場合
+        s = np.where(parallel, 0.0, (b * f - c * e) / denom)
+        s = np.clip(np.nan_to_num(s), 0.0, 1.0)
+        t = (b * s + f) / e
+        # tが範囲外ならsを求め直す
+        t_lo = t < 0.0
+        t_hi = t > 1.0
+        s = np.where(t_lo, np.clip(-c / a, 0.0, 1.0), s)
+        s = np.where(t_hi, np.clip((b - c) / a, 0.0, 1.0), s)
+        t = np.clip(t, 0.0, 1.0)
+
+        # 片方、若しくは両方が点
+        s = np.where(point1, 0.0, s)
+        t = np.where(point1, np.clip(f / e, 0.0, 1.0), t)
+        s = np.where(point2, np.clip(-c / a, 0.0, 1.0), s)
+        t = np.where(point2, 0.0, t)
+        both = point1 & point2
+        s[both] = 0.0
+        t[both] = 0.0
+
+    s = np.nan_to_num(s)
+    t = np.nan_to_num(t)
+    c1 = p1 + d1 * s[:, None]
+    c2 = p2 + d2 * t[:, None]
+    return s, t, c1, c2, parallel
+
+
+class SegmentIntersections:
+    """intersect_segments()の結果。
+    pairs: (N, 2)。線分番号の組で pairs[:, 0] < pairs[:, 1]
+    factors1, factors2: (N,)。各線分上の交点の位置(0.0 - 1.0)
+    points1, points2: (N, dim)。各線分上の交点
+    distances: (N,)。points1とpoints2の距離
+    """
+
+    __slots__ = ('pairs', 'factors1', 'factors2', 'points1', 'points2',
+                 'distances')
+
+    def __init__(self, pairs, factors1, factors2, points1, points2,
+                 distances):
+        self.pairs = pairs
+        self.factors1 = factors1
+        self.factors2 = factors2
+        self.points1 = points1
+        self.points2 = points2
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def segment_factors(self, num):
+        """線分毎の交点の位置をまとめる。
+        :param num: 線分の数
+        :return: 線分番号をキー、(交点番号, 位置)のリストを値とする辞書。
+            リストは位置の昇順。
+        :rtype: dict
+        """
+        index = np.concatenate((self.pairs[:, 0], self.pairs[:, 1]))
+        factors = np.concatenate((self.factors1, self.factors2))
+        isects = np.concatenate((np.arange(len(self)),) * 2)
+        order = np.lexsort((factors, index))
+        result = {}
+        for i in order:
+            key = int(index[i])
+            if key < num:
+                result.setdefault(key, []).append(
+                    (int(isects[i]), float(factors[i])))
+        return result
+
+
+def intersect_segments(starts, ends, threshold=1e-5, segment_verts=None,
+                       level=4):
+    """線分同士の交点を求める。
+    :param starts: 線分の始点。(N, 3)又は(N, 2)
+    :param ends: 線分の終点。startsと同じ形
+    :param threshold: 最近点間の距離がこれ以下なら交差していると見做す
+    :param segment_verts: (N, 2)。頂点番号。共有する頂点を持つ組は除外する
+    :param level: 八分木の分割レベル
+    :rtype: SegmentIntersections
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    dim = starts.shape[-1] if starts.ndim == 2 else 3
+    starts = starts.reshape(-1, dim)
+    ends = ends.reshape(-1, dim)
+    if dim == 2:
+        zeros = np.zeros((len(starts), 1))
+        starts3d = np.hstack((starts, zeros))
+        ends3d = np.hstack((ends, zeros))
+    else:
+        starts3d = starts
+        ends3d = ends
+
+    # Broad phase
+    mins = np.minimum(starts3d, ends3d) - threshold
+    maxs = np.maximum(starts3d, ends3d) + threshold
+    if len(starts):
+        bbox_min, bbox_max = mins.min(axis=0), maxs.max(axis=0)
+    else:
+        bbox_min, bbox_max = np.zeros(3), np.ones(3)
+    octree = LinearOctree(bbox_min, bbox_max, level)
+    octree.insert(mins, maxs)
+    pairs = octree.find_aabb_pairs()
+    if segment_verts is not None and len(pairs):
+        segment_verts = np.asarray(segment_verts)
+        v1 = segment_verts[pairs[:, 0]]
+        v2 = segment_verts[pairs[:, 1]]
+        shared = ((v1[:, 0] == v2[:, 0]) | (v1[:, 0] == v2[:, 1]) |
+                  (v1[:, 1] == v2[:, 0]) | (v1[:, 1] == v2[:, 1]))
+        pairs = pairs[~shared]
+
+    # Narrow phase
+    i, j = pairs[:, 0], pairs[:, 1]
+    s, t, c1, c2, parallel = closest_points_segments(
+        starts[i], ends[i], starts[j], ends[j])
+    if len(pairs):
+        dists = np.linalg.norm(c1 - c2, axis=1)
+    else:
+        dists = np.zeros(0)
+    hit = (dists <= threshold) & ~parallel
+    order = np.lexsort((pairs[hit, 1], pairs[hit, 0]))
+    return SegmentIntersections(
+        pairs[hit][order], s[hit][order], t[hit][order],
+        c1[hit][order], c2[hit][order], dists[hit][order])
+
+
+def test():
+    # 最近点
+    p1 = np.array([[0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]], dtype=float)
+    q1 = np.array([[2, 0, 0], [2, 0, 0], [0, 0, 0], [2, 0, 0]], dtype=float)
+    p2 = np.array([[1, -1, 1], [3, -1, 0], [1, -1, 0], [0, 1, 0]],
+                  dtype=float)
+    q2 = np.array([[1, 1, 1], [3, 1, 0], [1, 1, 0], [2, 1, 0]], dtype=float)
+    s, t, c1, c2, parallel = closest_points_segments(p1, q1, p2, q2)
+    assert np.allclose(s, [0.5, 1.0, 0.0, 0.0])
+    assert np.allclose(t[:3], [0.5, 0.5, 0.5])
+    assert np.allclose(c1[0], [1, 0, 0]) and np.allclose(c2[0], [1, 0, 1])
+    assert parallel.tolist() == [False, False, False, True]
+
+    # 格子状の線分: 縦4本と横4本で16交点
+    starts = []
+    ends = []
+    for k in range(4):
+        starts.append((k, -1.0))
+        ends.append((k, 4.0))
+    for k in range(4):
+        starts.append((-1.0, k + 0.5))
+        ends.append((4.0, k + 0.5))
+    result = intersect_segments(starts, ends)
+    assert len(result) == 16
+    assert np.allclose(result.points1, result.points2)
+    factors = result.segment_factors(8)
+    assert len(factors) == 8
+    assert all(len(v) == 4 for v in factors.values())
+    assert [f for _, f in factors[0]] == sorted(f for _, f in factors[0])
+
+    # 頂点を共有する組は除外
+    result = intersect_segments([(0, 0, 0), (1, 0, 0)],
+                                [(1, 0, 0), (1, 1, 0)],
+                                segment_verts=[(0, 1), (1, 2)])
+    assert len(result) == 0
+
+    # 総当りと比較
+    rng = np.random.RandomState(0)
+    starts = rng.uniform(0, 10, (60, 2))
+    ends = starts + rng.uniform(-2, 2, (60, 2))
+    result = intersect_segments(starts, ends)
+    i, j = np.triu_indices(60, 1)
+    s, t, c1, c2, parallel = closest_points_segments(
+        starts[i], ends[i], starts[j], ends[j])
+    hit = (np.linalg.norm(c1 - c2, axis=1) <= 1e-5) & ~parallel
+    expected = sorted(zip(i[hit].tolist(), j[hit].tolist()))
+    assert [tuple(p) for p in result.pairs.tolist()] == expected
+
+
+if __name__ == '__main__':
+    test()
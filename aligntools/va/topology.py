@@ -0,0 +1,395 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+BMeshの隣接関係をCSR(Compressed Sparse Row)形式のnumpy配列で保持する。
+
+vabmesh.vert_verts_dict()等はBMeshの要素をキーとしたlistの辞書を作るが、
+こちらは要素のインデックス(bm.verts等の並び順)の配列で表す。
+i番目の要素に隣接する要素のインデックスは
+    csr.indices[csr.offsets[i]:csr.offsets[i + 1]]
+で参照する。
+
+配列から隣接関係を求める関数はbpyに依存しないので、BMeshを用いなくても
+(E, 2)の辺の配列や面の頂点配列から直接構築出来る。
+"""
+
+
+import numpy as np
+
+
+__all__ = ('CSR', 'Topology')
+
+
+#==============================================================================
+# CSR
+#==============================================================================
+class CSR:
+    """要素毎の可変長のインデックス配列。
+    offsets: 長さ num + 1 の配列。
+    indices: 長さ offsets[-1] の配列。
+    """
+
+    __slots__ = ('offsets', 'indices')
+
+    def __init__(self, offsets, indices):
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.indices = np.asarray(indices, dtype=int)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """:rtype: numpy.ndarray"""
+        return self.indices[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return '<CSR: {} rows, {} items>'.format(len(self), len(self.indices))
+
+    @property
+    def counts(self):
+        """要素毎の隣接数
+        :rtype: numpy.ndarray
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self):
+        """indicesと同じ長さで、各値が属する行番号を格納した配列
+        :rtype: numpy.ndarray
+        """
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def to_lists(self):
+        """:rtype: list[list[int]]"""
+        return [self.indices[i:j].tolist()
+                for i, j in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def to_dict(self, elements, mask=None):
+        """vabmesh.vert_verts_dict()等と同じ形式の辞書に変換する。
+        :param elements: bm.verts等、インデックスに対応する要素のシーケンス
+        :param mask: 真となる要素だけキーに含める。Noneなら全て。
+        :type mask: numpy.ndarray | None
+        :rtype: dict
+        """
+        elements = list(elements)
+        d = {}
+        for i, ls in enumerate(self.to_lists()):
+            if mask is None or mask[i]:
+                d[elements[i]] = [elements[j] for j in ls]
+        return d
+
+    @classmethod
+    def from_pairs(cls, num, rows, cols, unique=False):
+        """(rows[k], cols[k])の組から生成する。同じ行内の並びは入力順を維持する。
+        :param num: 行数
+        :type num: int
+        :type rows: numpy.ndarray
+        :type cols: numpy.ndarray
+        :param unique: 重複する組を取り除く。この場合行内は昇順になる。
+        :type unique: bool
+        :rtype: CSR
+        """
+        rows = np.asarray(rows, dtype=int)
+        cols = np.asarray(cols, dtype=int)
+        if unique and len(rows):
+            base = int(cols.max()) + 1
+            keys = np.unique(rows * base + cols)
+            rows = keys // base
+            cols = keys % base
+        else:
+            order = np.argsort(rows, kind='mergesort')
+            rows = rows[order]
+            cols = cols[order]
+        offsets = np.zeros(num + 1, dtype=int)
+        np.cumsum(np.bincount(rows, minlength=num), out=offsets[1:])
+        return cls(offsets, cols)
+
+    def transposed(self, num=None):
+        """逆引きのCSRを返す。vert_faces -> face_verts等。
+        :param num: 列側の要素数。Noneならindicesの最大値 + 1
+        :type num: int | None
+        :rtype: CSR
+        """
+        if num is None:
+            num = int(self.indices.max()) + 1 if len(self.indices) else 0
+        return self.from_pairs(num, self.indices, self.rows)
+
+
+#==============================================================================
+# 配列からの構築
+#==============================================================================
+def _pairs_in_rows(csr):
+    """同じ行に含まれる値の全ての組み合わせ(順列)を返す。自身との組は除く。
+    :type csr: CSR
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    counts = csr.counts
+    row_of_item = csr.rows
+    # 各itemを、それが属する行の長さ分だけ複製する
+    item_counts = counts[row_of_item]
+    a = np.repeat(np.arange(len(csr.indices)), item_counts)
+    starts = np.repeat(csr.offsets[row_of_item], item_counts)
+    local = np.arange(len(a)) - np.repeat(
+        np.cumsum(item_counts) - item_counts, item_counts)
+    b = starts + local
+    valid = a != b
+    return csr.indices[a[valid]], csr.indices[b[valid]]
+
+
+def _masked(mask, num):
+    if mask is None:
+        return np.ones(num, dtype=bool)
+    return np.asarray(mask, dtype=bool)
+
+
+def vert_verts_csr(num_verts, edge_verts, edge_mask=None):
+    """辺で繋がった頂点。
+    :param edge_verts: (E, 2)の配列
+    :param edge_mask: 真となる辺のみ対象とする
+    :rtype: CSR
+    """
+    edge_verts = np.asarray(edge_verts, dtype=int).reshape(-1, 2)
+    ev = edge_verts[_masked(edge_mask, len(edge_verts))]
+    rows = np.concatenate((ev[:, 0], ev[:, 1]))
+    cols = np.concatenate((ev[:, 1], ev[:, 0]))
+    return CSR.from_pairs(num_verts, rows, cols)
+
+
+def vert_edges_csr(num_verts, edge_verts, edge_mask=None):
+    """頂点に接続する辺。
+    :rtype: CSR
+    """
+    edge_verts = np.asarray(edge_verts, dtype=int).reshape(-1, 2)
+    edge_indices = np.flatnonzero(_masked(edge_mask, len(edge_verts)))
+    ev = edge_verts[edge_indices]
+    rows = np.concatenate((ev[:, 0], ev[:, 1]))
+    cols = np.concatenate((edge_indices, edge_indices))
+    return CSR.from_pairs(num_verts, rows, cols)
+
+
+def edge_edges_csr(num_verts, edge_verts, edge_mask=None):
+    """頂点を共有する辺。
+    :rtype: CSR
+    """
+    edge_verts = np.asarray(edge_verts, dtype=int).reshape(-1, 2)
+    vert_edges = vert_edges_csr(num_verts, edge_verts, edge_mask)
+    a, b = _pairs_in_rows(vert_edges)
+    return CSR.from_pairs(len(edge_verts), a, b, unique=True)
+
+
+def vert_faces_csr(num_verts, face_verts, face_mask=None):
+    """頂点を含む面。
+    :param face_verts: 面毎の頂点インデックス
+    :type face_verts: CSR
+    :rtype: CSR
+    """
+    mask = _masked(face_mask, len(face_verts))
+    rows = face_verts.rows
+    valid = mask[rows]
+    return CSR.from_pairs(num_verts, face_verts.indices[valid], rows[valid])
+
+
+def face_faces_csr(num_elems, face_elems, face_mask=None):
+    """要素を共有する面。
+    :param num_elems: face_elemsが参照する要素の数
+    :param face_elems: 面毎の辺のインデックスなら辺で接続する面、
+        頂点のインデックスなら頂点で接続する面を求める。
+    :type face_elems: CSR
+    :rtype: CSR
+    """
+    elem_faces = vert_faces_csr(num_elems, face_elems, face_mask)
+    a, b = _pairs_in_rows(elem_faces)
+    return CSR.from_pairs(len(face_elems), a, b, unique=True)
+
+
+#==============================================================================
+# Topology
+#==============================================================================
+class Topology:
+    """BMeshから辺と面の構成を一度だけ読み込み、各隣接関係を必要に応じて
+    構築してキャッシュする。
+    select, hideの扱いはvabmesh.vert_verts_dict()等と同じで、
+    頂点同士・辺同士の接続は辺の状態で、面は面の状態で判別する。
+    select:  True:選択中, False:非選択, None:全て
+    hide:    True:非表示, False:表示, None:全て
+
+    topo = Topology(bm, select=True, hide=False)
+    for i in topo.vert_verts[3]:
+        ...
+    """
+
+    def __init__(self, bm=None, select=None, hide=None):
+        self._cache = {}
+        self.num_verts = 0
+        self.edge_verts = np.zeros((0, 2), dtype=int)
+        self.face_verts = CSR([0], [])
+        self.face_edges = CSR([0], [])
+        self.edge_mask = np.zeros(0, dtype=bool)
+        self.face_mask = np.zeros(0, dtype=bool)
+        if bm is not None:
+            self._read_bmesh(bm, select, hide)
+
+    @classmethod
+    def from_arrays(cls, num_verts, edge_verts, face_verts,
+                    edge_mask=None, face_mask=None):
+        """BMeshを使わずに生成する。face_edgesはedge_vertsから求める。
+        :param edge_verts: (E, 2)の配列
+        :param face_verts: 面毎の頂点インデックスのリストかCSR
+        :type face_verts: CSR | list[list[int]]
+        :rtype: Topology
+        """
+        self = cls()
+        self.num_verts = num_verts
+        self.edge_verts = np.asarray(edge_verts, dtype=int).reshape(-1, 2)
+        if not isinstance(face_verts, CSR):
+            counts = [len(vs) for vs in face_verts]
+            offsets = np.zeros(len(counts) + 1, dtype=int)
+            np.cumsum(counts, out=offsets[1:])
+            indices = [i for vs in face_verts for i in vs]
+            face_verts = CSR(offsets, indices)
+        self.face_verts = face_verts
+
+        # 面の各辺(頂点の組)から辺のインデックスを引く
+        keys = {}
+        for i, (v1, v2) in enumerate(self.edge_verts.tolist()):
+            keys[(v1, v2) if v1 < v2 else (v2, v1)] = i
+        indices = []
+        for vs in face_verts.to_lists():
+            for v1, v2 in zip(vs, vs[1:] + vs[:1]):
+                indices.append(keys[(v1, v2) if v1 < v2 else (v2, v1)])
+        self.face_edges = CSR(face_verts.offsets, indices)
+
+        self.edge_mask = _masked(edge_mask, len(self.edge_verts))
+        self.face_mask = _masked(face_mask, len(face_verts))
+        return self
+
+    def _read_bmesh(self, bm, select, hide):
+        def check(ele):
+            return ((select is None or ele.select == select) and
+                    (hide is None or ele.hide == hide))
+
+        vert_index = {eve: i for i, eve in enumerate(bm.verts)}
+        self.num_verts = len(vert_index)
+
+        edge_index = {}
+        edge_verts = []
+        edge_mask = []
+        for i, eed in enumerate(bm.edges):
+            edge_index[eed] = i
+            v1, v2 = eed.verts
+            edge_verts.append((vert_index[v1], vert_index[v2]))
+            edge_mask.append(check(eed))
+
+        counts = []
+        face_verts = []
+        face_edges = []
+        face_mask = []
+        for efa in bm.faces:
+            counts.append(len(efa.loops))
+            for loop in efa.loops:
+                face_verts.append(vert_index[loop.vert])
+                face_edges.append(edge_index[loop.edge])
+            face_mask.append(check(efa))
+        offsets = np.zeros(len(counts) + 1, dtype=int)
+        np.cumsum(counts, out=offsets[1:])
+
+        self.edge_verts = np.array(edge_verts, dtype=int).reshape(-1, 2)
+        self.face_verts = CSR(offsets, face_verts)
+        self.face_edges = CSR(offsets, face_edges)
+        self.edge_mask = np.array(edge_mask, dtype=bool)
+        self.face_mask = np.array(face_mask, dtype=bool)
+
+    def _cached(self, name, func, *args):
+        try:
+            return self._cache[name]
+        except KeyError:
+            result = self._cache[name] = func(*args)
+            return result
+
+    def cache_clear(self):
+        self._cache.clear()
+
+    @property
+    def num_edges(self):
+        return len(self.edge_verts)
+
+    @property
+    def num_faces(self):
+        return len(self.face_verts)
+
+    @property
+    def vert_verts(self):
+        """辺で繋がった頂点
+        :rtype: CSR
+        """
+        return self._cached('vert_verts', vert_verts_csr, self.num_verts,
+                            self.edge_verts, self.edge_mask)
+
+    @property
+    def vert_edges(self):
+        """頂点に接続する辺
+        :rtype: CSR
+        """
+        return self._cached('vert_edges', vert_edges_csr, self.num_verts,
+                            self.edge_verts, self.edge_mask)
+
+    @property
+    def edge_edges(self):
+        """頂点を共有する辺
+        :rtype: CSR
+        """
+        return self._cached('edge_edges', edge_edges_csr, self.num_verts,
+                            self.edge_verts, self.edge_mask)
+
+    @property
+    def vert_faces(self):
+        """頂点を含む面
+        :rtype: CSR
+        """
+        return self._cached('vert_faces', vert_faces_csr, self.num_verts,
+                            self.face_verts, self.face_mask)
+
+    @property
+    def edge_faces(self):
+        """辺を含む面
+        :rtype: CSR
+        """
+        return self._cached('edge_faces', vert_faces_csr, self.num_edges,
+                            self.face_edges, self.face_mask)
+
+    @property
+    def face_faces(self):
+        """辺を共有する面
+        :rtype: CSR
+        """
+        return self._cached('face_faces', face_faces_csr, self.num_edges,
+                            self.face_edges, self.face_mask)
+
+    @property
+    def face_faces_vert(self):
+        """頂点を共有する面
+        :rtype: CSR
+        """
+        return self._cached('face_faces_vert', face_faces_csr,
+                            self.num_verts, self.face_verts, self.face_mask)
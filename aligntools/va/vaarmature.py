@@ -48,6 +48,7 @@ import bpy
 #from bpy.props import *
 #import mathutils as Math
 from mathutils import Matrix, Euler, Vector, Quaternion
+import numpy as np
 
 from . import vamath as vam
 
@@ -242,3 +243,273 @@ def vec_roll_to_mat3(vec, roll):
 
     rMatrix = Quaternion(nor, roll).to_matrix()
     return rMatrix * bMatrix
+
+
+###############################################################################
+# Batch
+###############################################################################
+def vec_roll_to_mat3_array(vecs, rolls):
+    """vec_roll_to_mat3()のnumpy版。
+    :param vecs: (N, 3)
+    :param rolls: (N,)
+    :return: (N, 3, 3)。mat[:, row, col]
+    :rtype: numpy.ndarray
+    """
+    THETA_THRESHOLD_NEGY = 1.0e-9
+    THETA_THRESHOLD_NEGY_CLOSE = 1.0e-5
+
+    vecs = np.asarray(vecs, dtype=float).reshape(-1, 3)
+    rolls = np.asarray(rolls, dtype=float).reshape(-1)
+    length = np.sqrt((vecs * vecs).sum(axis=1))
+    length[length == 0.0] = 1.0
+    nor = vecs / length[:, None]
+    x, y, z = nor[:, 0], nor[:, 1], nor[:, 2]
+
+    num = len(nor)
+    b = np.zeros((num, 3, 3))
+    theta = 1.0 + y
+    close = theta > THETA_THRESHOLD_NEGY_CLOSE
+    near = ~close & ((x != 0.0) | (z != 0.0)) & (theta > THETA_THRESHOLD_NEGY)
+    flip = ~close & ~near
+
+    general = close | near
+    b[general, 1, 0] = -x[general]
+    b[general, 0, 1] = x[general]
+    b[general, 1, 1] = y[general]
+    b[general, 2, 1] = z[general]
+    b[general, 1, 2] = -z[general]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = theta[close]
+        b[close, 0, 0] = 1 - x[close] * x[close] / t
+        b[close, 2, 2] = 1 - z[close] * z[close] / t
+        b[close, 0, 2] = b[close, 2, 0] = -x[close] * z[close] / t
+        t = x[near] * x[near] + z[near] * z[near]
+        b[near, 0, 0] = (x[near] + z[near]) * (x[near] - z[near]) / -t
+        b[near, 2, 2] = -b[near, 0, 0]
+        b[near, 0, 2] = b[near, 2, 0] = 2.0 * x[near] * z[near] / t
+    b[flip, 0, 0] = b[flip, 1, 1] = -1.0
+    b[flip, 2, 2] = 1.0
+
+    # norを軸にrollだけ回転 (Rodrigues)
+    c = np.cos(rolls)[:, None, None]
+    s = np.sin(rolls)[:, None, None]
+    k = np.zeros((num, 3, 3))
+    k[:, 0, 1], k[:, 0, 2], k[:, 1, 2] = -z, y, -x
+    k[:, 1, 0], k[:, 2, 0], k[:, 2, 1] = z, -y, x
+    r = (c * np.eye(3) + s * k +
+         (1.0 - c) * nor[:, :, None] * nor[:, None, :])
+    return np.matmul(r, b)
+
+
+def mat3_to_vec_roll_array(mats):
+    """mat3_to_vec_roll()のnumpy版。
+    :param mats: (N, 3, 3)又は(N, 4, 4)。mat[:, row, col]
+    :return: vecs (N, 3), rolls (N,)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    mats = np.asarray(mats, dtype=float)[:, :3, :3]
+    vecs = mats[:, :, 1].copy()
+    vecmats = vec_roll_to_mat3_array(vecs, np.zeros(len(vecs)))
+    rollmats = np.matmul(vecmats.transpose(0, 2, 1), mats)
+    rolls = np.arctan2(rollmats[:, 0, 2], rollmats[:, 2, 2])
+    return vecs, rolls
+
+
+def _foreach_get(collection, attr, size):
+    arr = np.zeros(len(collection) * size, dtype=np.float32)
+    collection.foreach_get(attr, arr)
+    return arr.reshape(len(collection), size).astype(float)
+
+
+def _foreach_get_matrices(collection, attr):
+    # foreach_getは列優先で並ぶ
+    arr = _foreach_get(collection, attr, 16).reshape(-1, 4, 4)
+    return arr.transpose(0, 2, 1)
+
+
+def _foreach_set(collection, attr, arr):
+    collection.foreach_set(attr, np.ravel(arr).astype(np.float32))
+
+
+def _parent_indices(bones, indices):
+    return np.array([indices[b.parent.name] if b.parent else -1
+                     for b in bones], dtype=int)
+
+
+def hierarchy_levels(parents):
+    """親のインデックスの配列から、階層毎のインデックスの配列を返す。
+    :param parents: (N,)。親が無いものは-1
+    :return: root側から順に並んだ配列のリスト
+    :rtype: list[numpy.ndarray]
+    """
+    parents = np.asarray(parents, dtype=int)
+    depths = np.zeros(len(parents), dtype=int)
+    current = parents.copy()
+    while True:
+        alive = current != -1
+        if not alive.any():
+            break
+        depths[alive] += 1
+        current[alive] = parents[current[alive]]
+        if depths.max() > len(parents):
+            raise ValueError('cyclic parent')
+    order = np.argsort(depths, kind='mergesort')
+    counts = np.bincount(depths)
+    return [arr for arr in np.split(order, np.cumsum(counts)[:-1])]
+
+
+class EditBoneArrays:
+    """EditBoneのhead, tail, rollを配列として纏めて読み書きする。
+    座標はArmatureのlocal座標系。
+    """
+
+    def __init__(self, arm):
+        """
+        :type arm: bpy.types.Armature
+        """
+        self.arm = arm
+        bones = arm.edit_bones
+        self.names = [b.name for b in bones]
+        self.indices = {name: i for i, name in enumerate(self.names)}
+        self.parents = _parent_indices(bones, self.indices)
+        self.use_connect = np.array([b.use_connect for b in bones],
+                                    dtype=bool)
+        self.heads = _foreach_get(bones, 'head', 3)
+        self.tails = _foreach_get(bones, 'tail', 3)
+        self.rolls = _foreach_get(bones, 'roll', 1).reshape(-1)
+        self.head_changed = np.zeros(len(self.names), dtype=bool)
+        self.tail_changed = np.zeros(len(self.names), dtype=bool)
+
+    def set_heads(self, indices, heads):
+        self.heads[indices] = heads
+        self.head_changed[indices] = True
+
+    def set_tails(self, indices, tails):
+        self.tails[indices] = tails
+        self.tail_changed[indices] = True
+
+    def set_bones(self, indices, heads, tails, z_axes):
+        """headとtailを設定し、Z軸がz_axesに最も近くなるようrollを求める。
+        EditBone.align_roll()と同等。
+        """
+        indices = np.asarray(indices, dtype=int)
+        self.set_heads(indices, heads)
+        self.set_tails(indices, tails)
+        y = self.tails[indices] - self.heads[indices]
+        valid = (y != 0.0).any(axis=1)
+        mats = vec_roll_to_mat3_array(y, self.rolls[indices])
+        z = np.asarray(z_axes, dtype=float).reshape(-1, 3)
+        # z軸をyに直交させる
+        yn = mats[:, :, 1]
+        z = z - yn * (z * yn).sum(axis=1)[:, None]
+        z_len = np.sqrt((z * z).sum(axis=1))
+        valid &= z_len > 0.0
+        z[valid] /= z_len[valid, None]
+        mats[valid, :, 2] = z[valid]
+        mats[valid, :, 0] = np.cross(yn[valid], z[valid])
+        _vecs, rolls = mat3_to_vec_roll_array(mats[valid])
+        self.rolls[indices[valid]] = rolls
+
+    def update_connected(self):
+        """use_connectが真の親子のheadとtailを一致させる。
+        headを変更した物は親のtailを、tailを変更した物は子のheadを
+        変更する。
+        """
+        connected = np.flatnonzero(self.use_connect & (self.parents != -1))
+        moved = connected[self.head_changed[connected]]
+        self.tails[self.parents[moved]] = self.heads[moved]
+        self.tail_changed[self.parents[moved]] = True
+        follow = connected[self.tail_changed[self.parents[connected]]]
+        self.heads[follow] = self.tails[self.parents[follow]]
+        self.head_changed[follow] = True
+
+    def write(self):
+        bones = self.arm.edit_bones
+        _foreach_set(bones, 'head', self.heads)
+        _foreach_set(bones, 'tail', self.tails)
+        _foreach_set(bones, 'roll', self.rolls)
+
+
+class PoseBoneArrays:
+    """PoseBoneの行列を配列として纏めて読み書きする。
+    行列はArmatureのlocal座標系で、mat[:, row, col]。
+    """
+
+    def __init__(self, ob):
+        """
+        :param ob: Armature Object
+        :type ob: bpy.types.Object
+        """
+        self.ob = ob
+        pose_bones = ob.pose.bones
+        bones = ob.data.bones
+        self.names = [b.name for b in pose_bones]
+        self.indices = {name: i for i, name in enumerate(self.names)}
+        self.parents = _parent_indices(pose_bones, self.indices)
+        self.levels = hierarchy_levels(self.parents)
+        self.matrices = _foreach_get_matrices(pose_bones, 'matrix')
+        self.bases = _foreach_get_matrices(pose_bones, 'matrix_basis')
+
+        bone_indices = [bones.find(name) for name in self.names]
+        rests = _foreach_get_matrices(bones, 'matrix_local')[bone_indices]
+        # 親のpose行列からbone自身のbasis適用前の行列への変換
+        self.offsets = rests.copy()
+        has_parent = self.parents != -1
+        self.offsets[has_parent] = np.matmul(
+            np.linalg.inv(rests[self.parents[has_parent]]),
+            rests[has_parent])
+        self.inherit = np.array(
+            [b.use_inherit_rotation and b.use_inherit_scale and
+             b.use_local_location for b in (bones[i] for i in bone_indices)],
+            dtype=bool)
+
+    def set_matrices(self, indices, matrices):
+        """PoseBone.matrixに相当する行列を纏めて設定する。
+        親子関係にある物は階層順に一度で求める。選択外の子孫の行列は
+        basisから求め直す。
+        :param indices: (N,)
+        :param matrices: (N, 4, 4)
+        :return: 継承設定が既定でない為に計算出来なかった場合はFalse
+        :rtype: bool
+        """
+        indices = np.asarray(indices, dtype=int)
+        num = len(self.names)
+        targets = np.zeros(num, dtype=bool)
+        targets[indices] = True
+        new_matrices = self.matrices.copy()
+        new_matrices[indices] = matrices
+
+        affected = targets.copy()
+        for level in self.levels:
+            has_parent = self.parents[level] != -1
+            if not has_parent.any():
+                continue
+            level = level[has_parent]
+            affected[level] |= affected[self.parents[level]]
+        if not self.inherit[affected].all():
+            return False
+
+        for level in self.levels:
+            level = level[affected[level]]
+            if not len(level):
+                continue
+            parent_mats = np.tile(np.eye(4), (len(level), 1, 1))
+            has_parent = self.parents[level] != -1
+            parent_mats[has_parent] = new_matrices[
+                self.parents[level[has_parent]]]
+            bind = np.matmul(parent_mats, self.offsets[level])
+            is_target = targets[level]
+            # 対象外は親に追従させる
+            follow = level[~is_target]
+            new_matrices[follow] = np.matmul(bind[~is_target],
+                                             self.bases[follow])
+            target = level[is_target]
+            self.bases[target] = np.matmul(
+                np.linalg.inv(bind[is_target]), new_matrices[target])
+        self.matrices = new_matrices
+        return True
+
+    def write(self):
+        _foreach_set(self.ob.pose.bones, 'matrix_basis',
+                     self.bases.transpose(0, 2, 1))
+
@@ -29,6 +29,7 @@ import mathutils as Math
 from mathutils import Matrix, Euler, Vector, Quaternion
 import mathutils.geometry as geom
 import bmesh
+import numpy as np
 
 from .. import localutils
 from ..localutils.checkargs import CheckArgs
@@ -74,6 +75,8 @@ def vert_verts_dict(bm=None, select=None, hide=None, verts=None, edges=None):
              [BMEdge, ...] or [(BMVert, BMVert), ...] or [(3, 1), (7, 3), ...]
     
     return:     type:dict. key:BMVert value:接続するBMVertのリスト。
+
+    配列で扱う場合はtopology.Topology.vert_vertsを使う。
     """
 
     if verts:
@@ -175,12 +178,14 @@ def face_faces_dict(bm=None, select=None, hide=None, faces=None,
         for efa in faces:
             for eve in efa.verts:
                 vert_faces[eve].append(efa)
+        # 辺で接続していたら重複するので追加済みのものを集合で判定する
+        linked = {efa: set() for efa in faces}
         for bmfaces in vert_faces.values():
             for bmf1, bmf2 in combinations(bmfaces, 2):
-                # 辺で接続していたら重複するのでifを付ける
-                if bmf2 not in face_faces[bmf1]:
+                if bmf2 not in linked[bmf1]:
+                    linked[bmf1].add(bmf2)
+                    linked[bmf2].add(bmf1)
                     face_faces[bmf1].append(bmf2)
-                if bmf1 not in face_faces[bmf2]:
                     face_faces[bmf2].append(bmf1)
     else:
         edge_faces = defaultdict(list)
@@ -198,25 +203,106 @@ def face_faces_dict(bm=None, select=None, hide=None, faces=None,
 #==============================================================================
 # Connect
 #==============================================================================
+def _linked_groups(adjacency):
+    """隣接辞書のキーを連結成分毎に纏めた二次元リストを返す。
+    成分の並びは最初に出現するキーの順、成分内はキーの順となる。
+    """
+    keys = list(adjacency.keys())
+    index = {key: i for i, key in enumerate(keys)}
+    pairs = ((i, index[other]) for i, key in enumerate(keys)
+             for other in adjacency[key] if other in index)
+    labels = localutils.utils.connected_components(len(keys), pairs)
+    return [[keys[i] for i in group]
+            for group in localutils.utils.groups_from_labels(labels)]
+
+
 def linked_vertices_list(bm=None, select=None, hide=None,
                          verts=None, edges=None):
     """辺で繋がった頂点の二次元リストを返す"""
     vert_verts = vert_verts_dict(bm, select=select, hide=hide,
                                  verts=verts, edges=edges)
-    def key(v1, v2, data):
-        return v1 in data[v2] or v2 in data[v1]
-    return localutils.utils.groupwith(vert_verts.keys(), key, vert_verts)
+    return _linked_groups(vert_verts)
 
 
+def _linked_faces_labels(faces, connect_vert=False):
+    """facesの並び順でラベルのリストを返す。
+    face_faces_dict()を経由せず、辺(若しくは頂点)毎に最初に見つけた面とだけ
+    組を作るので面の数に対して線形となる。
+    """
+    first_face = {}
+    pairs = []
+    for i, efa in enumerate(faces):
+        for ele in (efa.verts if connect_vert else efa.edges):
+            j = first_face.setdefault(ele, i)
+            if j != i:
+                pairs.append((j, i))
+    return localutils.utils.connected_components(len(faces), pairs)
+
 
 def linked_faces_list(bm=None, select=None, hide=None, faces=None,
                       connect_vert=False):
     """繋がった面の二次元のリストを返す。"""
-    face_faces = face_faces_dict(bm, select, hide, faces=faces,
-                                 connect_vert=connect_vert)
-    def key(f1, f2, data):
-        return f1 in data[f2] or f2 in data[f1]
-    return localutils.utils.groupwith(face_faces.keys(), key, face_faces)
+    if faces is None:
+        faces = [efa for efa in bm.faces
+                 if (select is None or efa.select == select) and
+                    (hide is None or efa.hide == hide)]
+    else:
+        faces = list(faces)
+    labels = _linked_faces_labels(faces, connect_vert)
+    return [[faces[i] for i in group]
+            for group in localutils.utils.groups_from_labels(labels)]
+
+
+def linked_vertices_labels(bm, select=None, hide=None):
+    """辺で繋がった頂点の連結成分のラベルを返す。
+    selectとhideの扱いはvert_verts_dict()と同じ。
+    :type bm: bmesh.types.BMesh
+    :return: bm.vertsの並び順でラベルを格納した配列。対象外の頂点は-1。
+        localutils.utils.groups_from_labels()でインデックスの二次元リストに
+        変換出来る。
+    :rtype: numpy.ndarray
+    """
+    labels = np.full(len(bm.verts), -1, dtype=int)
+    targets = []
+    index = {}
+    for i, eve in enumerate(bm.verts):
+        if ((select is None or eve.select == select) and
+                (hide is None or eve.hide == hide)):
+            targets.append(i)
+            index[eve] = len(index)
+    if not index:
+        return labels
+    pairs = []
+    for eed in bm.edges:
+        if ((select is None or eed.select == select) and
+                (hide is None or eed.hide == hide)):
+            v1, v2 = eed.verts
+            if v1 in index and v2 in index:
+                pairs.append((index[v1], index[v2]))
+    labels[targets] = localutils.utils.connected_components(len(index),
+                                                            pairs)
+    return labels
+
+
+def linked_faces_labels(bm, select=None, hide=None, connect_vert=False):
+    """繋がった面の連結成分のラベルを返す。
+    :type bm: bmesh.types.BMesh
+    :param connect_vert: Trueなら頂点を共有している面同士は隣接しているとみなす。
+    :type connect_vert: bool
+    :return: bm.facesの並び順でラベルを格納した配列。対象外の面は-1。
+    :rtype: numpy.ndarray
+    """
+    labels = np.full(len(bm.faces), -1, dtype=int)
+    targets = []
+    faces = []
+    for i, efa in enumerate(bm.faces):
+        if ((select is None or efa.select == select) and
+                (hide is None or efa.hide == hide)):
+            targets.append(i)
+            faces.append(efa)
+    if faces:
+        labels[targets] = _linked_faces_labels(faces, connect_vert)
+    return labels
 
 
 #==============================================================================
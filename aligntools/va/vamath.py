@@ -1585,23 +1585,26 @@ def get_poly_morton_number_3d(vecs, sx, sy, sz, level):
     return lv, number
 
 
-def make_liner_octree_call(polygons, bbox_min, bbox_max, level=4):
+def make_liner_octree_call(polygons, bbox_min=None, bbox_max=None, level=4):
     """
     pylogons: 2d list of Vector. [(Vector, Vector, Vector), ...]
-    bbox_min: (xmin, ymin, zmin)
+              or np.ndarray (N, 3, 3)
+    bbox_min: (xmin, ymin, zmin). Noneならpolygonsから求める
     bbox_max: (xmax, ymax, zmax])
     level: int. bbox subdivide level
+    return: octree.LinearOctree. 要素番号はpolygonsのインデックスと一致する
     """
-    liner_octree_size = sum_geometric_progression(1, 8, level)
-    liner_octree = [[] for i in range(liner_octree_size)]
-    bbox_min = Vector(bbox_min)
-    bbox_max = Vector(bbox_max)
-    sx, sy, sz = bbox_max - bbox_min
-    for poly in polygons:
-        vecs = [v - bbox_min for v in poly]
-        lv, morton_number = get_poly_morton_number_3d(vecs, sx, sy, sz, level)
-        i = sum_geometric_progression(1, 8, lv - 1) + morton_number
-        liner_octree[i].append(poly)
+    from .octree import LinearOctree
+
+    arr = np.array([[tuple(v) for v in poly] for poly in polygons]
+                   if not isinstance(polygons, np.ndarray) else polygons,
+                   dtype=float)
+    if bbox_min is None or bbox_max is None:
+        return LinearOctree.from_triangles(arr, level)
+    liner_octree = LinearOctree(bbox_min, bbox_max, level)
+    liner_octree.insert(arr.min(axis=1), arr.max(axis=1))
+    liner_octree.triangles = arr
+    return liner_octree
 
 class Face:
     def __init__(self):
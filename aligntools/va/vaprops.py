@@ -18,8 +18,10 @@
 
 
 from functools import wraps as _wraps
+import os as _os
 import pickle as _pickle
-import shelve as _shelve
+import struct as _struct
+import tempfile as _tempfile
 import inspect as _inspect
 import logging as _logging
 
@@ -939,8 +941,201 @@ def undump(prop_dict, obj):
 ###############################################################################
 # save / load
 ###############################################################################
-def save(file_path, prop_obj, include=None, exclude=None, clear=True):
+SNAPSHOT_EXT = '.vaps'
+SNAPSHOT_MAGIC = b'VAPS'
+SNAPSHOT_VERSION = 1
+
+_SNAPSHOT_HEADER = _struct.Struct('<4sHI')  # magic, version, 要素数
+_SNAPSHOT_RECORD = _struct.Struct('<HI')  # keyの長さ, 値の長さ
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class _Snapshot:
+    """一つのファイルに対応するキャッシュ。
+    blobs: keyとpickle化した値の辞書
+    values: blobsを展開した値。呼び出し側と共有しないこと
+    """
+
+    __slots__ = ('blobs', 'values', 'mtime')
+
+    def __init__(self):
+        self.blobs = {}
+        self.values = {}
+        self.mtime = None
+
+    def get(self):
+        """値を複製して返す"""
+        return {key: _pickle.loads(blob) for key, blob in self.blobs.items()}
+
+    def update(self, d):
+        """変更された値だけをpickle化する。
+        :return: 変更があれば真
+        :rtype: bool
+        """
+        changed = False
+        for key, value in d.items():
+            if key in self.values:
+                try:
+                    if self.values[key] == value:
+                        continue
+                except Exception:  # 比較できない型
+                    pass
+            blob = _pickle.dumps(value, _pickle.HIGHEST_PROTOCOL)
+            if self.blobs.get(key) != blob:
+                changed = True
+            self.blobs[key] = blob
+            # 呼び出し側が後でvalueを書き換えても影響しないように展開した物
+            self.values[key] = _pickle.loads(blob)
+        return changed
+
+    def remove(self, keys):
+        changed = False
+        for key in list(keys):
+            if key in self.blobs:
+                del self.blobs[key]
+                del self.values[key]
+                changed = True
+        return changed
+
+    def clear(self):
+        changed = bool(self.blobs)
+        self.blobs.clear()
+        self.values.clear()
+        return changed
+
+    def encode(self):
+        buf = [_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                     len(self.blobs))]
+        for key, blob in sorted(self.blobs.items()):
+            key_ = key.encode('utf-8')
+            buf.append(_SNAPSHOT_RECORD.pack(len(key_), len(blob)))
+            buf.append(key_)
+            buf.append(blob)
+        return b''.join(buf)
+
+    @classmethod
+    def decode(cls, data):
+        header_size = _SNAPSHOT_HEADER.size
+        record_size = _SNAPSHOT_RECORD.size
+        if len(data) < header_size:
+            raise SnapshotError('truncated header')
+        magic, version, num = _SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError('not a snapshot file')
+        if version > SNAPSHOT_VERSION:
+            raise SnapshotError('unsupported version: {}'.format(version))
+        snapshot = cls()
+        offset = header_size
+        for _ in range(num):
+            if offset + record_size > len(data):
+                raise SnapshotError('truncated record')
+            key_len, blob_len = _SNAPSHOT_RECORD.unpack_from(data, offset)
+            offset += record_size
+            if offset + key_len + blob_len > len(data):
+                raise SnapshotError('truncated record')
+            key = data[offset: offset + key_len].decode('utf-8')
+            offset += key_len
+            blob = data[offset: offset + blob_len]
+            offset += blob_len
+            snapshot.blobs[key] = blob
+            snapshot.values[key] = _pickle.loads(blob)
+        return snapshot
+
+
+_snapshots = {}
+"""ファイルパスをキーとする_Snapshotのキャッシュ。
+オペレータを呼び出す度にファイルを読み直さないようにする"""
+
+
+def snapshot_path(file_path):
+    return file_path + SNAPSHOT_EXT
+
+
+def _get_mtime(path):
+    try:
+        return _os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    """一時ファイルに書き込んでから置き換える"""
+    dir_path = _os.path.dirname(path) or '.'
+    fd, tmp_path = _tempfile.mkstemp(
+        prefix='.' + _os.path.basename(path), suffix='.tmp', dir=dir_path)
+    try:
+        with _os.fdopen(fd, 'wb') as f:
+            f.write(snapshot.encode())
+        _os.replace(tmp_path, path)
+    except Exception:
+        try:
+            _os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    snapshot.mtime = _get_mtime(path)
+
+
+def _migrate_shelve(file_path):
+    """旧形式(shelve)のファイルを読み込む。無ければNoneを返す"""
+    import dbm
+    import shelve
+    try:
+        shelf = shelve.open(file_path, 'r')
+    except dbm.error:
+        return None
+    except Exception as err:
+        _logger.error(str(err))
+        return None
+    try:
+        d = dict(shelf)
+    finally:
+        shelf.close()
+    return d
+
+
+def _read_snapshot(file_path):
+    """キャッシュ、スナップショット、旧shelveの順に探す。
+    :rtype: _Snapshot
     """
+    path = snapshot_path(file_path)
+    mtime = _get_mtime(path)
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and (mtime is None or snapshot.mtime == mtime):
+        return snapshot
+
+    if mtime is not None:
+        with open(path, 'rb') as f:
+            snapshot = _Snapshot.decode(f.read())
+        snapshot.mtime = mtime
+    else:
+        snapshot = _Snapshot()
+        d = _migrate_shelve(file_path)
+        if d is not None:
+            snapshot.update(d)
+            try:
+                _write_snapshot(path, snapshot)
+                _logger.info("migrated '{}' to '{}'".format(file_path, path))
+            except Exception as err:
+                _logger.error(str(err))
+    _snapshots[path] = snapshot
+    return snapshot
+
+
+def clear_cache(file_path=None):
+    """メモリ上のキャッシュを破棄する"""
+    if file_path is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(snapshot_path(file_path), None)
+
+
+def save(file_path, prop_obj, include=None, exclude=None, clear=True):
+    """file_path + SNAPSHOT_EXT に保存する。前回から値が変わっていなければ
+    書き込まない。
     :type file_path: str
     :type prop_obj: dict | object
     :type include: dict
@@ -956,36 +1151,44 @@ def save(file_path, prop_obj, include=None, exclude=None, clear=True):
             d = dict(d)
         d.update(include)
     if exclude:
-        for key in exclude:
-            if key in d:
-                del d[key]
+        d = {k: v for k, v in d.items() if k not in exclude}
     try:
-        shelf = _shelve.open(file_path)
+        snapshot = _read_snapshot(file_path)
     except Exception as err:
         _logger.error(str(err))
+        snapshot = _Snapshot()
+        _snapshots[snapshot_path(file_path)] = snapshot
+    try:
+        changed = False
+        if clear:
+            changed = snapshot.remove([k for k in snapshot.blobs
+                                       if k not in d])
+        changed |= snapshot.update(d)
+        if changed or snapshot.mtime is None:
+            _write_snapshot(snapshot_path(file_path), snapshot)
+    except Exception as err:
+        _logger.error(str(err))
+        clear_cache(file_path)
         return False
-    if clear:
-        shelf.clear()
-    shelf.update(d)
-    shelf.close()
-    _logger.info("saved to '{}'".format(file_path))
+    _logger.info("saved to '{}'".format(snapshot_path(file_path)))
     return True
 
 
 def load(file_path, prop_obj, include=None, exclude=None):
-    """
+    """save()で保存したファイルを読み込む。旧形式のshelveのファイルしか無い
+    場合は変換する。
     :type file_path: str
     :type prop_obj: dict | object
     :type include: dict
     :type exclude: list | tuple
     """
     try:
-        shelf = _shelve.open(file_path)
+        snapshot = _read_snapshot(file_path)
     except Exception as err:
         _logger.error(str(err))
         return False
-    d = dict(shelf)
-    shelf.close()
+    # ファイルが無い場合は空として扱う(shelveの'c'と同じ)
+    d = snapshot.get()
     if include:
         d.update(include)
     if exclude:
@@ -996,7 +1199,7 @@ def load(file_path, prop_obj, include=None, exclude=None):
         prop_obj.update(d)
     else:
         undump(d, prop_obj)
-    _logger.info("loaded from '{}'".format(file_path))
+    _logger.info("loaded from '{}'".format(snapshot_path(file_path)))
     return True
 
 
@@ -32,7 +32,6 @@ bl_info = {
 
 import collections
 import importlib
-import itertools
 import math
 import traceback
 
@@ -45,12 +44,16 @@ from mathutils import *
 try:
     importlib.reload(addongroup)
     importlib.reload(registerinfo)
+    importlib.reload(attrtransfer)
+    importlib.reload(isolation)
     importlib.reload(unitsystem)
     importlib.reload(vagl)
     importlib.reload(vaview3d)
 except NameError:
     from .addonutils import addongroup
     from .addonutils import registerinfo
+    from . import attrtransfer
+    from . import isolation
     from . import unitsystem
     from . import vagl
     from . import vaview3d
@@ -210,21 +213,15 @@ def _intersect_edit(context, verts, edges, faces, reverse):
     ob = context.active_object
     obimat = ob.matrix_world.inverted()
     bm = bmesh.from_edit_mesh(ob.data)
+    isolator = isolation.BooleanIsolation(ob, 'booleancutoff')
     # layer追加は要素の追加前でないと、要素のis_validが偽になる
-    layer = bm.faces.layers.int.get('booleancutoff')
-    if not layer:
-        layer = bm.faces.layers.int.new('booleancutoff')
+    isolator.add_layers(bm)
 
     cut_verts = [bm.verts.new(obimat * co) for co in verts]
-    cut_edges = [bm.edges.new((cut_verts[v1], cut_verts[v2]))
-                for v1, v2, in edges]
+    for v1, v2, in edges:
+        bm.edges.new((cut_verts[v1], cut_verts[v2]))
     cut_faces = [bm.faces.new([cut_verts[v] for v in f]) for f in faces]
-    cutting_elems = cut_verts + cut_edges + cut_faces
-    cutting_elems = set(cutting_elems)
-    for f in bm.faces:
-        f[layer] = 0  # エラーが原因でlayerが残っている場合に初期化が必要
-    for f in cut_faces:
-        f[layer] = 1
+    isolator.mark_cutter(bm, cut_verts, cut_faces)
 
     # polygonを時計回りに書いていた場合に法線を直す
     bmesh.ops.recalc_face_normals(bm, faces=cut_faces)
@@ -235,73 +232,21 @@ def _intersect_edit(context, verts, edges, faces, reverse):
     unwrap_uvs_edit(bm, cut_faces)
 
     # boolean
-    hidden_elems = []
-    for ele in itertools.chain(bm.faces, bm.edges, bm.verts):
-        if not ele.hide:
-            if not ele.select and ele not in cutting_elems:
-                ele.hide = True
-                hidden_elems.append(ele)
+    # 非選択要素を隠す。INTERSECTでは切断用の要素と離れた島も削除される
+    # ので、DIFFERENCEの場合のみ範囲を絞る
+    isolator.isolate(scope=not reverse)
     # 非選択要素で選択要素を切り取る(DIFFERENCE)
     operation = 'INTERSECT' if reverse else 'DIFFERENCE'
     bpy.ops.mesh.intersect_boolean(operation=operation, use_swap=True)
 
     bpy.ops.mesh.select_all(action='SELECT')
 
-    for ele in hidden_elems:
-        if ele.is_valid:
-            ele.hide = False
+    # 隠した要素を戻し、切断面にmaterial, texture image, UVを移す
+    isolator.restore(
+        lambda me: attrtransfer.transfer_attributes(me, 'booleancutoff'))
 
-    # material
     bm = bmesh.from_edit_mesh(ob.data)
     layer = bm.faces.layers.int['booleancutoff']
-    for face in bm.faces:
-        if face[layer]:
-            # material
-            materials = []
-            for edge in face.edges:
-                for f in edge.link_faces:
-                    if not f[layer]:
-                        materials.append(f.material_index)
-            if not materials:
-                for edge in face.edges:
-                    for f in edge.link_faces:
-                        for e in f.edges:
-                            for f2 in e.link_faces:
-                                if not f2[layer]:
-                                    materials.append(f2.material_index)
-            if materials:
-                count = {materials.count(k): k for k in set(materials)}
-                face.material_index = count[max(count)]
-            # texture image
-            for tex_layer in bm.faces.layers.tex.values():
-                images = []
-                for edge in face.edges:
-                    for f in edge.link_faces:
-                        if not f[layer]:
-                            images.append(f[tex_layer].image)
-                if not images:
-                    for edge in face.edges:
-                        for f in edge.link_faces:
-                            for e in f.edges:
-                                for f2 in e.link_faces:
-                                    if not f2[layer]:
-                                        images.append(f2[tex_layer].image)
-                if images:
-                    count = {images.count(k): k for k in set(images)}
-                    face[tex_layer].image = count[max(count)]
-            # UV。割と適当
-            for uv_layer in bm.loops.layers.uv.values():
-                for vert in face.verts:
-                    uvs = []
-                    for loop in vert.link_loops:
-                        if loop.face != face:
-                            uvs.append(tuple(loop[uv_layer].uv))
-                    if uvs:
-                        uv = uvs.pop()
-                        for loop in vert.link_loops:
-                            if loop.face == face:
-                                loop[uv_layer].uv = uv
-
     bm.faces.layers.int.remove(layer)
 
     bmesh.update_edit_mesh(ob.data)
@@ -0,0 +1,602 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+boolean後の切断面に周囲の面のマテリアル、画像、UVを移す。
+
+transfer_attributes(me, 'booleancutoff')  # オブジェクトモードで
+
+mesh = MeshData.from_polygons(coords, polygons, cut, materials=materials)
+mesh.transfer()  # mesh.materials, mesh.images, mesh.uvsを書き換える
+
+transfer_attributes()はneighborhood_faces()で切断面の周囲の面だけを
+MeshData.extract()で取り出して処理する。
+面の隣接は辺を共有する面の組の配列として一度だけ作る。
+切断面毎に、辺を共有する切断面以外の面(無ければその隣の面)を参照し、
+マテリアルと画像は最も多い値、UVは参照面を三角形に分割し、
+切断面の頂点を含む三角形の重心座標で補間する。どの三角形にも
+乗らない頂点のUVはそのまま。
+MeshDataはnumpyの配列のみを持つので、bpy無しで使える。
+"""
+
+
+import numpy as np
+
+
+__all__ = ('expand_ranges', 'face_adjacency', 'neighborhood_faces',
+           'neighbor_ring', 'majority', 'fan_triangles', 'barycentric_lookup',
+           'MeshData', 'transfer_attributes')
+
+
+EDGE_KEY_SHIFT = 32
+
+
+def expand_ranges(starts, counts):
+    """[starts[i], starts[i] + counts[i])を連結した配列を返す。
+    :return: (連番, 元のindex)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.cumsum(counts) - counts
+    indices = np.arange(counts.sum()) - offsets[owner] + starts[owner]
+    return indices, owner
+
+
+def face_adjacency(loop_verts, loop_start, loop_total):
+    """辺を共有する面の組。両方向を含む。
+    :return: (N, 2)。面の番号の組
+    :rtype: numpy.ndarray
+    """
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    loop_face = np.repeat(np.arange(len(loop_start)), loop_total)
+    next_loop = np.arange(1, len(loop_verts) + 1)
+    next_loop[loop_start + loop_total - 1] = loop_start
+    pairs = np.column_stack((loop_verts, loop_verts[next_loop]))
+    pairs.sort(axis=1)
+    keys = (pairs[:, 0] << EDGE_KEY_SHIFT) | pairs[:, 1]
+
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    faces = loop_face[order]
+    if not len(keys):
+        return np.empty((0, 2), dtype=np.int64)
+    group_start = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    group_size = np.diff(np.r_[group_start, len(keys)])
+    # 同じ辺を持つloopの全ての組
+    size = np.repeat(group_size, group_size)
+    start = np.repeat(group_start, group_size)
+    partner, owner = expand_ranges(start, size)
+    src = faces[owner]
+    dst = faces[partner]
+    valid = src != dst
+    return np.column_stack((src[valid], dst[valid]))
+
+
+def neighborhood_faces(loop_verts, loop_total, faces, rings=2):
+    """facesから頂点を共有する面をrings回辿った面。
+    辺を共有する面をrings回辿った物を全て含む。
+    :param faces: (N,)。面の番号
+    :return: 面の番号。昇順
+    :rtype: numpy.ndarray
+    """
+    loop_verts = np.asarray(loop_verts, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    loop_face = np.repeat(np.arange(len(loop_total)), loop_total)
+    num_verts = loop_verts.max() + 1 if len(loop_verts) else 0
+    face_mask = np.zeros(len(loop_total), dtype=bool)
+    face_mask[faces] = True
+    for _ in range(rings):
+        vert_mask = np.zeros(num_verts, dtype=bool)
+        vert_mask[loop_verts[face_mask[loop_face]]] = True
+        face_mask = np.bincount(loop_face, vert_mask[loop_verts],
+                                len(loop_total)) > 0
+    return np.flatnonzero(face_mask)
+
+
+def _compose(pairs, targets, sources_mask):
+    """targetsから一歩でsources_maskの面へ進む組。
+    :param pairs: face_adjacency()の戻り値。0列目でソート済み
+    """
+    first = pairs[:, 0]
+    lo = np.searchsorted(first, targets, side='left')
+    hi = np.searchsorted(first, targets, side='right')
+    indices, owner = expand_ranges(lo, hi - lo)
+    neighbors = pairs[indices, 1]
+    valid = sources_mask[neighbors]
+    return owner[valid], neighbors[valid]
+
+
+def neighbor_ring(pairs, targets, sources_mask):
+    """targetsの各面が参照する面。辺を共有するsources_maskの面、
+    それが無ければ隣の面と辺を共有するsources_maskの面。
+    同じ面を複数の辺で共有していればその数だけ含む。
+    :param pairs: face_adjacency()の戻り値
+    :param targets: (N,)。面の番号
+    :param sources_mask: (num_faces,)。参照できる面
+    :return: (targetsのindex, 参照する面)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    sources_mask = np.asarray(sources_mask, dtype=bool)
+    pairs = pairs[np.argsort(pairs[:, 0], kind='mergesort')]
+    owner1, ring1 = _compose(pairs, targets, sources_mask)
+
+    found = np.zeros(len(targets), dtype=bool)
+    found[owner1] = True
+    rest = np.flatnonzero(~found)
+    if not len(rest):
+        return owner1, ring1
+    # 二周目は切断面自身も経由する
+    all_faces = np.ones(len(sources_mask), dtype=bool)
+    via_owner, via = _compose(pairs, targets[rest], all_faces)
+    via_owner = np.r_[np.arange(len(rest)), via_owner]
+    via = np.r_[targets[rest], via]
+    owner2, ring2 = _compose(pairs, via, sources_mask)
+    owner2 = rest[via_owner[owner2]]
+    return np.r_[owner1, owner2], np.r_[ring1, ring2]
+
+
+def majority(owner, values, num_owners):
+    """ownerの各番号について最も多いvaluesの値を返す。
+    同数の場合は小さい値を取る。
+    :param owner: (N,)。0 <= owner < num_owners
+    :param values: (N,)。整数
+    :return: (値, 値が有るか)。共に(num_owners,)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    owner = np.asarray(owner, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    result = np.zeros(num_owners, dtype=np.int64)
+    found = np.zeros(num_owners, dtype=bool)
+    if not len(owner):
+        return result, found
+    vmin = values.min()
+    span = values.max() - vmin + 1
+    keys, counts = np.unique(owner * span + (values - vmin),
+                             return_counts=True)
+    key_owner = keys // span
+    key_value = keys % span + vmin
+    # ownerの昇順、countの降順、値の昇順
+    order = np.lexsort((key_value, -counts, key_owner))
+    key_owner = key_owner[order]
+    first = np.r_[True, key_owner[1:] != key_owner[:-1]]
+    result[key_owner[first]] = key_value[order][first]
+    found[key_owner[first]] = True
+    return result, found
+
+
+def fan_triangles(loop_start, loop_total):
+    """面をloop_startを中心に三角形に分割する。
+    :return: (三角形のloop (N, 3), 各面の最初の三角形, 各面の三角形の数)
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    counts = np.maximum(np.asarray(loop_total, dtype=np.int64) - 2, 0)
+    tri_start = np.cumsum(counts) - counts
+    indices, owner = expand_ranges(np.ones(len(counts), np.int64), counts)
+    first = loop_start[owner]
+    tri_loops = np.column_stack((first, first + indices, first + indices + 1))
+    return tri_loops, tri_start, counts
+
+
+def barycentric_lookup(coords, query_loops, tri_verts, candidates,
+                       max_distance, epsilon=1e-4):
+    """query_loopsの各点を含む三角形を候補から探す。
+    点は三角形の平面に投影し、重心座標が全て-epsilon以上で平面からの距離が
+    max_distance以下の物の内、最も近い物を取る。
+    :param coords: (num_points, 3)
+    :param query_loops: (N,)。点の番号
+    :param tri_verts: (num_tris, 3)。三角形の頂点の点の番号
+    :param candidates: (query_loopsのindex, 三角形の番号)
+    :return: (query_loopsのindex, 三角形の番号, 重心座標 (M, 3))
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    owner, tris = candidates
+    p = coords[np.asarray(query_loops, dtype=np.int64)[owner]]
+    a, b, c = (coords[tri_verts[tris, i]] for i in range(3))
+    v0 = b - a
+    v1 = c - a
+    v2 = p - a
+    d00 = (v0 * v0).sum(axis=1)
+    d01 = (v0 * v1).sum(axis=1)
+    d11 = (v1 * v1).sum(axis=1)
+    d20 = (v2 * v0).sum(axis=1)
+    d21 = (v2 * v1).sum(axis=1)
+    denom = d00 * d11 - d01 * d01
+    normal = np.cross(v0, v1)
+    norm = np.sqrt((normal * normal).sum(axis=1))
+    valid = denom > (d00 * d11) * 1e-12
+    denom[~valid] = 1.0
+    norm[~valid] = 1.0
+    v = (d11 * d20 - d01 * d21) / denom
+    w = (d00 * d21 - d01 * d20) / denom
+    u = 1.0 - v - w
+    distance = np.abs((v2 * normal).sum(axis=1)) / norm
+    valid &= (u >= -epsilon) & (v >= -epsilon) & (w >= -epsilon)
+    valid &= distance <= max_distance
+
+    owner = owner[valid]
+    tris = tris[valid]
+    weights = np.column_stack((u, v, w))[valid]
+    order = np.lexsort((distance[valid], owner))
+    owner = owner[order]
+    first = np.r_[True, owner[1:] != owner[:-1]] if len(owner) else \
+        np.zeros(0, dtype=bool)
+    return owner[first], tris[order][first], weights[order][first]
+
+
+class MeshData:
+    def __init__(self, coords, loop_verts, loop_start, loop_total,
+                 cut, materials=None, images=None, uvs=None):
+        """
+        :param coords: (num_verts, 3)
+        :param loop_verts: (num_loops,)
+        :param loop_start: (num_faces,)
+        :param loop_total: (num_faces,)
+        :param cut: (num_faces,)。切断面ならTrue
+        :param materials: (num_faces,)
+        :param images: [(num_faces,), ...]。tex layer毎の画像の番号
+        :param uvs: [(num_loops, 2), ...]。uv layer毎
+        """
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.loop_verts = np.asarray(loop_verts, dtype=np.int64)
+        self.loop_start = np.asarray(loop_start, dtype=np.int64)
+        self.loop_total = np.asarray(loop_total, dtype=np.int64)
+        self.cut = np.asarray(cut, dtype=bool)
+        num_faces = len(self.loop_start)
+        if materials is None:
+            materials = np.zeros(num_faces, dtype=np.int64)
+        self.materials = np.asarray(materials, dtype=np.int64)
+        self.images = [np.asarray(a, dtype=np.int64) for a in images or ()]
+        self.uvs = [np.asarray(a, dtype=np.float64).reshape(-1, 2)
+                    for a in uvs or ()]
+        self._adjacency = None
+
+    @classmethod
+    def from_polygons(cls, coords, polygons, cut, **kwargs):
+        """
+        :param polygons: [[頂点の番号, ...], ...]
+        """
+        loop_total = np.array([len(p) for p in polygons], dtype=np.int64)
+        loop_start = np.cumsum(loop_total) - loop_total
+        loop_verts = [i for p in polygons for i in p]
+        return cls(coords, loop_verts, loop_start, loop_total, cut, **kwargs)
+
+    def extract(self, faces):
+        """facesのみのMeshDataを作る。頂点とloopは詰める。
+        :param faces: (N,)。面の番号
+        :return: (MeshData, 元のloopの番号)
+        :rtype: (MeshData, numpy.ndarray)
+        """
+        faces = np.asarray(faces, dtype=np.int64)
+        loops, _owner = expand_ranges(self.loop_start[faces],
+                                      self.loop_total[faces])
+        verts = np.unique(self.loop_verts[loops])
+        loop_total = self.loop_total[faces]
+        mesh = self.__class__(
+            self.coords[verts],
+            np.searchsorted(verts, self.loop_verts[loops]),
+            np.cumsum(loop_total) - loop_total,
+            loop_total,
+            self.cut[faces],
+            self.materials[faces],
+            [a[faces] for a in self.images],
+            [a[loops] for a in self.uvs])
+        return mesh, loops
+
+    @property
+    def adjacency(self):
+        if self._adjacency is None:
+            self._adjacency = face_adjacency(
+                self.loop_verts, self.loop_start, self.loop_total)
+        return self._adjacency
+
+    @property
+    def cut_faces(self):
+        return np.flatnonzero(self.cut)
+
+    def source_ring(self):
+        """切断面毎の参照する面。
+        :return: (cut_facesのindex, 面の番号)
+        """
+        return neighbor_ring(self.adjacency, self.cut_faces, ~self.cut)
+
+    def majority(self, ring, values):
+        """切断面に参照面の最も多い値を入れた配列を返す。
+        参照面が無い切断面の値はそのまま。
+        """
+        cut_faces = self.cut_faces
+        result, found = majority(ring[0], values[ring[1]], len(cut_faces))
+        values = values.copy()
+        values[cut_faces[found]] = result[found]
+        return values
+
+    def default_max_distance(self):
+        """メッシュの大きさの1e-5倍。extract()した物では小さくなるので、
+        元のメッシュで求めた値を渡す事。
+        """
+        if not len(self.coords):
+            return 0.0
+        return (self.coords.max(axis=0) - self.coords.min(axis=0)).max() * \
+            1e-5
+
+    def barycentric_lookup(self, ring, max_distance=None):
+        """切断面の各loopの頂点を含む参照面の三角形を探す。
+        :param max_distance: 平面からの距離の許容値。
+            Noneならメッシュの大きさの1e-5倍
+        :return: (loopの番号, 三角形のloop (N, 3), 重心座標 (N, 3))
+        """
+        if max_distance is None:
+            max_distance = self.default_max_distance()
+        cut_faces = self.cut_faces
+        # 切断面と参照面の組の重複を除く
+        num_faces = len(self.loop_start)
+        keys = np.unique(ring[0] * num_faces + ring[1])
+        owner = keys // num_faces
+        sources = keys % num_faces
+
+        tri_loops, tri_start, tri_count = fan_triangles(self.loop_start,
+                                                        self.loop_total)
+        tris, pair = expand_ranges(tri_start[sources], tri_count[sources])
+        # 組毎に切断面の全てのloopと三角形を組み合わせる
+        faces = cut_faces[owner[pair]]
+        loops, item = expand_ranges(self.loop_start[faces],
+                                    self.loop_total[faces])
+        tri_verts = self.loop_verts[tri_loops]
+        query, tri, weights = barycentric_lookup(
+            self.coords, self.loop_verts, tri_verts,
+            (loops, tris[item]), max_distance)
+        return query, tri_loops[tri], weights
+
+    def transfer(self, max_distance=None):
+        """materials, images, uvsを書き換える。
+        :param max_distance: barycentric_lookup()を参照
+        :return: 書き換えたloopの番号
+        """
+        ring = self.source_ring()
+        self.materials = self.majority(ring, self.materials)
+        self.images = [self.majority(ring, a) for a in self.images]
+        loops, tri_loops, weights = self.barycentric_lookup(ring,
+                                                            max_distance)
+        for uv in self.uvs:
+            uv[loops] = (uv[tri_loops] * weights[:, :, np.newaxis]).sum(1)
+        return loops
+
+
+def _get(collection, attr, dtype, size=1):
+    arr = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, arr)
+    return arr.reshape(-1, size) if size > 1 else arr
+
+
+def transfer_attributes(me, layer_name):
+    """layer_nameの値が真の面に周囲の面のマテリアル、画像、UVを移す。
+    切断面から二周分の面のみを処理する。オブジェクトモードで呼ぶ。
+    :type me: bpy.types.Mesh
+    """
+    p_layer = me.polygon_layers_int[layer_name].data
+    cut = _get(p_layer, 'value', np.int32) != 0
+    if not np.any(cut):
+        return
+
+    mesh = MeshData(_get(me.vertices, 'co', np.float32, 3),
+                    _get(me.loops, 'vertex_index', np.int32),
+                    _get(me.polygons, 'loop_start', np.int32),
+                    _get(me.polygons, 'loop_total', np.int32),
+                    cut,
+                    _get(me.polygons, 'material_index', np.int32),
+                    None,
+                    [_get(uv_layer.data, 'uv', np.float32, 2)
+                     for uv_layer in me.uv_layers])
+    faces = neighborhood_faces(mesh.loop_verts, mesh.loop_total,
+                               mesh.cut_faces)
+    sub, loops = mesh.extract(faces)
+
+    # 画像はforeach_getで読めないので、周囲の面のみ番号に置き換える
+    image_tables = []
+    for tex_layer in me.uv_textures:
+        table = [None]
+        index = {None: 0}
+        values = []
+        data = tex_layer.data
+        for i in faces.tolist():
+            image = data[i].image
+            k = index.get(image)
+            if k is None:
+                k = index[image] = len(table)
+                table.append(image)
+            values.append(k)
+        image_tables.append(table)
+        sub.images.append(np.array(values, dtype=np.int64))
+
+    sub.transfer(mesh.default_max_distance())
+
+    mesh.materials[faces] = sub.materials
+    me.polygons.foreach_set('material_index',
+                            mesh.materials.astype(np.int32))
+    sub_cut_faces = sub.cut_faces.tolist()
+    cut_faces = faces[sub.cut_faces].tolist()
+    for tex_layer, table, values in zip(me.uv_textures, image_tables,
+                                        sub.images):
+        data = tex_layer.data
+        for i, k in zip(cut_faces, sub_cut_faces):
+            data[i].image = table[values[k]]
+    for uv_layer, uv, sub_uv in zip(me.uv_layers, mesh.uvs, sub.uvs):
+        uv[loops] = sub_uv
+        uv_layer.data.foreach_set('uv', uv.astype(np.float32).ravel())
+
+
+def test():
+    # 3x1の四角形の帯の中央を切断面とする
+    #  4--5--6--7
+    #  |  |  |  |
+    #  0--1--2--3
+    coords = [(0, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0),
+              (0, 1, 0), (1, 1, 0), (2, 1, 0), (3, 1, 0)]
+    polygons = [(0, 1, 5, 4), (1, 2, 6, 5), (2, 3, 7, 6)]
+    pairs = face_adjacency([i for p in polygons for i in p],
+                           [0, 4, 8], [4, 4, 4])
+    assert sorted(map(tuple, pairs.tolist())) == \
+        [(0, 1), (1, 0), (1, 2), (2, 1)]
+
+    # 多数決: 同数なら小さい値
+    values, found = majority([0, 0, 0, 2, 2], [5, 3, 5, 7, 1], 3)
+    assert values.tolist() == [5, 0, 1] and found.tolist() == [1, 0, 1]
+    values, found = majority([0, 0], [-1, -1], 1)
+    assert values.tolist() == [-1]
+
+    uvs = np.array([(0, 0), (1, 0), (1, 1), (0, 1),
+                    (9, 9), (9, 9), (9, 9), (9, 9),
+                    (2, 0), (3, 0), (3, 1), (2, 1)], dtype=float)
+    mesh = MeshData.from_polygons(coords, polygons, [0, 1, 0],
+                                  materials=[2, 0, 2], images=[[1, 0, 3]],
+                                  uvs=[uvs])
+    loops = mesh.transfer()
+    assert mesh.materials.tolist() == [2, 2, 2]
+    assert mesh.images[0].tolist() == [1, 1, 3]
+    assert sorted(loops.tolist()) == [4, 5, 6, 7]
+    # 頂点1,5は左、2,6は右の面のUV(継ぎ目でも辺を共有する面から取る)
+    assert np.allclose(mesh.uvs[0][4:8], [(1, 0), (2, 0), (2, 1), (1, 1)])
+    assert np.allclose(mesh.uvs[0][:4], uvs[:4])
+
+    # 二周目: 切断面同士が隣接し、一つは参照面と辺を共有しない
+    polygons = [(0, 1, 5, 4), (1, 2, 6, 5), (2, 3, 7, 6)]
+    mesh = MeshData.from_polygons(coords, polygons, [1, 1, 0],
+                                  materials=[0, 0, 4])
+    ring = mesh.source_ring()
+    assert sorted(zip(ring[0].tolist(), ring[1].tolist())) == [(0, 2), (1, 2)]
+    assert mesh.majority(ring, mesh.materials).tolist() == [4, 4, 4]
+
+    # 参照面の内側に頂点がある場合は重心座標で補間する。外側はそのまま
+    coords = [(0, 0, 0), (4, 0, 0), (0, 4, 0),
+              (1, 1, 0), (2, 1, 0), (1, 2, 0), (1, 1, 3)]
+    polygons = [(0, 1, 2), (3, 4, 6), (4, 5, 6), (5, 3, 6)]
+    uvs = np.zeros((12, 2))
+    uvs[:3] = [(0, 0), (1, 0), (0, 1)]
+    uvs[3:] = -1
+    mesh = MeshData.from_polygons(coords, polygons, [0, 1, 1, 1],
+                                  uvs=[uvs])
+    ring = (np.array([0, 1, 2]), np.array([0, 0, 0]))
+    loops, tri_loops, weights = mesh.barycentric_lookup(ring)
+    uv = mesh.uvs[0]
+    result = (uv[tri_loops] * weights[:, :, np.newaxis]).sum(1)
+    table = dict(zip(loops.tolist(), map(tuple, result.tolist())))
+    # 頂点3 (1, 1, 0) -> (0.25, 0.25)
+    assert np.allclose(table[3], (0.25, 0.25))
+    assert np.allclose(table[4], (0.5, 0.25))
+    assert 5 not in table  # 頂点6は平面から離れている
+    assert len(table) == 6
+
+    # 周囲の面のみを取り出しても結果は同じ
+    size = 12
+    x, y = np.meshgrid(np.arange(size + 1), np.arange(size + 1))
+    coords = np.column_stack((x.ravel(), y.ravel(), np.zeros(x.size)))
+    i, j = np.meshgrid(np.arange(size), np.arange(size))
+    v = (j * (size + 1) + i).ravel()
+    polygons = np.column_stack((v, v + 1, v + size + 2, v + size + 1))
+    cut = ((abs(i - 6) < 3) & (abs(j - 6) < 3)).ravel()
+    rng = np.random.RandomState(0)
+    kwargs = {'materials': rng.randint(0, 4, len(polygons)),
+              'images': [rng.randint(0, 3, len(polygons))],
+              'uvs': [rng.rand(len(polygons) * 4, 2)]}
+    full = MeshData.from_polygons(coords, polygons.tolist(), cut, **kwargs)
+    faces = neighborhood_faces(full.loop_verts, full.loop_total,
+                               full.cut_faces)
+    assert len(faces) == 9 * 9  # 5x5の切断面から二周
+    sub, loops = full.extract(faces)
+    full.transfer()
+    sub.transfer(full.default_max_distance())
+    assert np.array_equal(full.materials[faces], sub.materials)
+    assert np.array_equal(full.images[0][faces], sub.images[0])
+    assert np.allclose(full.uvs[0][loops], sub.uvs[0])
+    assert full.cut[faces].sum() == sub.cut.sum() == 25
+
+
+def benchmark(num_faces=1000000, num_cut=2500):
+    """格子状のメッシュの中央の正方形を切断面として、要素毎のループと
+    配列での処理を比べる。
+    ループはBMeshの様に辺と面の参照表が既に有るものとし、その作成時間は
+    含めない。配列は周囲の面の抽出を含む。
+    ループはmaterialのみ、配列はmaterialとuvを処理する。
+    :return: {'faces', 'cut', 'neighborhood', 'loop', 'extract', 'numpy'}
+        時間は秒
+    :rtype: dict
+    """
+    import time
+
+    size = int(num_faces ** 0.5)
+    x, y = np.meshgrid(np.arange(size + 1), np.arange(size + 1))
+    coords = np.column_stack((x.ravel(), y.ravel(), np.zeros(x.size)))
+    i, j = np.meshgrid(np.arange(size), np.arange(size))
+    v = (j * (size + 1) + i).ravel()
+    polygons = np.column_stack((v, v + 1, v + size + 2, v + size + 1))
+    half = int(num_cut ** 0.5) // 2
+    center = size // 2
+    cut = ((np.abs(i - center) < half) & (np.abs(j - center) < half)).ravel()
+    rng = np.random.RandomState(0)
+    materials = rng.randint(0, 4, len(polygons))
+    loop_total = np.full(len(polygons), 4, dtype=np.int64)
+    mesh = MeshData(coords, polygons.ravel(), np.arange(len(polygons)) * 4,
+                    loop_total, cut, materials,
+                    uvs=[coords[polygons.ravel(), :2]])
+
+    edge_faces = {}
+    for f, poly in enumerate(polygons.tolist()):
+        for k in range(4):
+            key = tuple(sorted((poly[k], poly[k - 1])))
+            edge_faces.setdefault(key, []).append(f)
+    face_edges = [[tuple(sorted((p[k], p[k - 1]))) for k in range(4)]
+                  for p in polygons.tolist()]
+    cut_list = cut.tolist()
+    mat_list = materials.tolist()
+    # 元の処理と同じ順で辿る
+    t = time.perf_counter()
+    for face in np.flatnonzero(cut).tolist():
+        found = [mat_list[f] for e in face_edges[face]
+                 for f in edge_faces[e] if not cut_list[f]]
+        if not found:
+            found = [mat_list[f2] for e in face_edges[face]
+                     for f in edge_faces[e] for e2 in face_edges[f]
+                     for f2 in edge_faces[e2] if not cut_list[f2]]
+        if found:
+            count = {found.count(k): k for k in set(found)}
+            mat_list[face] = count[max(count)]
+    t_loop = time.perf_counter() - t
+
+    t = time.perf_counter()
+    faces = neighborhood_faces(mesh.loop_verts, mesh.loop_total,
+                               mesh.cut_faces)
+    sub, loops = mesh.extract(faces)
+    t_extract = time.perf_counter() - t
+    t = time.perf_counter()
+    sub.transfer(mesh.default_max_distance())
+    t_numpy = time.perf_counter() - t
+
+    return {'faces': len(polygons), 'cut': int(cut.sum()),
+            'neighborhood': len(faces), 'loop': t_loop,
+            'extract': t_extract, 'numpy': t_numpy}
+
+
+if __name__ == '__main__':
+    test()
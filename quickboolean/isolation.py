@@ -0,0 +1,444 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+mesh.intersect_boolean()の対象外の要素をまとめて隠し、後で元に戻す。
+
+isolation = BooleanIsolation(ob)
+face_layer = isolation.add_layers(bm)  # 切断用の要素を追加する前に呼ぶ
+... 切断用の要素を追加 ...
+isolation.mark_cutter(bm, cut_verts, cut_faces)
+isolation.isolate(scope=True)
+bpy.ops.mesh.intersect_boolean(...)
+isolation.restore(func)  # funcはオブジェクトモードでMeshを引数に呼ばれる
+
+隠す要素はMeshの配列をnumpyで読み書きして決める為、一旦オブジェクトモードに
+切り替える。元に戻す際の要素の対応は頂点のint layer(元のindex + 1)と
+面のint layer(切断面は1、隠した面は2以上)で取る。
+isolate()とrestore()はそれぞれBMeshとMeshの変換を一往復ずつ伴う。
+要素毎のループとの比較はBlender内でbenchmark(context)を実行する。
+
+scopeが真の場合、選択要素の内、切断用の要素のbounding boxと重ならない
+島(連結成分)も隠す。島の一部だけを隠すとbooleanの内外判定が
+変わるので、面単位では判定しない。
+"""
+
+
+import numpy as np
+
+
+__all__ = ('CUTTER', 'HIDDEN', 'SCOPED', 'island_labels', 'edge_keys',
+           'isolation_masks', 'scope_islands', 'restore_masks',
+           'BooleanIsolation')
+
+
+# 面のint layerの値
+CUTTER = 1
+HIDDEN = 2  # 非選択なので隠した
+SCOPED = 3  # 選択されているが切断用の要素と離れているので隠した
+
+EDGE_KEY_SHIFT = 32
+
+
+def island_labels(num_verts, edge_verts, mask=None):
+    """辺で繋がった頂点に同じ番号を振る。
+    :param edge_verts: (N, 2)
+    :param mask: (num_verts,)。Falseの頂点とそれに接する辺は無視する
+    :return: (num_verts,)。各島の最小の頂点番号
+    :rtype: numpy.ndarray
+    """
+    labels = np.arange(num_verts)
+    edge_verts = np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2)
+    if mask is not None:
+        edge_verts = edge_verts[mask[edge_verts].all(axis=1)]
+    if not len(edge_verts):
+        return labels
+    v1, v2 = edge_verts[:, 0], edge_verts[:, 1]
+    while True:
+        l1 = labels[v1]
+        l2 = labels[v2]
+        low = np.minimum(l1, l2)
+        if np.array_equal(l1, l2):
+            break
+        # 根の番号を小さい方に付け替え、pointer jumpingで圧縮する
+        np.minimum.at(labels, l1, low)
+        np.minimum.at(labels, l2, low)
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+def edge_keys(vert_ids, edge_verts):
+    """頂点のidの組から辺のキーを作る。
+    :param vert_ids: (num_verts,)。2 ** 31未満
+    :param edge_verts: (N, 2)
+    :rtype: numpy.ndarray
+    """
+    ids = np.asarray(vert_ids, dtype=np.int64)[
+        np.asarray(edge_verts, dtype=np.int64).reshape(-1, 2)]
+    ids.sort(axis=1)
+    return (ids[:, 0] << EDGE_KEY_SHIFT) | ids[:, 1]
+
+
+def isolation_masks(v_hide, v_select, v_cutter, e_hide, e_select, e_verts,
+                    p_hide, p_select, p_cutter):
+    """非表示にする要素。表示されていて非選択、かつ切断用でない物。
+    :return: (頂点, 辺, 面)の真偽値配列
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    v_cutter = np.asarray(v_cutter, dtype=bool)
+    e_verts = np.asarray(e_verts, dtype=np.int64).reshape(-1, 2)
+    e_cutter = v_cutter[e_verts].any(axis=1)
+    hv = ~np.asarray(v_hide, bool) & ~np.asarray(v_select, bool) & ~v_cutter
+    he = ~np.asarray(e_hide, bool) & ~np.asarray(e_select, bool) & ~e_cutter
+    hp = (~np.asarray(p_hide, bool) & ~np.asarray(p_select, bool) &
+          ~np.asarray(p_cutter, bool))
+    return hv, he, hp
+
+
+def scope_islands(v_co, v_active, e_verts, bbox_min, bbox_max,
+                  threshold=1e-5):
+    """v_activeの頂点で構成される島の内、bounding boxが
+    [bbox_min, bbox_max]と重ならない物の頂点を返す。
+    :param v_co: (N, 3)
+    :param v_active: (N,)。選択されている表示頂点
+    :rtype: numpy.ndarray
+    """
+    v_co = np.asarray(v_co, dtype=float).reshape(-1, 3)
+    v_active = np.asarray(v_active, dtype=bool)
+    labels = island_labels(len(v_co), e_verts, v_active)
+    index = np.flatnonzero(v_active)
+    if not len(index):
+        return np.zeros(len(v_co), dtype=bool)
+    island = labels[index]
+    order = np.argsort(island, kind='mergesort')
+    island = island[order]
+    co = v_co[index[order]]
+    starts = np.flatnonzero(np.r_[True, island[1:] != island[:-1]])
+    mins = np.minimum.reduceat(co, starts, axis=0)
+    maxs = np.maximum.reduceat(co, starts, axis=0)
+    bbox_min = np.asarray(bbox_min, dtype=float) - threshold
+    bbox_max = np.asarray(bbox_max, dtype=float) + threshold
+    disjoint = np.any((maxs < bbox_min) | (mins > bbox_max), axis=1)
+    result = np.zeros(len(v_co), dtype=bool)
+    result[index[order]] = np.repeat(disjoint, np.diff(np.r_[starts,
+                                                             len(island)]))
+    return result
+
+
+def restore_masks(v_ids, v_hide, e_verts, e_hide, p_flags, user_hidden,
+                  user_hidden_keys):
+    """isolate()で隠した要素。booleanは要素を隠さないので、隠れている要素の
+    内、元から隠れていた物以外が対象になる。
+    :param v_ids: (N,)。頂点のint layer
+    :param p_flags: 面のint layer
+    :param user_hidden: 頂点のidをindexとする真偽値配列。元から隠れていた頂点
+    :param user_hidden_keys: 元から隠れていた辺のedge_keys()(ソート済み)
+    :return: (頂点, 辺, 面)の真偽値配列
+    """
+    v_ids = np.asarray(v_ids, dtype=np.int64)
+    v_hide = np.asarray(v_hide, bool)
+    rv = v_hide & (v_ids > 0)
+    rv[rv] = ~user_hidden[v_ids[rv]]
+    e_hide = np.asarray(e_hide, bool)
+    re = e_hide.copy()
+    if np.any(re):
+        keys = edge_keys(v_ids, np.asarray(e_verts).reshape(-1, 2)[re])
+        re[re] = ~_isin_sorted(keys, user_hidden_keys)
+    rp = np.asarray(p_flags) >= HIDDEN
+    return rv, re, rp
+
+
+def _isin_sorted(values, sorted_array):
+    if not len(sorted_array) or not len(values):
+        return np.zeros(len(values), dtype=bool)
+    i = np.searchsorted(sorted_array, values)
+    i[i == len(sorted_array)] = 0
+    return sorted_array[i] == values
+
+
+def _get(collection, attr, dtype, size=1):
+    arr = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, arr)
+    return arr.reshape(-1, size) if size > 1 else arr
+
+
+class BooleanIsolation:
+    def __init__(self, ob, face_layer_name='booleancutoff',
+                 vert_layer_name='booleanisolate'):
+        """
+        :type ob: bpy.types.Object
+        """
+        self.ob = ob
+        self.face_layer_name = face_layer_name
+        self.vert_layer_name = vert_layer_name
+        self.user_hidden = None
+        self.user_hidden_keys = None
+        self.scoped = None
+
+    def add_layers(self, bm):
+        """layerを作り直す。要素を追加する前に呼ぶ事。
+        :type bm: bmesh.types.BMesh
+        :return: 面のlayer
+        """
+        for layers, name in ((bm.faces.layers.int, self.face_layer_name),
+                             (bm.verts.layers.int, self.vert_layer_name)):
+            layer = layers.get(name)
+            if layer:
+                # エラーが原因でlayerが残っている場合
+                layers.remove(layer)
+            layers.new(name)
+        return bm.faces.layers.int[self.face_layer_name]
+
+    def mark_cutter(self, bm, cut_verts, cut_faces):
+        vert_layer = bm.verts.layers.int[self.vert_layer_name]
+        face_layer = bm.faces.layers.int[self.face_layer_name]
+        for v in cut_verts:
+            v[vert_layer] = -1
+        for f in cut_faces:
+            f[face_layer] = CUTTER
+
+    def isolate(self, scope=False):
+        """非選択要素を隠す。scopeが真なら切断用の要素から離れた島も隠す。
+        編集モードで呼ぶ。
+        """
+        import bpy
+
+        bpy.ops.object.mode_set(mode='OBJECT')
+        me = self.ob.data
+        v_layer = me.vertex_layers_int[self.vert_layer_name].data
+        p_layer = me.polygon_layers_int[self.face_layer_name].data
+
+        v_hide = _get(me.vertices, 'hide', bool)
+        v_select = _get(me.vertices, 'select', bool)
+        v_cutter = _get(v_layer, 'value', np.int32) == -1
+        e_hide = _get(me.edges, 'hide', bool)
+        e_select = _get(me.edges, 'select', bool)
+        e_verts = _get(me.edges, 'vertices', np.int32, 2)
+        p_hide = _get(me.polygons, 'hide', bool)
+        p_select = _get(me.polygons, 'select', bool)
+        p_flags = _get(p_layer, 'value', np.int32)
+
+        hv, he, hp = isolation_masks(v_hide, v_select, v_cutter, e_hide,
+                                     e_select, e_verts, p_hide, p_select,
+                                     p_flags == CUTTER)
+        sv = np.zeros(len(hv), dtype=bool)
+        se = np.zeros(len(he), dtype=bool)
+        sp = np.zeros(len(hp), dtype=bool)
+        if scope and np.any(v_cutter):
+            v_co = _get(me.vertices, 'co', np.float32, 3)
+            cutter_co = v_co[v_cutter]
+            v_active = ~v_hide & v_select & ~v_cutter
+            sv = scope_islands(v_co, v_active, e_verts,
+                               cutter_co.min(axis=0), cutter_co.max(axis=0))
+            if np.any(sv):
+                se = ~e_hide & sv[e_verts].any(axis=1)
+                loop_verts = _get(me.loops, 'vertex_index', np.int32)
+                loop_start = _get(me.polygons, 'loop_start', np.int32)
+                sp = ~p_hide & sv[loop_verts[loop_start]]
+
+        # 頂点のid: 元のindex + 1。切断用は0
+        v_ids = np.arange(1, len(hv) + 1, dtype=np.int32)
+        v_ids[v_cutter] = 0
+        self.user_hidden = np.r_[False, v_hide]
+        self.user_hidden_keys = np.sort(edge_keys(v_ids, e_verts[e_hide]))
+        self.scoped = np.r_[False, sv]
+        p_flags[hp] = HIDDEN
+        p_flags[sp] = SCOPED
+
+        v_layer.foreach_set('value', v_ids)
+        p_layer.foreach_set('value', p_flags)
+        me.vertices.foreach_set('hide', v_hide | hv | sv)
+        me.vertices.foreach_set('select', v_select & ~sv)
+        me.edges.foreach_set('hide', e_hide | he | se)
+        me.edges.foreach_set('select', e_select & ~se)
+        me.polygons.foreach_set('hide', p_hide | hp | sp)
+        me.polygons.foreach_set('select', p_select & ~sp)
+        bpy.ops.object.mode_set(mode='EDIT')
+
+    def restore(self, func=None):
+        """isolate()で隠した要素を表示し、layerの値を戻す。
+        頂点のlayerは削除する。編集モードで呼ぶ。
+        :param func: 元に戻した後、オブジェクトモードのままMeshを引数にして
+            呼ぶ関数。モードの切り替えを増やさずに配列を読み書きできる
+        """
+        import bpy
+        import bmesh
+
+        bpy.ops.object.mode_set(mode='OBJECT')
+        me = self.ob.data
+        v_layer = me.vertex_layers_int[self.vert_layer_name].data
+        p_layer = me.polygon_layers_int[self.face_layer_name].data
+
+        v_ids = _get(v_layer, 'value', np.int32)
+        v_hide = _get(me.vertices, 'hide', bool)
+        v_select = _get(me.vertices, 'select', bool)
+        e_hide = _get(me.edges, 'hide', bool)
+        e_select = _get(me.edges, 'select', bool)
+        e_verts = _get(me.edges, 'vertices', np.int32, 2)
+        p_hide = _get(me.polygons, 'hide', bool)
+        p_select = _get(me.polygons, 'select', bool)
+        p_flags = _get(p_layer, 'value', np.int32)
+
+        rv, re, rp = restore_masks(v_ids, v_hide, e_verts, e_hide, p_flags,
+                                   self.user_hidden, self.user_hidden_keys)
+        scoped = self.scoped[v_ids]
+        sv = rv & scoped
+        se = re & scoped[e_verts].any(axis=1)
+        sp = p_flags == SCOPED
+        p_flags[rp] = 0
+
+        p_layer.foreach_set('value', p_flags)
+        me.vertices.foreach_set('hide', v_hide & ~rv)
+        me.vertices.foreach_set('select', v_select | sv)
+        me.edges.foreach_set('hide', e_hide & ~re)
+        me.edges.foreach_set('select', e_select | se)
+        me.polygons.foreach_set('hide', p_hide & ~rp)
+        me.polygons.foreach_set('select', p_select | sp)
+        if func:
+            func(me)
+        bpy.ops.object.mode_set(mode='EDIT')
+
+        bm = bmesh.from_edit_mesh(me)
+        layer = bm.verts.layers.int.get(self.vert_layer_name)
+        if layer:
+            bm.verts.layers.int.remove(layer)
+        bmesh.update_edit_mesh(me)
+
+
+def test():
+    # 二つの島: 0-1-2 と 3-4
+    labels = island_labels(6, [(0, 1), (1, 2), (3, 4)])
+    assert labels.tolist() == [0, 0, 0, 3, 3, 5]
+    mask = np.array([True, False, True, True, True, True])
+    assert island_labels(6, [(0, 1), (1, 2), (3, 4)], mask).tolist() == \
+        [0, 1, 2, 3, 3, 5]
+    # 長い鎖(逆順)
+    n = 1000
+    chain = np.column_stack((np.arange(n - 1, 0, -1), np.arange(n - 2, -1, -1)))
+    assert np.all(island_labels(n, chain) == 0)
+
+    # 隠す要素
+    v_hide = np.array([0, 0, 0, 1, 0], bool)
+    v_select = np.array([1, 0, 0, 0, 0], bool)
+    v_cutter = np.array([0, 0, 0, 0, 1], bool)
+    e_verts = np.array([(0, 1), (1, 2), (2, 3), (2, 4)])
+    e_hide = np.array([0, 0, 1, 0], bool)
+    e_select = np.array([0, 0, 0, 0], bool)
+    hv, he, hp = isolation_masks(v_hide, v_select, v_cutter, e_hide, e_select,
+                                 e_verts, [0, 1], [0, 0], [0, 0])
+    assert hv.tolist() == [False, True, True, False, False]
+    assert he.tolist() == [True, True, False, False]
+    assert hp.tolist() == [True, False]
+
+    # 元に戻す: boolean後に頂点が増えて順番が変わった場合
+    v_ids = np.arange(1, 6)
+    v_ids[v_cutter] = 0
+    user_hidden = np.r_[False, v_hide]
+    user_hidden_keys = np.sort(edge_keys(v_ids, e_verts[e_hide]))
+    after_ids = np.array([0, 3, 2, 9, 4, 1])  # 9は新しい頂点
+    after_hide = np.array([0, 1, 1, 0, 1, 0], bool)
+    after_edges = np.array([(5, 2), (2, 1), (1, 4), (3, 5)])
+    after_e_hide = np.array([1, 1, 1, 0], bool)
+    rv, re, rp = restore_masks(after_ids, after_hide, after_edges,
+                               after_e_hide, [0, 2, 1, 3], user_hidden,
+                               user_hidden_keys)
+    # 元から隠れていた頂点4(id 4)と辺(id 3-4)はそのまま
+    assert rv.tolist() == [False, True, True, False, False, False]
+    assert re.tolist() == [True, True, False, False]
+    assert rp.tolist() == [False, True, False, True]
+
+    # 島単位の範囲: 切断用の要素は島Aにのみ重なる
+    v_co = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0),
+                     (10, 0, 0), (11, 0, 0), (11, 1, 0)], dtype=float)
+    e_verts = np.array([(0, 1), (1, 2), (3, 4), (4, 5)])
+    scoped = scope_islands(v_co, np.ones(6, bool), e_verts,
+                           (0.5, -1, -1), (2, 2, 1))
+    assert scoped.tolist() == [False] * 3 + [True] * 3
+    active = np.array([1, 1, 1, 0, 1, 1], bool)
+    scoped = scope_islands(v_co, active, e_verts, (10.5, -1, -1), (12, 2, 1))
+    assert scoped.tolist() == [True] * 3 + [False] * 3
+
+
+def benchmark(context, size=1000, select_ratio=0.01):
+    """実際のメッシュで、要素毎のループとBooleanIsolationを比べる。
+    BooleanIsolationはモードの切り替えとforeach_get/foreach_setを含む。
+    Blender内で実行する。一時的なオブジェクトを作って削除する。
+    :param size: 格子の分割数。面の数はおおよそsize ** 2
+    :return: {'elements': 要素数, 'loop': 秒, 'isolation': 秒}
+    :rtype: dict
+    """
+    import itertools
+    import time
+    import bpy
+    import bmesh
+
+    me = bpy.data.meshes.new('isolation_benchmark')
+    bm = bmesh.new()
+    bmesh.ops.create_grid(bm, x_segments=size, y_segments=size, size=1.0)
+    step = max(int(1 / select_ratio), 1)
+    for i, f in enumerate(bm.faces):
+        f.select_set(i % step == 0)
+    bm.to_mesh(me)
+    bm.free()
+    ob = bpy.data.objects.new(me.name, me)
+    scene = context.scene
+    scene.objects.link(ob)
+    active = scene.objects.active
+    scene.objects.active = ob
+    bpy.ops.object.mode_set(mode='EDIT')
+    try:
+        bm = bmesh.from_edit_mesh(me)
+        num_elems = len(bm.verts) + len(bm.edges) + len(bm.faces)
+
+        # 変更前の_intersect_edit()と同じ処理
+        t = time.perf_counter()
+        hidden_elems = []
+        for ele in itertools.chain(bm.faces, bm.edges, bm.verts):
+            if not ele.hide:
+                if not ele.select:
+                    ele.hide = True
+                    hidden_elems.append(ele)
+        for ele in hidden_elems:
+            if ele.is_valid:
+                ele.hide = False
+        t_loop = time.perf_counter() - t
+        bmesh.update_edit_mesh(me)
+
+        t = time.perf_counter()
+        isolator = BooleanIsolation(ob)
+        isolator.add_layers(bmesh.from_edit_mesh(me))
+        isolator.isolate()
+        isolator.restore()
+        t_numpy = time.perf_counter() - t
+    finally:
+        bpy.ops.object.mode_set(mode='OBJECT')
+        scene.objects.active = active
+        scene.objects.unlink(ob)
+        bpy.data.objects.remove(ob)
+        bpy.data.meshes.remove(me)
+
+    return {'elements': num_elems, 'loop': t_loop, 'isolation': t_numpy}
+
+
+if __name__ == '__main__':
+    test()
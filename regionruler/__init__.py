@@ -62,7 +62,6 @@ import bpy
 import bgl
 import blf
 from mathutils import Matrix, Vector
-import mathutils.geometry as geom
 from bpy.app.handlers import persistent
 
 # import va
@@ -75,11 +74,14 @@ from bpy.app.handlers import persistent
 try:
     importlib.reload(addongroup)
     importlib.reload(customproperty)
+    importlib.reload(governor)
+    importlib.reload(measuresnap)
     importlib.reload(registerinfor)
+    importlib.reload(rulerlayout)
+    importlib.reload(rulerticks)
     importlib.reload(unitsystem)
     importlib.reload(utils)
     importlib.reload(vagl)
-    importlib.reload(vam)
     importlib.reload(vap)
     importlib.reload(vav)
     importlib.reload(vawm)
@@ -88,9 +90,12 @@ except NameError:
     from .addonutils import customproperty
     from .addonutils import registerinfo
     from .addonutils import utils
+    from . import governor
+    from . import measuresnap
+    from . import rulerlayout
+    from . import rulerticks
     from . import unitsystem
     from . import vagl
-    from . import vamath as vam
     from . import vaprops as vap
     from . import vaview3d as vav
     from . import vawm
@@ -336,6 +341,10 @@ class RegionRulerPreferences(
         '最小グリッド*5(or最小グリッド)の位置に数値を表示する。',
         default=(18, 90),  # (18, 36)
         min=1, max=120, soft_min=6, soft_max=60, size=2)
+    avoid_label_overlap = vap.BP(
+        'Avoid Number Overlap',
+        'Hide numbers that overlap others with higher priority',
+        default=False)
     draw_mouse_coordinates = vap.BP(
         'Mouse Coordinates',
         default=False)
@@ -356,6 +365,15 @@ class RegionRulerPreferences(
         'Use Simple Measure',
         'Hold alt key',
         default=False)
+    use_measure_snap = vap.BP(
+        'Use Measure Snap',
+        'Hold ctrl key to snap to vertices, edge centers and origins',
+        default=True)
+    measure_snap_distance = vap.IP(
+        'Snap Distance',
+        'Measure snap distance (pixel)',
+        default=12,
+        min=1, max=100, soft_min=1, soft_max=50)
     use_fill = vap.BP(
         'Use Fill',
         description='Fill text box',
@@ -405,6 +423,7 @@ class RegionRulerPreferences(
         col = split.column()
         self.draw_property('scale_size', col, row=True)
         self.draw_property('number_min_px', col, row=True)
+        self.draw_property('avoid_label_overlap', col)
         self.draw_property('draw_mouse_coordinates', col)
         prop = self.draw_property('mouse_coordinates_position', col)
         prop.active = self.draw_mouse_coordinates
@@ -416,6 +435,9 @@ class RegionRulerPreferences(
 
         col = split.column()
         self.draw_property('use_simple_measure', col, text='Simple Measure')
+        self.draw_property('use_measure_snap', col, text='Measure Snap')
+        prop = self.draw_property('measure_snap_distance', col)
+        prop.active = self.use_measure_snap
         self.draw_property('draw_cross_cursor', col, row=True)
         prop = self.draw_property('cross_cursor', col, text='', row=True)
         prop.active = self.draw_cross_cursor
@@ -474,6 +496,83 @@ def get_view_location(context):
     return view_location
 
 
+class SpaceRegistry(OrderedDict):
+    """{SpaceView3D.as_pointer(): {'enable': bool}, ...}
+    screen毎にareaのアドレスとspaceの数を記録しておき、それが変化した
+    screenのみspaceを走査し直す。更新される度にgenerationが増える。
+    """
+
+    SPACE_TYPES = {'VIEW_3D', 'IMAGE_EDITOR', 'NODE_EDITOR'}
+
+    def __init__(self):
+        super().__init__()
+        # {Screen.as_pointer(): (signature, {space address, ...}), ...}
+        self.screens = {}
+        self.generation = 0
+        self.default_enable = False  # 新規スペースのenableの値
+        self.dirty = True  # 真なら次のsync()で全screenを確認する
+
+    @staticmethod
+    def _signature(screen):
+        return tuple((area.as_pointer(), len(area.spaces))
+                     for area in screen.areas)
+
+    def ensure(self, address):
+        value = self.get(address)
+        if value is None:
+            value = self[address] = {'enable': self.default_enable}
+        return value
+
+    def sync_screen(self, screen):
+        """screenの構成が変わっていればそのspaceを登録し直す。
+        :return: 変更があれば真
+        :rtype: bool
+        """
+        ptr = screen.as_pointer()
+        signature = self._signature(screen)
+        item = self.screens.get(ptr)
+        if item is not None and item[0] == signature:
+            return False
+        addresses = set()
+        for area in screen.areas:
+            for space in area.spaces:
+                if space.type in self.SPACE_TYPES:
+                    address = space.as_pointer()
+                    addresses.add(address)
+                    self.ensure(address)
+        if item is not None:
+            for address in item[1] - addresses:
+                self.pop(address, None)
+        self.screens[ptr] = (signature, addresses)
+        self.generation += 1
+        return True
+
+    def sync(self, screens, windows=()):
+        """dirtyかscreenの数が変わった場合は全screenを、そうでなければ
+        windowsで表示中のscreenのみを確認する。
+        """
+        if self.dirty or len(screens) != len(self.screens):
+            valid = set()
+            for screen in screens:
+                valid.add(screen.as_pointer())
+                self.sync_screen(screen)
+            for ptr in set(self.screens) - valid:
+                _signature, addresses = self.screens.pop(ptr)
+                for address in addresses:
+                    self.pop(address, None)
+                self.generation += 1
+            self.dirty = False
+        else:
+            for win in windows:
+                self.sync_screen(win.screen)
+
+    def clear(self):
+        super().clear()
+        self.screens.clear()
+        self.generation += 1
+        self.dirty = True
+
+
 class Data:
     def __init__(self):
         # RegionRuler_PG.enableをTrueとした際に、そのプロパティのupdate関数が
@@ -491,7 +590,7 @@ class Data:
         self.exit_waiting = {}
 
         # {SpaceView3D.as_pointer(): {}, ...}
-        self.spaces = OrderedDict()
+        self.spaces = SpaceRegistry()
         # {Window.as_pointer(): Operator, ...}
         self.operators = {}
         # draw callback handler
@@ -524,16 +623,18 @@ class Data:
         self.shift = None
         self.alt = False
         self.alt_disable_count = 0
+        self.measure_snap = measuresnap.MeasureSnap()
+        self.snap_target = None  # measuresnap.SnapTarget
 
     def wm_sync(self):
         """WindowManagerに存在しない物をself.operatorsとself.spacesから削除。
         self.spacesに限って必要な要素を追加する。
+        spacesは変更されたscreenのみ更新する。
         """
         # delete operators
         context = bpy.context
         wm = context.window_manager
-        prefs = RegionRulerPreferences.get_instance()
-        valid_addresses = [win.as_pointer() for win in wm.windows]
+        valid_addresses = {win.as_pointer() for win in wm.windows}
         for address in list(self.operators):
             if address not in valid_addresses:
                 logger.debug('Delete invalid operator: ' +
@@ -542,21 +643,8 @@ class Data:
 
         # delete and add spaces
         # ruler起動中は新規スペースのenableフラグはTrueとなる
-        default_value = bool(self.operators)
-        d = OrderedDict()
-        for screen in bpy.data.screens:
-            for area in screen.areas:
-                for space in area.spaces:
-                    if space.type in ('VIEW_3D', 'IMAGE_EDITOR',
-                                      'NODE_EDITOR'):
-                        address = space.as_pointer()
-                        if address in self.spaces:
-                            value = self.spaces[address]
-                        else:
-                            value = {'enable': default_value}
-                        d[address] = value
-        self.spaces.clear()
-        self.spaces.update(d)
+        self.spaces.default_enable = bool(self.operators)
+        self.spaces.sync(bpy.data.screens, wm.windows)
 
     def updated_space(self, context, glsettings):
         """draw_callbackの頭で呼び出し、描画に必要な情報を更新する"""
@@ -579,7 +667,7 @@ class Data:
                 override['system'] = 'METRIC'
             elif ruler_settings.unit == 'imperial':
                 override['system'] = 'IMPERIAL'
-            unit_system = unitsystem.UnitSystem(context, override)
+            unit_system = unit_system_cache.get(context, override)
             unit_system_2d_x = unit_system_2d_y = None
 
             # View: top, right, left, ...
@@ -618,7 +706,7 @@ class Data:
             override = {'grid_scale': 1.0,
                         'grid_subdivisions': 10,
                         'system': 'NONE'}
-            unit_system = unitsystem.UnitSystem(context, override)
+            unit_system = unit_system_cache.get(context, override)
             view_type = 'top'
             sign_x = sign_y = 1
             vmat = Matrix(glsettings.modelview_matrix).transposed()
@@ -627,9 +715,9 @@ class Data:
             # X,Y毎にunit_systemを作成
             image_editor_unit = ruler_settings.image_editor_unit
             use_view2d = image_editor_unit == 'uv'
-            unit_system_2d_x = unitsystem.UnitSystem(
+            unit_system_2d_x = unit_system_cache.get(
                 context, override, axis='x', use_view2d=use_view2d)
-            unit_system_2d_y = unitsystem.UnitSystem(
+            unit_system_2d_y = unit_system_cache.get(
                 context, override, axis='y', use_view2d=use_view2d)
             image_sx, image_sy = unit_system.image_size
             if image_sx == 0:
@@ -666,7 +754,7 @@ class Data:
             override = {'grid_scale': 1.0, 'grid_subdivisions': 10,
                         'system': 'NONE'}
             use_view2d = ruler_settings.node_editor_unit != 'node'
-            unit_system = unitsystem.UnitSystem(context, override,
+            unit_system = unit_system_cache.get(context, override,
                                                 use_view2d=use_view2d)
             unit_system_2d_x = unit_system_2d_y = None
             view_type = 'top'
@@ -716,6 +804,12 @@ class Data:
 
 data = Data()
 
+unit_system_cache = unitsystem.UnitSystemCache()
+
+layout_cache = rulerlayout.LayoutCache()
+
+event_governor = governor.EventGovernor()
+
 
 ###############################################################################
 # Functions
@@ -745,17 +839,15 @@ def redraw_regions(context, region_types={'WINDOW', 'UI'}, window=None):
 def region_drawing_rectangle(context, area, region):
     """'WINDOW'の描画範囲を表すregion座標を返す。RegionOverlapが有効な場合の
     範囲は 'WINDOW' から 'TOOLS'('TOOL_PROPS'), 'UI' を除外したものになる。
+    計算はrulerlayout.drawing_rectangle()で行う。
     :return (xmin, ymin, xmax, ymax)
     :rtype (int, int, int, int)
     """
-    xmax = region.width - 1
-    ymin = 0
-    ymax = region.height - 1
-
     # right scroll bar
+    scrollbar_width = 0
     if context.area.type == 'NODE_EDITOR':
         # V2D_SCROLLER_HANDLE_SIZE 等を参照。+1は誤差修正用
-        xmax -= int(get_widget_unit(context) * 0.8) + 1
+        scrollbar_width = int(get_widget_unit(context) * 0.8) + 1
 
     # render info
     has_render_info = False
@@ -766,58 +858,18 @@ def region_drawing_rectangle(context, area, region):
     elif context.area.type == 'VIEW_3D':
         if context.space_data.viewport_shade == 'RENDERED':
             has_render_info = True
-    if has_render_info:
-        dpi = context.user_preferences.system.dpi
-        ymax -= get_widget_unit(context)
-
-    if not context.user_preferences.system.use_region_overlap:
-        return 0, ymin, xmax, ymax
+    header_height = get_widget_unit(context) if has_render_info else 0
 
     # Regionが非表示ならidが0。
     # その際、通常はwidth若しくはheightが1になっている。
     # TOOLSが非表示なのにTOOL_PROPSのみ表示される事は無い
-    window = tools = tool_props = ui = None
-    for ar in area.regions:
-        if ar.id != 0:
-            if ar.type == 'WINDOW':
-                window = ar
-            elif ar.type == 'TOOLS':
-                tools = ar
-            elif ar.type == 'TOOL_PROPS':
-                tool_props = ar
-            elif ar.type == 'UI':
-                ui = ar
-
-    xmin = region.x
-    xmax = xmin + region.width - 1
-    left_width = right_width = 0
-    if tools and ui:
-        r1, r2 = sorted([tools, ui], key=lambda ar: ar.x)
-        if r1.x == area.x:
-            # 両方左
-            if r2.x == r1.x + r1.width:
-                left_width = r1.width + r2.width
-            # 片方ずつ
-            else:
-                left_width = r1.width
-                right_width = r2.width
-        # 両方右
-        else:
-            right_width = r1.width + r2.width
-    elif tools:
-        if tools.x == area.x:
-            left_width = tools.width
-        else:
-            right_width = tools.width
-    elif ui:
-        if ui.x == area.x:
-            left_width = ui.width
-        else:
-            right_width = ui.width
+    side_regions = [(ar.x, ar.width) for ar in area.regions
+                    if ar.id != 0 and ar.type in {'TOOLS', 'UI'}]
 
-    xmin = max(xmin, area.x + left_width) - region.x
-    xmax = min(xmax, area.x + area.width - right_width - 1) - region.x
-    return xmin, ymin, xmax, ymax
+    return rulerlayout.drawing_rectangle(
+        region.width, region.height, region.x, area.x, area.width,
+        side_regions, context.user_preferences.system.use_region_overlap,
+        scrollbar_width, header_height)
 
 
 ###############################################################################
@@ -943,34 +995,6 @@ def draw_angle_box(context, box, line=False, fill=False,
 ###############################################################################
 # Draw
 ###############################################################################
-def rotated_bbox(box_width, box_height, angle):
-    """回転されたbounding boxの幅と高さを求める"""
-    mat = Matrix.Rotation(angle, 2)
-    hw = box_width / 2
-    hh = box_height / 2
-    vecs = [mat * Vector((x, y)) for x, y in
-            ((hw, hh), (hw, -hh), (-hw, hh), (-hw, -hh))]
-    width = max((abs(v[0]) for v in vecs)) * 2
-    height = max((abs(v[1]) for v in vecs)) * 2
-    return width, height
-
-
-def get_line_type(prop, cnt, magnification):
-    ssmain, sseven, ssodd = prop.scale_size
-    sseven = min(ssmain, sseven)
-    ssodd = min(ssmain, ssodd)
-    if cnt % magnification == 0:
-        line_width = 3
-        scale_size = ssmain
-    else:
-        line_width = 1
-        if cnt % 2 == 0:
-            scale_size = sseven
-        else:
-            scale_size = ssodd
-    return scale_size, line_width
-
-
 def modify_imperial_symbol(symbol):
     if symbol in ('fur',):
         symbol = 'mi'
@@ -997,45 +1021,110 @@ def calc_relative_magnification(unit_system):
     return magnification
 
 
-def scale_label_interval(context, unit_system, cnt):
-    prefs = RegionRulerPreferences.get_instance()
-    magnification = calc_relative_magnification(unit_system)
-    interval = 0
-    if magnification and cnt % magnification == 0:
-        interval = 10
-    elif cnt % 5 == 0 and unit_system.system in ('NONE', 'METRIC'):
-        if unit_system.dpg >= prefs.number_min_px[0]:
-            interval = 5
-    elif unit_system.dpg >= prefs.number_min_px[1]:
-        interval = 1
-        if unit_system.system == 'NONE':
-            interval = 1
-        elif unit_system.dpg >= prefs.number_min_px[1] * 2:
-            interval = 1
+class LabelCache:
+    """目盛とマウス座標の文字列、及びblf.dimensions()の結果を保持して
+    フレーム間で使い回す。
+    dimensions()はfont_size()で設定した文字サイズをキーに含めるので、
+    先にfont_size()を呼んでおくこと。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.labels = OrderedDict()
+        self.widths = OrderedDict()
+        self.font_sizes = {}  # {font_id: (size, dpi), ...}
+        self.label_hits = self.label_misses = 0
+        self.dimension_hits = self.dimension_misses = 0
+
+    def _get(self, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _set(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def label(self, key, func, *args):
+        """キャッシュに無ければfunc(*args)で作る。
+        :type key: tuple
+        :rtype: str
+        """
+        text = self._get(self.labels, key)
+        if text is None:
+            self.label_misses += 1
+            text = func(*args)
+            self._set(self.labels, key, text)
+        else:
+            self.label_hits += 1
+        return text
+
+    def font_size(self, font_id, size, dpi):
+        blf.size(font_id, size, dpi)
+        self.font_sizes[font_id] = (size, dpi)
 
-    return interval
+    def dimensions(self, font_id, text):
+        """blf.dimensions()
+        :rtype: (float, float)
+        """
+        if font_id not in self.font_sizes:
+            return blf.dimensions(font_id, text)
+        key = (font_id, self.font_sizes[font_id], text)
+        dims = self._get(self.widths, key)
+        if dims is None:
+            self.dimension_misses += 1
+            dims = blf.dimensions(font_id, text)
+            self._set(self.widths, key, dims)
+        else:
+            self.dimension_hits += 1
+        return dims
+
+    def stats(self):
+        return {'label_hits': self.label_hits,
+                'label_misses': self.label_misses,
+                'dimension_hits': self.dimension_hits,
+                'dimension_misses': self.dimension_misses,
+                'labels': len(self.labels),
+                'dimensions': len(self.widths)}
+
+    def clear(self):
+        self.labels.clear()
+        self.widths.clear()
+        self.font_sizes.clear()
+        self.label_hits = self.label_misses = 0
+        self.dimension_hits = self.dimension_misses = 0
 
 
-def make_scale_label(context, unit_system, cnt):
+label_cache = LabelCache()
+
+
+def make_scale_label(context, unit_system, cnt, interval):
     """
     :param unit_system:
     :type unit_system: unitsystem.UnitSystem
     :param cnt:
     :type cnt: int
+    :param interval: rulerticks.label_intervals()の値
+    :type interval: int
     :rtype: str
     """
 
-    units = unit_system.units
-    unit = unit_system.unit
-
     if cnt == 0 and unit_system.system != 'NONE':
-        return '0' + units.next_basic(unit.symbol)
-
-    interval = scale_label_interval(context, unit_system, cnt)
+        units = unit_system.units
+        return '0' + units.next_basic(unit_system.unit.symbol)
 
     if interval == 0:
         return ''
 
+    key = ('scale', unit_system.fingerprint(), cnt, interval)
+    return label_cache.label(key, _make_scale_label, unit_system, cnt)
+
+
+def _make_scale_label(unit_system, cnt):
+    unit = unit_system.unit
+
     if unit_system.system == 'NONE':
         value = unit_system.bupg * cnt
         e = max(0, -int(math.log10(unit_system.bupg)))
@@ -1057,111 +1146,53 @@ def make_scale_label(context, unit_system, cnt):
     return text
 
 
-def clip_start_end(context, start, end, offset, negative):
-    region = context.region
-    rv3d = context.region_data
-    sign = -1 if negative else 1
-    sx, sy = region.width, region.height
-    q1 = Vector((-1, -1))
-    q2 = Vector((sx + 1, -1))
-    q3 = Vector((sx + 1, sy + 1))
-    q4 = Vector((-1, sy + 1))
-    unit_system = data.unit_system
-
-    is_world_coords = len(start) == 3
-    line = (end - start).normalized()
-
-    invalid_result = None, None, 0.0
-
-    # World coors
-    if is_world_coords:
-        start_rco_no_clip = vav.project(region, rv3d, start).to_2d()
-        end_rco_no_clip = vav.project(region, rv3d, end).to_2d()
-        result = vam.intersect_line_quad_2d(start_rco_no_clip, end_rco_no_clip,
-                                            q1, q2, q3, q4, True)
-        if result is None:
-            return invalid_result
-        start_rco, end_rco = result
-        if start_rco == end_rco:
-            return invalid_result
-
-        # startとoffsetの修正
-        if start_rco != start_rco_no_clip:
-            p1 = Vector((start_rco[0], start_rco[1], 0.5))
-            p2 = Vector((start_rco[0], start_rco[1], 1.0))
-            v1 = vav.unproject(region, rv3d, p1)
-            v2 = vav.unproject(region, rv3d, p2)
-            v3, v4 = geom.intersect_line_line(v1, v2, start, end)
-            v = (v3 + v4) / 2
-            offset += sign * (start - v).length
-            start = v
-
-        # endの修正
-        if end_rco != end_rco_no_clip:
-            p1 = Vector((end_rco[0], end_rco[1], 0.5))
-            p2 = Vector((end_rco[0], end_rco[1], 1.0))
-            v1 = vav.unproject(region, rv3d, p1)
-            v2 = vav.unproject(region, rv3d, p2)
-            v3, v4 = geom.intersect_line_line(v1, v2, start, end)
-            end = (v3 + v4) / 2
-
-    # Region coords
+def _ruler_persmat(context, start):
+    if len(start) == 3:
+        region = context.region
+        rv3d = context.region_data
+        return vav.ProjectionContext.get(region, rv3d).persmat
     else:
-        result = vam.intersect_line_quad_2d(start, end, q1, q2, q3, q4, True)
-        if result is None:
-            return invalid_result
-        start_rco, end_rco = result
-        if start_rco == end_rco:
-            return invalid_result
-        dot_ofs = line.dot(start_rco - start)
-        offset += sign * dot_ofs * unit_system.bupd
-        start = start_rco
-        end = end_rco
-
-    return start, end, offset
-
-
-def generate_scale_points(context, start, end, offset, negative):
-    """目盛のカウントとregion座標を返すジェネレータ"""
+        return None
+
+
+def _layout_free_ruler(context, prefs, start, end, offset, negative, persmat,
+                       line_feed, rotate_text, number_upper_side,
+                       double_side_scale, base_line, draw_zero):
+    """draw_free_ruler()の配置を求める。フォントサイズは設定済みの事。
+    :rtype: rulerlayout.RulerLayout | None
+    """
     region = context.region
-    rv3d = context.region_data
     unit_system = data.unit_system
+    magnification = calc_relative_magnification(unit_system)
 
-    sign = -1 if negative else 1
+    # clip, 目盛の位置と種類
+    ticks = rulerticks.ruler_ticks(
+        start, end, offset, negative, unit_system, magnification,
+        region.width, region.height, persmat, prefs.scale_size)
+    if ticks is None:
+        return None
+    intervals = rulerticks.label_intervals(
+        ticks.counts, magnification, unit_system.system, unit_system.dpg,
+        prefs.number_min_px)
 
-    count, val = divmod(offset, unit_system.bupg)
-    count = int(count)
-    if val == 0.0:
-        scale_start = start.copy()
-    else:
-        sign = -1 if negative else 1
-        if sign == 1:
-            count += 1
-        count_offset = count * unit_system.bupg
-        line = (end - start).normalized()
-        if len(start) == 3:
-            v = sign * (count_offset - offset) * line
+    labels = []
+    for count, interval in zip(ticks.counts.tolist(), intervals.tolist()):
+        if count == 0 and 'number' not in draw_zero:
+            labels.append('')
         else:
-            v = sign * (count_offset - offset) * unit_system.dpbu * line
-        scale_start = start + v
+            labels.append(make_scale_label(context, unit_system, count,
+                                           interval))
 
-    if (scale_start - start).length > (end - start).length:
-        return
+    font = prefs.font
+    _, th = label_cache.dimensions(font.id, string.digits)
 
-    if len(start) == 3:
-        offset_vec = (end - start).normalized() * unit_system.bupg
-        num = int((end - scale_start).length / unit_system.bupg) + 1
-        for _ in range(num):
-            yield count, vav.project(region, rv3d, scale_start).to_2d()
-            count += sign
-            scale_start += offset_vec
-    else:
-        offset_vec = (end - start).normalized() * unit_system.dpg
-        num = int((end - scale_start).length * unit_system.gpd) + 1
-        for _ in range(num):
-            yield count, scale_start.copy()
-            count += sign
-            scale_start += offset_vec
+    def text_width(text):
+        return label_cache.dimensions(font.id, text)[0]
+
+    return rulerlayout.layout_ruler(
+        ticks, labels, text_width, th, font.margin, prefs.scale_size,
+        line_feed, rotate_text, number_upper_side, double_side_scale,
+        base_line, draw_zero, intervals, prefs.avoid_label_overlap)
 
 
 def draw_free_ruler(context, prefs, start, end, offset,
@@ -1196,151 +1227,47 @@ def draw_free_ruler(context, prefs, start, end, offset,
     """
 
     region = context.region
-    rv3d = context.region_data
     unit_system = data.unit_system
 
-    # clip
-    start, end, offset = clip_start_end(context, start, end, offset, negative)
-    if start is None:
-        return
-
-    if len(start) == 3:
-        start_rco = vav.project(region, rv3d, start).to_2d()
-        end_rco = vav.project(region, rv3d, end).to_2d()
-    else:
-        start_rco = start.copy()
-        end_rco = end.copy()
-    hvec = (end_rco - start_rco).normalized()
-    if number_upper_side:
-        vvec = Vector((-hvec[1], hvec[0]))
-    else:
-        vvec = Vector((hvec[1], -hvec[0]))
-    angle = math.atan2(hvec[1], hvec[0])
-
-    # 目盛りの大きさ
-    ssmain, sseven, ssodd = prefs.scale_size  # even:偶数
-    sseven = min(ssmain, sseven)
-    ssodd = min(ssmain, ssodd)
-
     # Font
     font = prefs.font
-    blf.size(font.id, font.size, context.user_preferences.system.dpi)
-    _, th = blf.dimensions(font.id, string.digits)
-    margin = font.margin
-
-    magnification = calc_relative_magnification(unit_system)
-
-    lines = []
-    lines_bold = []
-    numbers = []
-    numbers_fill = []
-    triangles = []
-
-    for count, p in generate_scale_points(
-            context, start, end, offset, negative):
-        # Scale
-        if not (count == 0 and 'scale' not in draw_zero):
-            if count % magnification == 0:
-                scale_size = ssmain
-                line_width = 3
-            else:
-                scale_size = sseven if count % 2 == 0 else ssodd
-                line_width = 1
-
-            # 5-Triangles
-            if count % 5 == 0 and count % 10 != 0:
-                if unit_system.system != 'IMPERIAL':
-                    if ssmain >= 3:
-                        v1 = p + vvec * max(0, (ssodd - 3))  # top vertex
-                        v2 = vvec * 3
-                        v3 = hvec * 2
-                        triangles.append((v1 + v2 - v3, v1 + v2 + v3, v1))
-                        scale_size = max(0, scale_size - 3)
-
-            if double_side_scale:
-                val = (p + vvec * scale_size, p - vvec * scale_size)
-            else:
-                val = (p, p + vvec * scale_size)
-            if line_width == 1:
-                lines.append(val)
-            else:
-                lines_bold.append(val)
-
-        # 数値。複数行の場合は右揃え
-        if count == 0 and 'number' not in draw_zero:
-            text = ''
-        else:
-            text = make_scale_label(context, unit_system, count)
-        if line_feed:
-            text_lines = text.split(' ')
-            widths = [blf.dimensions(font.id, t)[0] for t in text_lines]
-        else:
-            text_lines = [text]
-            widths = [blf.dimensions(font.id, text)[0]]
-        box_width = max(widths) + margin * 2
-        box_height = len(widths) * th + (len(widths) + 1) * margin
-        if rotate_text:
-            vx = hvec
-            vy = -vvec
-            h = box_height
-        else:
-            vx = Vector((1, 0))
-            vy = Vector((0, 1))
-            rbox_width, h = rotated_bbox(box_width, box_height, -angle)
-        box_center = p + (ssmain + h / 2) * vvec
-        box_loc = box_center - box_width / 2 * vx - box_height / 2 * vy
-        if text:
-            for i in range(len(text_lines)):
-                txt = text_lines[-i - 1]
-                tw = widths[-i - 1]
-                fx = box_width - margin - tw
-                fy = margin + (th + margin) * i
-                v = box_loc + vx * fx + vy * fy
-                numbers.append((v[0], v[1], txt))
-                v -= (vx + vy) * margin
-                w = tw + margin * 2
-                h = th + margin * 2
-                numbers_fill.append((v[0], v[1], w, h))
-
-        # Origin Triangles
-        if count == 0:
-            if 'marker' in draw_zero:
-                if rotate_text:
-                    w = box_width / 2
-                else:
-                    w = rbox_width / 2
-                triangles.append((box_center - hvec * w - vvec * (th / 2),
-                                  box_center - hvec * (w + 5),
-                                  box_center - hvec * w + vvec * (th / 2)))
-                triangles.append((box_center + hvec * w - vvec * (th / 2),
-                                  box_center + hvec * w + vvec * (th / 2),
-                                  box_center + hvec * (w + 5)))
+    dpi = context.user_preferences.system.dpi
+    label_cache.font_size(font.id, font.size, dpi)
+
+    persmat = _ruler_persmat(context, start)
+    key = (tuple(start), tuple(end), offset, negative,
+           unit_system.fingerprint(), unit_system.bupg, unit_system.dpbu,
+           unit_system.dpg, region.width, region.height,
+           None if persmat is None else persmat.tobytes(),
+           line_feed, rotate_text, number_upper_side, double_side_scale,
+           base_line, frozenset(draw_zero), tuple(prefs.scale_size),
+           tuple(prefs.number_min_px), prefs.avoid_label_overlap, font.id,
+           font.size, dpi, font.margin)
+    layout = layout_cache.get(
+        key, _layout_free_ruler, context, prefs, start, end, offset,
+        negative, persmat, line_feed, rotate_text, number_upper_side,
+        double_side_scale, base_line, draw_zero)
+    if layout is None:
+        return
+    angle = layout.angle
 
     # 描画
-    if base_line:
-        bgl.glColor4f(*(list(prefs.color.line) + [0.5]))
-        bgl.glLineWidth(1)
-        bgl.glBegin(bgl.GL_LINES)
-        bgl.glVertex2f(*start_rco)
-        bgl.glVertex2f(*end_rco)
-        bgl.glEnd()
-
-    bgl.glColor3f(*prefs.color.line)
+    batch = vagl.DrawBatch(vagl.GLBackend())
+    if layout.base_line is not None:
+        batch.add_lines([layout.base_line], list(prefs.color.line) + [0.5])
 
     # 目盛
-    for line_width, lines in ((1.0, lines), (3.0, lines_bold)):
-        bgl.glLineWidth(line_width)
-        bgl.glBegin(bgl.GL_LINES)
-        for v1, v2 in lines:
-            bgl.glVertex2f(*v1)
-            bgl.glVertex2f(*v2)
-        bgl.glEnd()
-    bgl.glLineWidth(1.0)
+    batch.add_lines(layout.lines, prefs.color.line, 1.0, layer=1)
+    batch.add_lines(layout.lines_bold, prefs.color.line, 3.0, layer=1)
 
     # 三角形
-    for p1, p2, p3 in triangles:
-        vagl.draw_triangle(p1, p2, p3, poly=True)
-        vagl.draw_triangle(p1, p2, p3)
+    if len(layout.triangles):
+        batch.add_triangles(layout.triangles, prefs.color.line, layer=2)
+        for tri in layout.triangles:
+            batch.add_line_loop(tri, prefs.color.line, layer=2)
+
+    batch.flush()
+    bgl.glColor3f(*prefs.color.line)
 
     # 数値
     if rotate_text:
@@ -1360,9 +1287,9 @@ def draw_free_ruler(context, prefs, start, end, offset,
         bgl.glTexParameteri(bgl.GL_TEXTURE_2D, bgl.GL_TEXTURE_MIN_FILTER,
                             bgl.GL_LINEAR)
     bgl.glColor3f(*prefs.color.number)
-    for number_data, fill_data in zip(numbers, numbers_fill):
+    for number_data, fill_data in zip(layout.labels, layout.boxes.tolist()):
         xmin, ymin, w, h = fill_data
-        ang = angle if rotate_text else 0.0
+        ang = layout.box_angle
         x, y, text = number_data
         blf.position(prefs.font.id, x, y, 0)
         draw_font_context(context, prefs.font.id, text, outline=True,
@@ -1452,10 +1379,9 @@ def view3d_upper_left_text_rect(context):
         except:
             pass
     blf.size(font_id, 11, dpi)
+    label_cache.font_sizes.pop(font_id, None)
     w, h = blf.dimensions(font_id, text)
-    return [widget_unit, int(widget_unit + w),
-            region.height - 1 - widget_unit,
-            region.height - 1 - widget_unit + h]
+    return rulerlayout.upper_left_text_rect(region.height, widget_unit, w, h)
 
 
 def set_model_view_z(z):
@@ -1472,13 +1398,10 @@ def draw_mask(context):
     set_model_view_z(50)
 
     name_rect = view3d_upper_left_text_rect(context)
-    margin = 5
     bgl.glColorMask(0, 0, 0, 0)
     bgl.glBegin(bgl.GL_QUADS)
-    bgl.glVertex2f(name_rect[0] - margin, name_rect[2] - margin)
-    bgl.glVertex2f(name_rect[1] + margin, name_rect[2] - margin)
-    bgl.glVertex2f(name_rect[1] + margin, name_rect[3] + margin)
-    bgl.glVertex2f(name_rect[0] - margin, name_rect[3] + margin)
+    for co in rulerlayout.mask_quad(name_rect, margin=5):
+        bgl.glVertex2f(*co)
     bgl.glEnd()
     bgl.glColorMask(1, 1, 1, 1)
 
@@ -1570,9 +1493,10 @@ def draw_unit_box(context, use_fill):
     sx, sy = region.width, region.height
     xmin, ymin, xmax, ymax = region_drawing_rectangle(context, area, region)
     font = prefs.font
-    blf.size(font.id, font.size, context.user_preferences.system.dpi)
-    _, text_height = blf.dimensions(font.id, string.digits)
-    tw, _ = blf.dimensions(font.id, text)
+    label_cache.font_size(font.id, font.size,
+                          context.user_preferences.system.dpi)
+    _, text_height = label_cache.dimensions(font.id, string.digits)
+    tw, _ = label_cache.dimensions(font.id, text)
     w = tw + font.margin * 2 + 4  # 見にくいのでちょっと変更
     h = text_height + font.margin * 2
     box = [xmax - w, sy - h - 1, w, h]
@@ -1627,8 +1551,9 @@ def draw_measure(context, event):
     font = prefs.font
     margin = font.margin
 
-    blf.size(font.id, font.size, context.user_preferences.system.dpi)
-    _, th = blf.dimensions(font.id, string.digits)
+    label_cache.font_size(font.id, font.size,
+                          context.user_preferences.system.dpi)
+    _, th = label_cache.dimensions(font.id, string.digits)
 
     if ruler_settings.view_depth == 'cursor':
         depth_location = context.scene.cursor_location
@@ -1665,13 +1590,22 @@ def draw_measure(context, event):
             bgl.glColorMask(1, 1, 1, 1)
 
     # Calc coords ---------------------------------------------------------
+    snap_target = data.snap_target
+    if snap_target:
+        mco = Vector(snap_target.region_co)
     if data.measure_points:
         coordsW = data.measure_points[:]
-        coordsR = [vav.project_v3(sx, sy, pmat, v).to_2d()
-                   for v in data.measure_points]
-        coordsW.append(vav.unproject_v3(sx, sy, pimat, mco,
-                                        coordsW[-1], True))
+        pctx = vav.ProjectionContext.get(region, rv3d)
+        coordsR = [Vector(v) for v in pctx.project_2d(data.measure_points)]
+        if snap_target:
+            coordsW.append(Vector(snap_target.location))
+        else:
+            coordsW.append(vav.unproject_v3(sx, sy, pimat, mco,
+                                            coordsW[-1], True))
         coordsR.append(mco)
+    elif snap_target:
+        coordsW = [Vector(snap_target.location)]
+        coordsR = [mco]
     else:
         coordsW = [vav.unproject_v3(sx, sy, pimat, mco,
                                     depth_location, True)]
@@ -1687,7 +1621,7 @@ def draw_measure(context, event):
             # Width Box -------------------------------------------------------
             value = (v2R[0] - v1R[0]) * unit_system.bupd
             text = make_mouse_coordinate_label(context, unit_system, value)
-            tw, _ = blf.dimensions(font.id, text)
+            tw, _ = label_cache.dimensions(font.id, text)
             if v2R[0] >= v1R[0]:
                 x = mco[0] - tw - margin * 2 - 20
             else:
@@ -1700,7 +1634,7 @@ def draw_measure(context, event):
             # Height Box ------------------------------------------------------
             value = (v2R[1] - v1R[1]) * unit_system.bupd
             text = make_mouse_coordinate_label(context, unit_system, value)
-            tw, _ = blf.dimensions(font.id, text)
+            tw, _ = label_cache.dimensions(font.id, text)
             if v2R[1] >= v1R[1]:
                 y = mco[1] - th - margin * 2 - 20
             else:
@@ -1722,7 +1656,7 @@ def draw_measure(context, event):
             # length
             text = make_mouse_coordinate_label(
                 context, unit_system, (v1W - v2W).length)
-            tw, _ = blf.dimensions(font.id, text)
+            tw, _ = label_cache.dimensions(font.id, text)
             box = [mco[0] + 1.6 * ofs, mco[1] - th - ofs,
                    tw + margin * 2, th + margin * 2]
             draw_box_text(box, text)
@@ -1734,7 +1668,7 @@ def draw_measure(context, event):
                 text = "{0:.2f}".format(angle)
             else:
                 text = "{0:.2f}".format(math.degrees(angle))
-            tw, _ = blf.dimensions(font.id, text)
+            tw, _ = label_cache.dimensions(font.id, text)
             box[1] -= th + 10
             box[2] = tw + margin * 2
             draw_angle_box_text(box, text)
@@ -1765,9 +1699,10 @@ def draw_measure(context, event):
             # Length ----------------------------------------------------------
             text = make_mouse_coordinate_label(
                 context, unit_system, (v1W - v2W).length)
-            tw, _ = blf.dimensions(font.id, text)
-            _width, height = rotated_bbox(tw + margin * 2, th + margin * 2,
-                                         - math.atan2(*(v2R - v1R).yx))
+            tw, _ = label_cache.dimensions(font.id, text)
+            _width, height = rulerlayout.rotated_bbox(
+                tw + margin * 2, th + margin * 2,
+                - math.atan2(*(v2R - v1R).yx))
             hvec = (v2R - v1R).normalized()
             vvec = Matrix.Rotation(-math.pi / 2, 2) * hvec
             v = (v2R + v1R) / 2 + (ssmain + height / 2) * vvec
@@ -1790,7 +1725,7 @@ def draw_measure(context, event):
                     text = "{0:.2f}".format(angle)
                 else:
                     text = "{0:.2f}".format(math.degrees(angle))
-                tw, _ = blf.dimensions(font.id, text)
+                tw, _ = label_cache.dimensions(font.id, text)
                 box = (v[0] - tw / 2 - margin,
                        v[1] - th / 2 - margin,
                        tw + margin * 2, th + margin * 2)
@@ -1831,6 +1766,8 @@ def draw_measure(context, event):
                                     double_side_scale=True, draw_zero=set())
                 if view_loc is not None:
                     unit_system.view_location = view_loc
+                else:
+                    del unit_system.view_location
                 unit_system.update(context)
             else:
                 # Single Scale
@@ -1842,55 +1779,47 @@ def draw_measure(context, event):
                                 draw_zero={'scale'})
 
     def draw_backgrount_circle():
-        bgl.glColor4f(*(list(prefs.color.line) + [0.5]))
-        bgl.glLineWidth(1)
+        batch = vagl.DrawBatch(vagl.GLBackend())
+        color = list(prefs.color.line) + [0.5]
 
         # Background circle ---------------------------------------------------
         if data.measure_points:
             centerR = coordsR[-2]
 
             if 0 <= centerR[0] <= sx and 0 <= centerR[1] <= sy:
-                vagl.draw_circle(centerR[0], centerR[1],
-                                 (centerR - mco).length, 256)
+                batch.add_circle(centerR[0], centerR[1],
+                                 (centerR - mco).length, 256, color)
             else:
                 angle = (2 * math.pi /
                          (2 * (centerR - mco).length * math.pi / 2.0))
                 angle = max(angle, 1E-6)
-                mat = Matrix.Rotation(angle, 2)
-                v = mco - centerR
-                vec = mco.copy()
-                bgl.glBegin(bgl.GL_LINE_STRIP)
-                while 0 <= vec[0] <= sx and 0 <= vec[1] <= sy:
-                    bgl.glVertex2f(*vec)
-                    v = v * mat
-                    vec = v + centerR
-                bgl.glVertex2f(*vec)
-                bgl.glEnd()
-                mat = Matrix.Rotation(-angle, 2)
-                v = mco - centerR
-                vec = mco.copy()
-                bgl.glBegin(bgl.GL_LINE_STRIP)
-                while 0 <= vec[0] <= sx and 0 <= vec[1] <= sy:
-                    bgl.glVertex2f(*vec)
-                    v = v * mat
-                    vec = v + centerR
-                bgl.glVertex2f(*vec)
-                bgl.glEnd()
+                for ang in (angle, -angle):
+                    mat = Matrix.Rotation(ang, 2)
+                    v = mco - centerR
+                    vec = mco.copy()
+                    coords = []
+                    while 0 <= vec[0] <= sx and 0 <= vec[1] <= sy:
+                        coords.append(vec)
+                        v = v * mat
+                        vec = v + centerR
+                    coords.append(vec)
+                    batch.add_line_strip(coords, color)
 
         # Background Line -----------------------------------------------------
         if len(coordsR) > 1:
             v1R = coordsR[-2]
-            bgl.glBegin(bgl.GL_LINE_STRIP)
-            bgl.glVertex2f(v1R[0], min(v1R[1], mco[1]))
-            bgl.glVertex2f(v1R[0], data.mcbox_x[1])
-            bgl.glVertex2f(mco[0], data.mcbox_x[1])
-            bgl.glEnd()
-
-            bgl.glBegin(bgl.GL_LINE_STRIP)
-            bgl.glVertex2f(min(v1R[0], mco[0]), v1R[1])
-            bgl.glVertex2f(data.mcbox_y[0], v1R[1])
-            bgl.glVertex2f(data.mcbox_y[0], mco[1])
-            bgl.glEnd()
+            batch.add_line_strip(
+                [(v1R[0], min(v1R[1], mco[1])),
+                 (v1R[0], data.mcbox_x[1]),
+                 (mco[0], data.mcbox_x[1])], color)
+            batch.add_line_strip(
+                [(min(v1R[0], mco[0]), v1R[1]),
+                 (data.mcbox_y[0], v1R[1]),
+                 (data.mcbox_y[0], mco[1])], color)
+
+        batch.flush()
+        bgl.glColor4f(*color)
+        bgl.glLineWidth(1)
 
 
     bgl.glEnable(bgl.GL_BLEND)
@@ -1958,6 +1887,12 @@ def draw_cross_cursor(context, event):
 
 
 def make_mouse_coordinate_label(context, unit_system, value):
+    key = ('mouse', unit_system.fingerprint(), unit_system.dpbu, value)
+    return label_cache.label(key, _make_mouse_coordinate_label, unit_system,
+                             value)
+
+
+def _make_mouse_coordinate_label(unit_system, value):
     # 丸めは0方向への切り捨て
     if unit_system.system == 'NONE':
         e = max(0, -int(math.log10(unit_system.bupg) - 1))
@@ -2013,13 +1948,14 @@ def draw_mouse_coordinates_lower_right(context, event, use_fill):
 
     unit_system = data.unit_system
     font = prefs.font
-    blf.size(font.id, font.mcsize, context.user_preferences.system.dpi)
-    _, th = blf.dimensions(font.id, string.digits)
+    label_cache.font_size(font.id, font.mcsize,
+                          context.user_preferences.system.dpi)
+    _, th = label_cache.dimensions(font.id, string.digits)
 
     x_label = make_mouse_coordinate_label(context, unit_system, data.mval[0])
     y_label = make_mouse_coordinate_label(context, unit_system, data.mval[1])
     label = x_label + ', ' + y_label
-    tw, _ = blf.dimensions(font.id, label)
+    tw, _ = label_cache.dimensions(font.id, label)
 
     region = context.region
 
@@ -2073,8 +2009,9 @@ def draw_mouse_coordinates(context, event, use_fill):
     triangle_size = 6
 
     font = prefs.font
-    blf.size(font.id, font.mcsize, context.user_preferences.system.dpi)
-    _, th = blf.dimensions(font.id, string.digits)
+    label_cache.font_size(font.id, font.mcsize,
+                          context.user_preferences.system.dpi)
+    _, th = label_cache.dimensions(font.id, string.digits)
 
     set_model_view_z(90)
 
@@ -2084,7 +2021,7 @@ def draw_mouse_coordinates(context, event, use_fill):
     else:
         unit_system = data.unit_system
     text = make_mouse_coordinate_label(context, unit_system, data.mval[0])
-    tw, _ = blf.dimensions(font.id, text)
+    tw, _ = label_cache.dimensions(font.id, text)
     boxw = tw + font.margin * 2
     boxh = th + font.margin * 2
     boxx = mco[0] - boxw / 2
@@ -2095,7 +2032,8 @@ def draw_mouse_coordinates(context, event, use_fill):
     rect = view3d_upper_left_text_rect(context)
     use_fill_x = (boxx < rect[1] and boxy < rect[3] and
                   rect[0] < boxx + boxw and rect[2] < boxy + boxh) or use_fill
-    blf.size(font.id, font.mcsize, context.user_preferences.system.dpi)
+    label_cache.font_size(font.id, font.mcsize,
+                          context.user_preferences.system.dpi)
 
     bgl.glEnable(bgl.GL_BLEND)
     if data.is_inside and (not prefs.autohide_mouse_coordinate or
@@ -2134,7 +2072,7 @@ def draw_mouse_coordinates(context, event, use_fill):
         unit_system = data.unit_system
     text = make_mouse_coordinate_label(context, unit_system, data.mval[1])
     text_lines = text.split(' ')
-    tw = max([blf.dimensions(font.id, t)[0] for t in text_lines])
+    tw = max([label_cache.dimensions(font.id, t)[0] for t in text_lines])
     boxw = tw + font.margin * 2
     boxh = th * len(text_lines) + font.margin * (len(text_lines) + 1)
     boxx = xmax - ssmain - boxw
@@ -2157,7 +2095,7 @@ def draw_mouse_coordinates(context, event, use_fill):
         bgl.glColor3f(*prefs.color.number)
         py = mco[1] + boxh / 2 - font.margin - th
         for text_line in text_lines:
-            tw, _ = blf.dimensions(font.id, text_line)
+            tw, _ = label_cache.dimensions(font.id, text_line)
             px = xmax - ssmain - tw - font.margin
             blf.position(font.id, px, py, 0)
             draw_font_context(context, font.id, text_line,
@@ -2198,6 +2136,9 @@ def draw_callback(context):
     if not prop.enable:
         return
 
+    # 分割等で構成が変わったscreenのspaceをここで登録・削除する
+    data.spaces.sync_screen(context.screen)
+
     glsettings = vagl.GLSettings(context)
     glsettings.push()
 
@@ -2364,16 +2305,41 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
            event.type not in ('MOUSEMOVE', 'INBETWEEN_MOUSEMOVE'):
             data.shift = None
 
+        snap = data.measure_snap
+        if (running_measure or data.simple_measure) and \
+                prefs.use_measure_snap:
+            if not snap.active:
+                snap.start(context.scene, context.visible_objects)
+        elif snap.active:
+            snap.stop()
+            data.snap_target = None
+
         if region and rv3d:
             mco = (event.mouse_x - region.x, event.mouse_y - region.y)
             if running_measure or data.simple_measure:
+                snap_target = data.snap_target
+                if (event.ctrl and prefs.use_measure_snap and
+                        event.type in ('MOUSEMOVE', 'INBETWEEN_MOUSEMOVE',
+                                       'LEFT_CTRL', 'RIGHT_CTRL')):
+                    # 編集モードのメッシュはctrlを押した時のみ読み直す
+                    snap.sync(context.scene, context.visible_objects,
+                              event.type in ('LEFT_CTRL', 'RIGHT_CTRL'))
+                    pctx = vav.ProjectionContext.get(region, rv3d)
+                    data.snap_target = snap.nearest(
+                        pctx, mco, prefs.measure_snap_distance)
+                elif not event.ctrl:
+                    data.snap_target = None
+                if data.snap_target is not snap_target:
+                    do_redraw = True
                 if event.type == 'ESC' and event.value == 'PRESS':
                     RegionRuler_PG._measure = False
                     data.measure_points.clear()
                     do_redraw = True
                     do_redraw_panel = True
                 elif event.type == 'LEFTMOUSE' and event.value == 'PRESS':
-                    if data.measure_points:
+                    if data.snap_target:
+                        vec = Vector(data.snap_target.location)
+                    elif data.measure_points:
                         dvec = data.measure_points[-1]
                         vec = vav.unproject(region, rv3d, mco, dvec)
                     else:
@@ -2450,6 +2416,7 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
         data.mouse_coords[context.window.as_pointer()] = event.mco
 
         if event.type == 'INBETWEEN_MOUSEMOVE':
+            event_governor.events += 1
             return {'PASS_THROUGH'}
         elif event.type == 'MOUSEMOVE':
             # commit 53a3850a8a05249942a0c4a16060e9491456af02
@@ -2463,11 +2430,31 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
             # イベントが発生し続ける。
             if (event.mouse_x == event.mouse_prev_x and
                     event.mouse_y == event.mouse_prev_y):
+                event_governor.events += 1
                 return {'PASS_THROUGH'}
         elif event.type.startswith('TIMER'):
             return {'PASS_THROUGH'}
 
         prefs = RegionRulerPreferences.get_instance()
+        running_measure = RegionRuler_PG._measure or data.simple_measure
+        follow_mouse = (prefs.cross_cursor or prefs.draw_mouse_coordinates or
+                        running_measure)
+
+        # 一フレーム以内のマウス移動はまとめる。描画はイベントを直接参照
+        # するので、マウス下のregionの再描画だけ行う。
+        # Measureのドラッグ中とスナップ中は全て処理する。
+        # マウス下のregionが前回処理した時と異なればまとめない。まとめた
+        # 移動は後で処理されないので、regionを跨いで止まった場合に新しい
+        # regionとprev_region_idが更新されなくなる。
+        mergeable = not (running_measure and (data.shift or event.ctrl))
+        mouse_area, mouse_region = vawm.mouse_area_region(
+            event.mco, find_reverse=True)
+        region_id = mouse_region.id if mouse_region else -1
+        if event_governor.merge(ptr, event.type, mergeable, region_id):
+            if follow_mouse and mouse_region:
+                event_governor.tag_redraw(mouse_region, event.mco)
+            return {'PASS_THROUGH'}
+
         wm = context.window_manager
         data.wm_sync()
 
@@ -2487,6 +2474,8 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
         if self.terminate:
             msg = 'Exit view3d.region_ruler() (Window at {:x})'.format(address)
             logger.debug(msg)
+            logger.debug('Event governor: {}'.format(event_governor.stats()))
+            event_governor.forget_window(address)
             if address in data.operators:
                 del data.operators[address]
             if address in windows:
@@ -2510,13 +2499,14 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
                         if area.type in ('VIEW_3D', 'IMAGE_EDITOR',
                                          'NODE_EDITOR'):
                             space = area.spaces.active
-                            if data.spaces[space.as_pointer()]['enable']:
+                            value = data.spaces.ensure(space.as_pointer())
+                            if value['enable']:
                                 for region in area.regions:
                                     if region.type == 'WINDOW':
                                         region.tag_redraw()
         data.active_window = act_win_ptr
 
-        do_redraw = do_redraw_panel = False
+        do_redraw = do_redraw_panel = force_redraw = False
         if prefs.cross_cursor or prefs.draw_mouse_coordinates:
             if event.type == 'MOUSEMOVE':
                 do_redraw = True
@@ -2526,12 +2516,13 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
             retval, do_redraw_measure, do_redraw_panel_measure = \
                 self.modal_measure(context, event)
             do_redraw |= do_redraw_measure
+            force_redraw = do_redraw_measure
             do_redraw_panel |= do_redraw_panel_measure
         else:
             retval = {'PASS_THROUGH'}
 
         # 再描画: active region
-        area, region = vawm.mouse_area_region(event.mco, find_reverse=True)
+        area, region = mouse_area, mouse_region
         if area and area.type not in ('VIEW_3D', 'IMAGE_EDITOR',
                                       'NODE_EDITOR'):
             area = None
@@ -2540,7 +2531,9 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
             prop = space.region_ruler
             if prop.enable:
                 if do_redraw and region:
-                    region.tag_redraw()
+                    # マウス位置が同じなら描画内容も同じ
+                    event_governor.tag_redraw(region, event.mco,
+                                              force=force_redraw)
                 if do_redraw_panel:
                     for ar in area.regions:
                         if ar.type == 'UI':
@@ -2555,7 +2548,7 @@ class VIEW3D_OT_region_ruler(bpy.types.Operator):
             space = prev_area.spaces.active
             prop = space.region_ruler
             if prop.enable:
-                prev_region.tag_redraw()
+                event_governor.tag_redraw(prev_region, None)
 
         if region:
             data.prev_region_id = region.id
@@ -2738,7 +2731,18 @@ def load_pre_handler(dummy):
 def load_post_handler(dummy):
     logger.debug('Load Post')
 
+    data.spaces.dirty = True
     data.wm_sync()
+    unit_system_cache.invalidate()
+    logger.debug('Label cache: {}'.format(label_cache.stats()))
+    label_cache.clear()
+    logger.debug('Layout cache: {}'.format(layout_cache.stats()))
+    layout_cache.clear()
+    logger.debug('Event governor: {}'.format(event_governor.stats()))
+    event_governor.clear()
+    event_governor.reset_stats()
+    data.measure_snap.stop()
+    data.snap_target = None
 
     add_callback = False
     for space in (space for screen in bpy.data.screens
@@ -2767,6 +2771,9 @@ def scene_update_post_handler(dummy):
         event = data.events[ptr]
         mco = (event.mouse_x, event.mouse_y)
         if mco != data.mouse_coords[ptr]:
+            # scene_update_postは頻繁に呼ばれるので再起動の間隔を空ける
+            if not event_governor.allow_restart(ptr):
+                return
             logger.debug('Other modal operator started. Restart ruler')
             op = data.operators.pop(ptr)
             data.exit_waiting.setdefault(ptr, []).append(op)
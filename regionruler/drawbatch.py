@@ -0,0 +1,246 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+線、三角形、文字を溜めておき、まとめて描画する。
+
+batch = DrawBatch(vagl.GLBackend())
+batch.add_lines(segments, color, width=1.0)
+batch.add_triangles(triangles, color)
+batch.flush()
+
+プリミティブはlayer, 種類, 線幅が同じ物毎に一つの頂点配列にまとめられ、
+flush()でlayerの昇順に描画される。文字は各layerの図形の後に描画する。
+色は頂点毎に持つので、色が違っても同じ描画呼び出しにまとめられる。
+
+RecordingBackendは描画せずに呼び出しを記録するので、bglを使わずに
+描画内容を確認できる。
+bpyに依存しない。
+"""
+
+
+from collections import OrderedDict, namedtuple
+import math
+
+import numpy as np
+
+
+__all__ = ('LINES', 'TRIANGLES', 'DrawCall', 'TextCall', 'DrawBatch',
+           'RecordingBackend')
+
+
+LINES = 'LINES'
+TRIANGLES = 'TRIANGLES'
+
+
+DrawCall = namedtuple('DrawCall', ('mode', 'width', 'vertices', 'colors'))
+TextCall = namedtuple('TextCall', ('x', 'y', 'text', 'font_id', 'color',
+                                   'angle'))
+
+
+def _rgba(color):
+    color = tuple(color)
+    if len(color) == 3:
+        color += (1.0,)
+    return color
+
+
+class DrawBatch:
+    def __init__(self, backend=None):
+        """
+        :param backend: draw(DrawCall)とdraw_text(TextCall)を持つ物
+        """
+        self.backend = backend
+        # {(layer, mode, width): ([vertices, ...], [colors, ...]), ...}
+        self._groups = OrderedDict()
+        # {layer: [TextCall, ...], ...}
+        self._texts = OrderedDict()
+
+    def __len__(self):
+        """描画呼び出しの回数"""
+        return len(self._groups) + sum(len(t) for t in self._texts.values())
+
+    def _append(self, layer, mode, width, vertices, color):
+        key = (layer, mode, float(width))
+        item = self._groups.get(key)
+        if item is None:
+            item = self._groups[key] = ([], [])
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 2)
+        colors = np.asarray(color, dtype=np.float32)
+        if colors.ndim == 1:
+            colors = np.tile(_rgba(color), (len(vertices), 1))
+        elif colors.shape[1] == 3:
+            colors = np.column_stack((colors, np.ones(len(colors))))
+        item[0].append(vertices)
+        item[1].append(colors.astype(np.float32))
+
+    # Lines -------------------------------------------------------------------
+    def add_lines(self, segments, color, width=1.0, layer=0):
+        """
+        :param segments: (N, 2, 2)。始点と終点の組
+        :param color: RGB(A)。又は頂点毎の(N * 2, 3 or 4)
+        """
+        self._append(layer, LINES, width, segments, color)
+
+    def add_line_strip(self, coords, color, width=1.0, layer=0, loop=False):
+        """
+        :param coords: (N, 2)
+        """
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        if len(coords) < 2:
+            return
+        if loop:
+            ends = np.roll(coords, -1, axis=0)
+        else:
+            ends = coords[1:]
+            coords = coords[:-1]
+        segments = np.stack((coords, ends), axis=1)
+        self._append(layer, LINES, width, segments, color)
+
+    def add_line_loop(self, coords, color, width=1.0, layer=0):
+        self.add_line_strip(coords, color, width, layer, loop=True)
+
+    # Polygons ----------------------------------------------------------------
+    def add_triangles(self, triangles, color, layer=0):
+        """
+        :param triangles: (N, 3, 2)
+        :param color: RGB(A)。又は頂点毎の(N * 3, 3 or 4)
+        """
+        self._append(layer, TRIANGLES, 0.0, triangles, color)
+
+    def add_quads(self, quads, color, layer=0):
+        """
+        :param quads: (N, 4, 2)。反時計回り
+        """
+        quads = np.asarray(quads, dtype=np.float32).reshape(-1, 4, 2)
+        triangles = quads[:, (0, 1, 2, 0, 2, 3)]
+        colors = np.asarray(color, dtype=np.float32)
+        if colors.ndim == 2:
+            colors = colors.reshape(len(quads), 4, -1)[:, (0, 1, 2, 0, 2, 3)]
+            colors = colors.reshape(-1, colors.shape[-1])
+        self._append(layer, TRIANGLES, 0.0, triangles, colors)
+
+    def add_circle(self, x, y, radius, subdivide, color, poly=False,
+                   width=1.0, layer=0):
+        angles = np.arange(subdivide) * (math.pi * 2 / subdivide)
+        coords = np.column_stack((x + radius * np.cos(angles),
+                                  y + radius * np.sin(angles)))
+        if poly:
+            center = np.tile((x, y), (subdivide, 1))
+            triangles = np.stack(
+                (center, coords, np.roll(coords, -1, axis=0)), axis=1)
+            self.add_triangles(triangles, color, layer)
+        else:
+            self.add_line_loop(coords, color, width, layer)
+
+    # Text --------------------------------------------------------------------
+    def add_text(self, x, y, text, font_id, color, angle=0.0, layer=0):
+        self._texts.setdefault(layer, []).append(
+            TextCall(x, y, text, font_id, _rgba(color), angle))
+
+    # Flush -------------------------------------------------------------------
+    def calls(self):
+        """layerの昇順にDrawCallとTextCallを返すジェネレータ"""
+        layers = sorted({key[0] for key in self._groups} | set(self._texts))
+        for layer in layers:
+            for key, (vertices, colors) in self._groups.items():
+                if key[0] == layer:
+                    yield DrawCall(key[1], key[2], np.concatenate(vertices),
+                                   np.concatenate(colors))
+            for text in self._texts.get(layer, ()):
+                yield text
+
+    def flush(self, backend=None):
+        """溜めたプリミティブを描画して空にする"""
+        if backend is None:
+            backend = self.backend
+        for call in self.calls():
+            if isinstance(call, DrawCall):
+                backend.draw(call)
+            else:
+                backend.draw_text(call)
+        self.clear()
+
+    def clear(self):
+        self._groups.clear()
+        self._texts.clear()
+
+
+class RecordingBackend:
+    """描画せずに呼び出しを記録する"""
+
+    def __init__(self):
+        self.calls = []
+
+    def draw(self, call):
+        self.calls.append(call)
+
+    def draw_text(self, call):
+        self.calls.append(call)
+
+    @property
+    def draw_calls(self):
+        return [c for c in self.calls if isinstance(c, DrawCall)]
+
+    @property
+    def text_calls(self):
+        return [c for c in self.calls if isinstance(c, TextCall)]
+
+    def clear(self):
+        self.calls.clear()
+
+
+def test():
+    backend = RecordingBackend()
+    batch = DrawBatch(backend)
+    batch.add_lines([((0, 0), (1, 0)), ((0, 1), (1, 1))], (1, 0, 0))
+    batch.add_lines([((0, 2), (1, 2))], (0, 1, 0, 0.5))
+    batch.add_lines([((0, 3), (1, 3))], (0, 0, 1), width=3.0)
+    batch.add_triangles([((0, 0), (1, 0), (0, 1))], (1, 1, 1), layer=-1)
+    batch.add_quads([((0, 0), (1, 0), (1, 1), (0, 1))],
+                    [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 1)])
+    batch.add_circle(0, 0, 1, 8, (1, 1, 1))
+    batch.add_text(5, 5, 'abc', 0, (1, 1, 1))
+    assert len(batch) == 5
+    batch.flush()
+    assert len(batch) == 0
+
+    calls = backend.calls
+    # layer -1 の三角形が最初
+    assert calls[0].mode == TRIANGLES and len(calls[0].vertices) == 3
+    lines = calls[1]
+    assert lines.mode == LINES and lines.width == 1.0
+    # 2 + 1 + 8本の線分
+    assert len(lines.vertices) == 22
+    assert np.allclose(lines.colors[:4], (1, 0, 0, 1))
+    assert np.allclose(lines.colors[4:6], (0, 1, 0, 0.5))
+    assert calls[2].width == 3.0
+    quads = calls[3]
+    assert quads.mode == TRIANGLES and len(quads.vertices) == 6
+    assert np.allclose(quads.colors[3], (1, 0, 0, 1))
+    assert np.allclose(quads.colors[5], (1, 1, 1, 1))
+    assert isinstance(calls[4], TextCall) and calls[4].text == 'abc'
+
+    # 円の頂点
+    circle = lines.vertices[6:]
+    assert np.allclose(np.hypot(circle[:, 0], circle[:, 1]), 1.0)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,211 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+modal()に届くイベントの頻度を抑える。
+
+governor = EventGovernor(frame_budget=1 / 60)
+if governor.merge(window_ptr, event.type, key=region_id):
+    return {'PASS_THROUGH'}  # 前回の処理から一フレーム経っていない
+...
+governor.tag_redraw(region, state)  # stateが前回と同じならtag_redraw()しない
+...
+if governor.allow_restart(window_ptr):
+    restart()
+
+回数はstats()で確認できる。
+bpyに依存しない。
+"""
+
+
+import time
+
+
+__all__ = ('EventGovernor',)
+
+
+class EventGovernor:
+    MOUSEMOVE_TYPES = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE'}
+
+    def __init__(self, frame_budget=1 / 60, restart_interval=0.1,
+                 clock=time.perf_counter):
+        """
+        :param frame_budget: この秒数以内のマウス移動はまとめる
+        :param restart_interval: オペレータの再起動の最小間隔(秒)
+        :param clock: 秒を返す関数
+        """
+        self.frame_budget = frame_budget
+        self.restart_interval = restart_interval
+        self.clock = clock
+        self.last_move = {}  # {Window.as_pointer(): time, ...}
+        self.last_key = {}  # {Window.as_pointer(): key, ...}
+        self.last_restart = {}  # {Window.as_pointer(): time, ...}
+        self.region_states = {}  # {Region.as_pointer(): state, ...}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.events = 0
+        self.merged = 0
+        self.redraws = 0
+        self.redraws_skipped = 0
+        self.restarts = 0
+        self.restarts_debounced = 0
+
+    def stats(self):
+        return {'events': self.events,
+                'merged': self.merged,
+                'redraws': self.redraws,
+                'redraws_skipped': self.redraws_skipped,
+                'restarts': self.restarts,
+                'restarts_debounced': self.restarts_debounced}
+
+    def merge(self, window, event_type, mergeable=True, key=None):
+        """マウス移動を前回の処理と同じフレームにまとめるならTrueを返す。
+        マウス移動以外のイベントは常にFalse。
+        :param mergeable: Falseなら処理した物として扱う。
+            ドラッグ中等、全ての移動を処理したい場合に使う
+        :param key: マウス下のregion等。前回処理した時と異なればまとめない。
+            まとめた移動は後で処理されないので、regionを跨いで止まった場合に
+            新しいregionが更新されなくなるのを防ぐ
+        """
+        self.events += 1
+        if event_type not in self.MOUSEMOVE_TYPES:
+            return False
+        now = self.clock()
+        last = self.last_move.get(window)
+        if (mergeable and last is not None and
+                now - last < self.frame_budget and
+                self.last_key.get(window) == key):
+            self.merged += 1
+            return True
+        self.last_move[window] = now
+        self.last_key[window] = key
+        return False
+
+    def tag_redraw(self, region, state=None, force=False):
+        """stateが前回と異なる場合のみregion.tag_redraw()を呼ぶ。
+        :param state: 描画内容を表すハッシュ可能な値
+        :return: tag_redraw()を呼んだか
+        :rtype: bool
+        """
+        key = region.as_pointer()
+        if not force and key in self.region_states and \
+                self.region_states[key] == state:
+            self.redraws_skipped += 1
+            return False
+        self.region_states[key] = state
+        region.tag_redraw()
+        self.redraws += 1
+        return True
+
+    def invalidate(self, region=None):
+        """次回のtag_redraw()を必ず通す"""
+        if region is None:
+            self.region_states.clear()
+        else:
+            self.region_states.pop(region.as_pointer(), None)
+
+    def allow_restart(self, window):
+        """前回の再起動からrestart_interval秒経っていればTrue"""
+        now = self.clock()
+        last = self.last_restart.get(window)
+        if last is not None and now - last < self.restart_interval:
+            self.restarts_debounced += 1
+            return False
+        self.last_restart[window] = now
+        self.restarts += 1
+        return True
+
+    def forget_window(self, window):
+        self.last_move.pop(window, None)
+        self.last_key.pop(window, None)
+        self.last_restart.pop(window, None)
+
+    def clear(self):
+        self.last_move.clear()
+        self.last_key.clear()
+        self.last_restart.clear()
+        self.region_states.clear()
+
+
+def test():
+    class Clock:
+        t = 0.0
+
+        def __call__(self):
+            return self.t
+
+    class Region:
+        def __init__(self, ptr):
+            self.ptr = ptr
+            self.count = 0
+
+        def as_pointer(self):
+            return self.ptr
+
+        def tag_redraw(self):
+            self.count += 1
+
+    clock = Clock()
+    gov = EventGovernor(frame_budget=8 / 1024, restart_interval=0.1,
+                        clock=clock)
+
+    # 1024Hzのマウスは128Hzにまとめられる
+    processed = 0
+    for i in range(1024):
+        clock.t = i / 1024
+        if not gov.merge(1, 'MOUSEMOVE'):
+            processed += 1
+    assert processed == 128 and gov.merged == 896
+    assert not gov.merge(1, 'LEFTMOUSE')
+    assert not gov.merge(2, 'MOUSEMOVE')  # windowは別扱い
+    assert not gov.merge(2, 'MOUSEMOVE', mergeable=False)
+
+    # 一フレーム以内でもregionが変われば処理する
+    clock.t = 5.0
+    assert not gov.merge(3, 'MOUSEMOVE', key=1)
+    clock.t = 5.001
+    assert gov.merge(3, 'MOUSEMOVE', key=1)
+    clock.t = 5.002
+    assert not gov.merge(3, 'MOUSEMOVE', key=2)
+    clock.t = 5.003
+    assert gov.merge(3, 'MOUSEMOVE', key=2)
+
+    region = Region(10)
+    assert gov.tag_redraw(region, (0, 0))
+    assert not gov.tag_redraw(region, (0, 0))
+    assert gov.tag_redraw(region, (1, 0))
+    assert gov.tag_redraw(region, (1, 0), force=True)
+    gov.invalidate(region)
+    assert gov.tag_redraw(region, (1, 0))
+    assert region.count == 4 and gov.redraws_skipped == 1
+
+    clock.t = 10.0
+    assert gov.allow_restart(1)
+    clock.t = 10.05
+    assert not gov.allow_restart(1)
+    clock.t = 10.2
+    assert gov.allow_restart(1)
+    stats = gov.stats()
+    assert stats['restarts'] == 2 and stats['restarts_debounced'] == 1
+    assert stats['events'] == 1031
+
+
+if __name__ == '__main__':
+    test()
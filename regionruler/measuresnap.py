@@ -0,0 +1,415 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+Measure用の吸着点。
+
+頂点、辺の中点、オブジェクトの原点をワールド座標で保持し、
+Region座標に投影した点を一様格子に登録して最近点を求める。
+
+snap = MeasureSnap()
+snap.sync(context.scene, context.visible_objects)  # 変更された物のみ読み直す
+target = snap.nearest(pctx, mco, 12)  # pctx: vaview3d.ProjectionContext
+if target:
+    vec = target.location
+
+オブジェクト毎の局所座標はメッシュの頂点数等が変わった時のみ読み直し、
+matrix_worldが変わっただけなら変換のみやり直す。編集モードのメッシュは
+update_from_editmode()が重いので、sync(reload_editmode=True)の時のみ読み直す。
+モディファイアは考慮しない。
+bpyはMeasureSnap.sync()でのみ使う。
+"""
+
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+
+__all__ = ('VERTEX', 'EDGE', 'ORIGIN', 'mesh_targets', 'ScreenGrid',
+           'SnapTargets', 'SnapTarget', 'MeasureSnap')
+
+
+VERTEX = 0
+EDGE = 1
+ORIGIN = 2
+
+
+SnapTarget = namedtuple('SnapTarget',
+                        ('location', 'region_co', 'kind', 'name', 'distance'))
+
+
+def mesh_targets(verts, edges=None):
+    """頂点、辺の中点、原点を連結する。
+    :param verts: (N, 3)
+    :param edges: (M, 2)。頂点番号
+    :return: 座標(N + M + 1, 3)と種類(N + M + 1,)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+    if edges is None or not len(edges):
+        mids = np.zeros((0, 3))
+    else:
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        mids = (verts[edges[:, 0]] + verts[edges[:, 1]]) * 0.5
+    coords = np.concatenate((verts, mids, np.zeros((1, 3))))
+    kinds = np.concatenate((np.full(len(verts), VERTEX, dtype=np.int8),
+                            np.full(len(mids), EDGE, dtype=np.int8),
+                            np.array([ORIGIN], dtype=np.int8)))
+    return coords, kinds
+
+
+class ScreenGrid:
+    """二次元の点を一様格子に登録し、半径内の最近点を求める"""
+
+    OFFSET = 1 << 30
+
+    def __init__(self, coords, cell_size):
+        """
+        :param coords: (N, 2)
+        :param cell_size: 格子の大きさ。問い合わせの半径程度にする
+        """
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        keys = self._keys(np.floor(self.coords / self.cell_size))
+        self.order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.coords)
+
+    @classmethod
+    def _keys(cls, cells):
+        cells = cells.astype(np.int64) + cls.OFFSET
+        return (cells[..., 0] << 32) | cells[..., 1]
+
+    def candidates(self, co, radius):
+        """co周辺の格子に含まれる点の番号"""
+        lo = np.floor((np.asarray(co) - radius) / self.cell_size)
+        hi = np.floor((np.asarray(co) + radius) / self.cell_size)
+        xs = np.arange(lo[0], hi[0] + 1)
+        ys = np.arange(lo[1], hi[1] + 1)
+        cells = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1)
+        keys = self._keys(cells.reshape(-1, 2))
+        starts = np.searchsorted(self.keys, keys, 'left')
+        ends = np.searchsorted(self.keys, keys, 'right')
+        if not len(keys) or not np.any(ends > starts):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self.order[s:e]
+                               for s, e in zip(starts, ends) if e > s])
+
+    def nearest(self, co, radius):
+        """
+        :return: (点の番号, 距離)。見つからなければ(None, inf)
+        :rtype: (int | None, float)
+        """
+        if not len(self):
+            return None, float('inf')
+        indices = self.candidates(co, radius)
+        if not len(indices):
+            return None, float('inf')
+        dists = np.linalg.norm(self.coords[indices] - co, axis=1)
+        i = int(np.argmin(dists))
+        if dists[i] > radius:
+            return None, float('inf')
+        return int(indices[i]), float(dists[i])
+
+
+class _Entry:
+    __slots__ = ('data_key', 'matrix', 'local', 'kinds', 'world')
+
+    def __init__(self, data_key, local, kinds):
+        self.data_key = data_key
+        self.matrix = None
+        self.local = local
+        self.kinds = kinds
+        self.world = None
+
+
+class SnapTargets:
+    """オブジェクト名をキーとして吸着点を保持する。
+    変更が有る度にgenerationを増やす。
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.generation = 0
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def update(self, name, data_key, matrix, read_func):
+        """
+        :param data_key: これが変わればread_funcで局所座標を読み直す。
+            Noneなら常に読み直す
+        :param matrix: (4, 4)。ワールド行列
+        :param read_func: 引数無しで(座標(N, 3), 種類(N,))を返す関数
+        :return: 更新したか
+        :rtype: bool
+        """
+        entry = self.entries.get(name)
+        changed = False
+        if entry is None or data_key is None or entry.data_key != data_key:
+            local, kinds = read_func()
+            entry = self.entries[name] = _Entry(data_key, local, kinds)
+            changed = True
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if (changed or entry.matrix is None or
+                not np.array_equal(entry.matrix, matrix)):
+            entry.matrix = matrix
+            entry.world = (np.dot(entry.local, matrix[:3, :3].T) +
+                           matrix[:3, 3])
+            changed = True
+        if changed:
+            self._modified()
+        return changed
+
+    def retain(self, names):
+        """names以外を削除する"""
+        names = set(names)
+        removed = [name for name in self.entries if name not in names]
+        for name in removed:
+            del self.entries[name]
+        if removed:
+            self._modified()
+        return removed
+
+    def clear(self):
+        if self.entries:
+            self.entries.clear()
+            self._modified()
+
+    def _modified(self):
+        self.generation += 1
+        self._arrays = None
+
+    def arrays(self):
+        """全ての吸着点を連結して返す。
+        :return: (座標(N, 3), 種類(N,), オブジェクト番号(N,), 名前のリスト)
+        """
+        if self._arrays is None:
+            names = list(self.entries)
+            entries = list(self.entries.values())
+            if entries:
+                world = np.concatenate([e.world for e in entries])
+                kinds = np.concatenate([e.kinds for e in entries])
+                owners = np.repeat(np.arange(len(entries)),
+                                   [len(e.world) for e in entries])
+            else:
+                world = np.zeros((0, 3))
+                kinds = np.zeros(0, dtype=np.int8)
+                owners = np.zeros(0, dtype=np.int64)
+            self._arrays = (world, kinds, owners, names)
+        return self._arrays
+
+
+class MeasureSnap:
+    """SnapTargetsとRegion座標のScreenGridを管理する"""
+
+    def __init__(self):
+        self.targets = SnapTargets()
+        self.active = False
+        self._grid = None
+        self._grid_key = None
+        self._indices = None
+        self._edit_generation = 0
+
+    def start(self, scene, objects):
+        self.active = True
+        self.sync(scene, objects)
+
+    def stop(self):
+        self.active = False
+        self.targets.clear()
+        self._grid = self._grid_key = None
+
+    def sync(self, scene, objects, reload_editmode=False):
+        """objectsの内、変更された物のみ吸着点を読み直す
+        :param reload_editmode: 編集モードのメッシュを読み直す。
+            偽なら未読込の物のみ読む
+        """
+        if reload_editmode:
+            self._edit_generation += 1
+        names = []
+        for ob in objects:
+            names.append(ob.name)
+            if ob.type == 'MESH':
+                me = ob.data
+                if ob.mode == 'EDIT':
+                    data_key = ('EDIT', me.as_pointer(),
+                                self._edit_generation)
+                    read_func = self._mesh_reader(me, ob)
+                else:
+                    data_key = (me.as_pointer(), len(me.vertices),
+                                len(me.edges))
+                    read_func = self._mesh_reader(me)
+            else:
+                data_key = ob.type
+                read_func = self._origin_reader
+            self.targets.update(ob.name, data_key, ob.matrix_world,
+                                read_func)
+        self.targets.retain(names)
+
+    @staticmethod
+    def _mesh_reader(me, edit_object=None):
+        def read():
+            if edit_object:
+                edit_object.update_from_editmode()
+            verts = np.empty(len(me.vertices) * 3, dtype=np.float32)
+            me.vertices.foreach_get('co', verts)
+            edges = np.empty(len(me.edges) * 2, dtype=np.int32)
+            me.edges.foreach_get('vertices', edges)
+            return mesh_targets(verts, edges)
+        return read
+
+    @staticmethod
+    def _origin_reader():
+        return mesh_targets(np.zeros((0, 3)))
+
+    def grid(self, pctx, cell_size):
+        """投影済みのScreenGridを返す。視点か吸着点が変われば作り直す。
+        :type pctx: vaview3d.ProjectionContext
+        """
+        key = (pctx, self.targets.generation, cell_size)
+        if self._grid_key != key:
+            world = self.targets.arrays()[0]
+            coords, mask = pctx.project_2d(world, clip=True)
+            self._indices = np.flatnonzero(mask)
+            self._grid = ScreenGrid(coords[mask], cell_size)
+            self._grid_key = key
+        return self._grid
+
+    def nearest(self, pctx, mco, distance):
+        """
+        :param mco: Region座標
+        :param distance: 吸着する距離(pixel)
+        :rtype: SnapTarget | None
+        """
+        grid = self.grid(pctx, distance)
+        i, dist = grid.nearest(np.asarray(mco[:2], dtype=np.float64),
+                               distance)
+        if i is None:
+            return None
+        index = self._indices[i]
+        world, kinds, owners, names = self.targets.arrays()
+        return SnapTarget(world[index], grid.coords[i], int(kinds[index]),
+                          names[owners[index]], dist)
+
+
+def test():
+    # mesh_targets
+    coords, kinds = mesh_targets([(0, 0, 0), (2, 0, 0)], [(0, 1)])
+    assert np.allclose(coords, [(0, 0, 0), (2, 0, 0), (1, 0, 0), (0, 0, 0)])
+    assert kinds.tolist() == [VERTEX, VERTEX, EDGE, ORIGIN]
+
+    # ScreenGrid: 総当りと比較
+    rng = np.random.RandomState(0)
+    points = rng.uniform(-500, 500, (5000, 2))
+    grid = ScreenGrid(points, 10.0)
+    for co in rng.uniform(-520, 520, (200, 2)):
+        i, dist = grid.nearest(co, 10.0)
+        dists = np.linalg.norm(points - co, axis=1)
+        j = int(np.argmin(dists))
+        if dists[j] <= 10.0:
+            assert i is not None and np.isclose(dist, dists[j])
+        else:
+            assert i is None
+    assert ScreenGrid(np.zeros((0, 2)), 10.0).nearest((0, 0), 10.0)[0] is None
+
+    # SnapTargets: 変更された物のみ読み直す
+    reads = []
+
+    def reader(verts):
+        def read():
+            reads.append(1)
+            return mesh_targets(verts)
+        return read
+
+    targets = SnapTargets()
+    eye = np.identity(4)
+    targets.update('a', 1, eye, reader([(1, 0, 0)]))
+    targets.update('b', 1, eye, reader([(0, 1, 0)]))
+    gen = targets.generation
+    assert not targets.update('a', 1, eye, reader([(1, 0, 0)]))
+    assert targets.generation == gen and len(reads) == 2
+    moved = eye.copy()
+    moved[:3, 3] = (0, 0, 5)
+    assert targets.update('a', 1, moved, reader([(1, 0, 0)]))
+    assert len(reads) == 2
+    world, kinds, owners, names = targets.arrays()
+    assert np.allclose(world[0], (1, 0, 5)) and names[owners[0]] == 'a'
+    targets.update('a', 2, moved, reader([(3, 0, 0)]))
+    assert len(reads) == 3
+    assert targets.retain(['a']) == ['b']
+    assert len(targets.arrays()[0]) == 2
+
+    # MeasureSnap: 正射影で確認
+    class Projection:
+        def project_2d(self, array, clip=False):
+            coords = np.asarray(array)[:, :2] * 10 + 100
+            return coords, np.ones(len(coords), dtype=bool)
+
+    snap = MeasureSnap()
+    snap.targets.update('c', 1, eye,
+                        lambda: mesh_targets([(0, 0, 0), (2, 0, 0)], [(0, 1)]))
+    pctx = Projection()
+    target = snap.nearest(pctx, (109, 101), 5)
+    assert target.kind == EDGE and np.allclose(target.location, (1, 0, 0))
+    assert target.name == 'c'
+    assert snap.nearest(pctx, (150, 150), 5) is None
+
+    # 編集モードのメッシュはreload_editmodeが真の時のみ読み直す
+    class Collection(list):
+        def foreach_get(self, attr, array):
+            array[:] = np.ravel(self)
+
+    class Mesh:
+        vertices = Collection([(0, 0, 0), (2, 0, 0)])
+        edges = Collection([(0, 1)])
+
+        def as_pointer(self):
+            return 1
+
+    class Object:
+        name = 'd'
+        type = 'MESH'
+        mode = 'EDIT'
+        data = Mesh()
+        matrix_world = eye
+        updates = 0
+
+        def update_from_editmode(self):
+            self.updates += 1
+
+    ob = Object()
+    snap = MeasureSnap()
+    snap.start(None, [ob])
+    for i in range(3):
+        snap.sync(None, [ob])
+    assert ob.updates == 1
+    snap.sync(None, [ob], reload_editmode=True)
+    assert ob.updates == 2 and len(snap.targets.arrays()[0]) == 4
+
+
+if __name__ == '__main__':
+    test()
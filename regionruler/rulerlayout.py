@@ -0,0 +1,411 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+ルーラーの配置を計算する。描画はせず、目盛の線、三角形、数値の位置と
+背景の矩形、マスクの矩形を返す。
+
+ticks = rulerticks.ruler_ticks(...)
+layout = layout_ruler(ticks, labels, text_width, text_height, margin,
+                      scale_size)
+for x, y, text in layout.labels:
+    ...
+
+Regionの大きさ等は全て数値で受け取る。文字幅はtext_width(text)で求める。
+LayoutCacheでビューの状態毎に結果を保持できる。
+bpyに依存しない。
+"""
+
+
+from collections import OrderedDict
+import math
+
+import numpy as np
+
+
+__all__ = ('rotated_bbox', 'drawing_rectangle', 'upper_left_text_rect',
+           'mask_quad', 'label_collisions', 'RulerLayout', 'layout_ruler',
+           'LayoutCache')
+
+
+def rotated_bbox(box_width, box_height, angle):
+    """回転されたbounding boxの幅と高さを求める"""
+    c = abs(math.cos(angle))
+    s = abs(math.sin(angle))
+    return box_width * c + box_height * s, box_width * s + box_height * c
+
+
+def drawing_rectangle(width, height, region_x, area_x, area_width,
+                      side_regions=(), use_region_overlap=True,
+                      scrollbar_width=0, header_height=0):
+    """'WINDOW'の描画範囲。__init__.region_drawing_rectangle()参照。
+    :param side_regions: 表示されているTOOLSとUIの[(x, width), ...]。
+        TOOL_PROPSは含まない
+    :param scrollbar_width: 右のスクロールバーの幅。NODE_EDITOR用
+    :param header_height: 上のrender情報の高さ
+    :return: (xmin, ymin, xmax, ymax)。region座標
+    :rtype: (int, int, int, int)
+    """
+    xmax = width - 1 - scrollbar_width
+    ymin = 0
+    ymax = height - 1 - header_height
+    if not use_region_overlap:
+        return 0, ymin, xmax, ymax
+
+    left_width = right_width = 0
+    side_regions = sorted(side_regions)
+    if len(side_regions) == 2:
+        (x1, w1), (x2, w2) = side_regions
+        if x1 == area_x:
+            # 両方左
+            if x2 == x1 + w1:
+                left_width = w1 + w2
+            # 片方ずつ
+            else:
+                left_width = w1
+                right_width = w2
+        # 両方右
+        else:
+            right_width = w1 + w2
+    elif side_regions:
+        x1, w1 = side_regions[0]
+        if x1 == area_x:
+            left_width = w1
+        else:
+            right_width = w1
+
+    xmin = max(region_x, area_x + left_width) - region_x
+    xmax = min(region_x + width - 1,
+               area_x + area_width - right_width - 1) - region_x
+    return xmin, ymin, xmax, ymax
+
+
+def upper_left_text_rect(region_height, widget_unit, text_width,
+                         text_height):
+    """View3D左上の文字の範囲。
+    :return: [xmin, xmax, ymin, ymax]
+    :rtype: [int, int, int, int]
+    """
+    ymin = region_height - 1 - widget_unit
+    return [widget_unit, int(widget_unit + text_width),
+            ymin, ymin + text_height]
+
+
+def mask_quad(rect, margin=5):
+    """upper_left_text_rect()の矩形を広げて左下から反時計回りの四点を返す"""
+    xmin, xmax, ymin, ymax = rect
+    return ((xmin - margin, ymin - margin),
+            (xmax + margin, ymin - margin),
+            (xmax + margin, ymax + margin),
+            (xmin - margin, ymax + margin))
+
+
+def label_collisions(boxes, priorities):
+    """重なる矩形の内、優先度の低い方を除外する。
+    :param boxes: (N, 4)。[xmin, ymin, xmax, ymax]
+    :param priorities: (N,)。小さい方を優先する
+    :return: (N,)。残す物がTrue
+    :rtype: numpy.ndarray
+    """
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    keep = np.zeros(len(boxes), dtype=bool)
+    kept = []
+    for i in np.argsort(priorities, kind='mergesort'):
+        b = boxes[i]
+        if kept:
+            k = boxes[kept]
+            if np.any((k[:, 0] < b[2]) & (b[0] < k[:, 2]) &
+                      (k[:, 1] < b[3]) & (b[1] < k[:, 3])):
+                continue
+        keep[i] = True
+        kept.append(i)
+    return keep
+
+
+class RulerLayout:
+    """layout_ruler()の結果。座標は全てRegion座標。
+    start_rco, end_rco: 切り取り後の始点と終点
+    angle: start->endの角度
+    base_line: (2, 2)。描画しない場合はNone
+    lines, lines_bold: (N, 2, 2)。線幅1と3の目盛
+    triangles: (N, 3, 2)。5の位置と0の位置の三角形
+    labels: [(x, y, text), ...]。数値の描画位置
+    boxes: (N, 4)。labelsに対応する背景の[x, y, w, h]
+    box_angle: boxesの回転角
+    """
+
+    __slots__ = ('start_rco', 'end_rco', 'angle', 'base_line', 'lines',
+                 'lines_bold', 'triangles', 'labels', 'boxes', 'box_angle')
+
+
+def layout_ruler(ticks, labels, text_width, text_height, margin, scale_size,
+                 line_feed=False, rotate_text=False, number_upper_side=False,
+                 double_side_scale=False, base_line=True,
+                 draw_zero=('marker', 'number', 'scale'),
+                 intervals=None, avoid_overlap=False):
+    """__init__.draw_free_ruler()の配置部分。
+    :param ticks: rulerticks.RulerTicks
+    :param labels: 目盛毎の数値の文字列。空文字列なら描画しない
+    :param text_width: 文字列の幅を返す関数
+    :param text_height: 一行の高さ
+    :param scale_size: [main, even, odd]
+    :param intervals: rulerticks.label_intervals()の結果。
+        重なった数値を除外する際の優先度に使う
+    :param avoid_overlap: 重なった数値は優先度の低い方を除外する
+    :rtype: RulerLayout
+    """
+    th = text_height
+    start_rco = np.asarray(ticks.start_rco, dtype=float)[:2]
+    end_rco = np.asarray(ticks.end_rco, dtype=float)[:2]
+    hvec = end_rco - start_rco
+    length = np.linalg.norm(hvec)
+    if length > 0.0:
+        hvec = hvec / length
+    if number_upper_side:
+        vvec = np.array((-hvec[1], hvec[0]))
+    else:
+        vvec = np.array((hvec[1], -hvec[0]))
+    angle = math.atan2(hvec[1], hvec[0])
+
+    ssmain, _, ssodd = scale_size
+    ssodd = min(ssmain, ssodd)
+
+    counts = np.asarray(ticks.counts)
+    points = np.asarray(ticks.points, dtype=float).reshape(-1, 2)
+    sizes = np.asarray(ticks.sizes, dtype=float)
+    markers = np.asarray(ticks.markers, dtype=bool)
+    bold = np.asarray(ticks.widths) != 1
+
+    # 目盛
+    scale = np.ones(len(counts), dtype=bool)
+    if 'scale' not in draw_zero:
+        scale &= counts != 0
+    sizes = np.where(markers, np.maximum(0, sizes - 3), sizes)
+    offsets = vvec * sizes[:, None]
+    if double_side_scale:
+        segments = np.stack((points + offsets, points - offsets), axis=1)
+    else:
+        segments = np.stack((points, points + offsets), axis=1)
+
+    # 5-Triangles
+    tri_mask = scale & markers
+    tops = points[tri_mask] + vvec * max(0, ssodd - 3)
+    v2 = vvec * 3
+    v3 = hvec * 2
+    triangles = [np.stack((tops + v2 - v3, tops + v2 + v3, tops), axis=1)]
+
+    # 数値。複数行の場合は右揃え
+    if rotate_text:
+        vx, vy = hvec, -vvec
+    else:
+        vx, vy = np.array((1.0, 0.0)), np.array((0.0, 1.0))
+    label_items = []  # [(tick index, [(x, y, text), ...], [box, ...]), ...]
+    for i, (count, p, text) in enumerate(zip(counts.tolist(),
+                                             points.tolist(), labels)):
+        if line_feed:
+            text_lines = text.split(' ')
+        else:
+            text_lines = [text]
+        widths = [text_width(t) for t in text_lines]
+        box_width = max(widths) + margin * 2
+        box_height = len(widths) * th + (len(widths) + 1) * margin
+        if rotate_text:
+            h = box_height
+        else:
+            rbox_width, h = rotated_bbox(box_width, box_height, -angle)
+        box_center = np.asarray(p) + (ssmain + h / 2) * vvec
+        box_loc = box_center - box_width / 2 * vx - box_height / 2 * vy
+        if text:
+            items = []
+            boxes = []
+            for j in range(len(text_lines)):
+                txt = text_lines[-j - 1]
+                tw = widths[-j - 1]
+                fx = box_width - margin - tw
+                fy = margin + (th + margin) * j
+                v = box_loc + vx * fx + vy * fy
+                items.append((float(v[0]), float(v[1]), txt))
+                v = v - (vx + vy) * margin
+                boxes.append((float(v[0]), float(v[1]), tw + margin * 2,
+                              th + margin * 2))
+            label_items.append((i, items, boxes))
+
+        # Origin Triangles
+        if count == 0 and 'marker' in draw_zero:
+            w = box_width / 2 if rotate_text else rbox_width / 2
+            triangles.append(np.array((
+                (box_center - hvec * w - vvec * (th / 2),
+                 box_center - hvec * (w + 5),
+                 box_center - hvec * w + vvec * (th / 2)),
+                (box_center + hvec * w - vvec * (th / 2),
+                 box_center + hvec * w + vvec * (th / 2),
+                 box_center + hvec * (w + 5)))))
+
+    if avoid_overlap and len(label_items) > 1:
+        box_angle = angle if rotate_text else 0.0
+        bounds = []
+        priorities = []
+        for i, _items, boxes in label_items:
+            corners = np.concatenate([_box_corners(b, box_angle)
+                                      for b in boxes])
+            bounds.append(np.concatenate((corners.min(axis=0),
+                                          corners.max(axis=0))))
+            interval = intervals[i] if intervals is not None else 0
+            priorities.append((counts[i] != 0) * 100 - interval)
+        keep = label_collisions(bounds, priorities)
+        label_items = [item for item, k in zip(label_items, keep) if k]
+
+    layout = RulerLayout()
+    layout.start_rco = start_rco
+    layout.end_rco = end_rco
+    layout.angle = angle
+    layout.base_line = np.array((start_rco, end_rco)) if base_line else None
+    layout.lines = segments[scale & ~bold]
+    layout.lines_bold = segments[scale & bold]
+    layout.triangles = np.concatenate(triangles).reshape(-1, 3, 2)
+    layout.labels = [t for _i, items, _b in label_items for t in items]
+    boxes = [b for _i, _items, boxes in label_items for b in boxes]
+    layout.boxes = np.array(boxes, dtype=float).reshape(-1, 4)
+    layout.box_angle = angle if rotate_text else 0.0
+    return layout
+
+
+def _box_corners(box, angle):
+    """(x, y)を中心に回転した矩形の四隅"""
+    x, y, w, h = box
+    corners = np.array(((0, 0), (w, 0), (w, h), (0, h)), dtype=float)
+    if angle:
+        c, s = math.cos(angle), math.sin(angle)
+        corners = np.dot(corners, ((c, s), (-s, c)))
+    return corners + (x, y)
+
+
+class LayoutCache:
+    """ビューの状態をキーとしてRulerLayoutを保持する"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.layouts = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, func, *args, **kwargs):
+        """キャッシュに無ければfunc(*args, **kwargs)の結果を登録して返す"""
+        layout = self.layouts.get(key)
+        if layout is not None:
+            self.layouts.move_to_end(key)
+            self.hits += 1
+            return layout
+        self.misses += 1
+        layout = func(*args, **kwargs)
+        self.layouts[key] = layout
+        if len(self.layouts) > self.maxsize:
+            self.layouts.popitem(last=False)
+        return layout
+
+    def stats(self):
+        return {'layouts': len(self.layouts), 'hits': self.hits,
+                'misses': self.misses}
+
+    def clear(self):
+        self.layouts.clear()
+        self.hits = self.misses = 0
+
+
+def test():
+    # rotated_bbox
+    w, h = rotated_bbox(10, 4, math.pi / 2)
+    assert abs(w - 4) < 1e-9 and abs(h - 10) < 1e-9
+
+    # drawing_rectangle: TOOLS左, UI右
+    rect = drawing_rectangle(800, 600, 0, 0, 800, [(0, 100), (650, 150)])
+    assert rect == (100, 0, 649, 599)
+    rect = drawing_rectangle(800, 600, 0, 0, 800, [(0, 100), (100, 150)])
+    assert rect == (250, 0, 799, 599)
+    rect = drawing_rectangle(800, 600, 0, 0, 800, [(650, 150)],
+                             use_region_overlap=False, header_height=20)
+    assert rect == (0, 0, 799, 579)
+
+    assert upper_left_text_rect(600, 20, 50.5, 10) == [20, 70, 579, 589]
+    assert mask_quad([20, 70, 579, 589])[2] == (75, 594)
+
+    # 重なり
+    keep = label_collisions([(0, 0, 10, 10), (5, 5, 15, 15), (20, 0, 30, 5)],
+                            [1, 0, 2])
+    assert keep.tolist() == [False, True, True]
+
+    class Ticks:
+        start_rco = (0.0, 300.0)
+        end_rco = (400.0, 300.0)
+        counts = np.arange(21)
+        points = np.column_stack((counts * 20.0, np.full(21, 300.0)))
+        widths = np.where(counts % 10 == 0, 3, 1)
+        sizes = np.where(counts % 10 == 0, 6, 3)
+        markers = (counts % 5 == 0) & (counts % 10 != 0)
+
+        def __len__(self):
+            return len(self.counts)
+
+    ticks = Ticks()
+    intervals = np.where(ticks.counts % 10 == 0, 10,
+                         np.where(ticks.counts % 5 == 0, 5, 1))
+    labels = [str(c) for c in ticks.counts.tolist()]
+
+    def text_width(text):
+        return len(text) * 6
+
+    layout = layout_ruler(ticks, labels, text_width, 10, 2, (6, 3, 3),
+                          intervals=intervals, avoid_overlap=True)
+    assert len(layout.lines) + len(layout.lines_bold) == len(ticks)
+    assert len(layout.labels) == len(layout.boxes)
+    assert {t for _x, _y, t in layout.labels} <= set(labels)
+    # 0の位置に三角形が二つ
+    assert len(layout.triangles) >= 2
+    # 数値は目盛の下側
+    assert all(y < 300 for _x, y, _t in layout.labels)
+    # 重なりは無い
+    b = layout.boxes
+    for i in range(len(b)):
+        for j in range(i + 1, len(b)):
+            assert not (b[i, 0] < b[j, 0] + b[j, 2] and
+                        b[j, 0] < b[i, 0] + b[i, 2] and
+                        b[i, 1] < b[j, 1] + b[j, 3] and
+                        b[j, 1] < b[i, 1] + b[i, 3])
+
+    # 数値が全て重なる場合は0が優先される
+    def wide(text):
+        return 1000
+
+    layout = layout_ruler(ticks, labels, wide, 10, 2, (6, 3, 3),
+                          intervals=intervals, avoid_overlap=True)
+    assert [t for _x, _y, t in layout.labels] == ['0']
+    # 既定では除外しない
+    layout = layout_ruler(ticks, labels, wide, 10, 2, (6, 3, 3),
+                          intervals=intervals)
+    assert len(layout.labels) == len(labels)
+
+    cache = LayoutCache(maxsize=1)
+    a = cache.get('a', layout_ruler, ticks, labels, text_width, 10, 2,
+                  (6, 3, 3))
+    assert cache.get('a', None) is a
+    cache.get('b', layout_ruler, ticks, labels, text_width, 10, 2, (6, 3, 3))
+    assert 'a' not in cache.layouts and cache.stats()['hits'] == 1
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,439 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+"""
+ルーラーの目盛をnumpyでまとめて計算する。
+
+ticks = ruler_ticks(start, end, offset, negative, unit_system,
+                    magnification, region.width, region.height,
+                    persmat=rv3d.perspective_matrix)
+for count, p, size, width in zip(ticks.counts, ticks.points, ticks.sizes,
+                                 ticks.widths):
+    ...
+
+unit_systemにはbupg, dpbu, dpg, system属性が有ればよい。
+bpyに依存しない。
+"""
+
+
+import numpy as np
+
+
+__all__ = ('LINE_MAJOR', 'LINE_MINOR', 'LINE_SUB', 'RulerTicks',
+           'clip_ruler', 'scale_points', 'line_kinds', 'scale_sizes',
+           'five_markers', 'label_intervals', 'ruler_ticks')
+
+
+LINE_MAJOR = 0  # count % magnification == 0
+LINE_MINOR = 1  # 偶数
+LINE_SUB = 2  # 奇数
+
+PROJECT_MIN_NUMBER = 1E-5
+
+
+def _project(persmat, width, height, points):
+    """World Coords -> Region Coords (2D)。wも返す"""
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    arr = np.dot(points, persmat[:3, :3].T) + persmat[:3, 3]
+    w = np.dot(points, persmat[3, :3]) + persmat[3, 3]
+    flags = np.abs(w) > PROJECT_MIN_NUMBER
+    arr[flags] /= w[flags, None]
+    xy = np.empty((len(points), 2))
+    xy[:, 0] = (arr[:, 0] + 1.0) * width * 0.5
+    xy[:, 1] = (arr[:, 1] + 1.0) * height * 0.5
+    return xy, w
+
+
+def _clip_box(p1, p2, box_min, box_max):
+    """Liang–Barsky。線分p1-p2の内、矩形内にある範囲を(t0, t1)で返す。
+    :rtype: (float, float) | None
+    """
+    d = p2 - p1
+    t0, t1 = 0.0, 1.0
+    for i in range(2):
+        if d[i] == 0.0:
+            if p1[i] < box_min[i] or p1[i] > box_max[i]:
+                return None
+            continue
+        ta = (box_min[i] - p1[i]) / d[i]
+        tb = (box_max[i] - p1[i]) / d[i]
+        if ta > tb:
+            ta, tb = tb, ta
+        t0 = max(t0, ta)
+        t1 = min(t1, tb)
+        if t0 > t1:
+            return None
+    return t0, t1
+
+
+def clip_ruler(start, end, offset, negative, width, height, bupd,
+               persmat=None):
+    """regionの外側(1pixelの余白を含む)を切り取ってstart, end, offsetを
+    修正する。
+    :param start: Region座標なら(2,)、World座標なら(3,)
+    :param bupd: blenderUnit / dot。Region座標の場合のみ使う
+    :param persmat: World座標の場合のperspective_matrix
+    :return: (start, end, offset)。描画不要ならNone
+    :rtype: (numpy.ndarray, numpy.ndarray, float) | None
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    sign = -1 if negative else 1
+    box_min = np.array((-1.0, -1.0))
+    box_max = np.array((width + 1.0, height + 1.0))
+
+    if len(start) == 3:
+        persmat = np.asarray(persmat, dtype=float)
+        (p1, p2), (w1, w2) = _project(persmat, width, height, (start, end))
+        # カメラの後方を除外
+        s0, s1 = 0.0, 1.0
+        if w1 <= PROJECT_MIN_NUMBER and w2 <= PROJECT_MIN_NUMBER:
+            return None
+        if w1 <= PROJECT_MIN_NUMBER or w2 <= PROJECT_MIN_NUMBER:
+            s = (PROJECT_MIN_NUMBER - w1) / (w2 - w1)
+            if w1 <= PROJECT_MIN_NUMBER:
+                s0 = s
+            else:
+                s1 = s
+            line = end - start
+            start, end = start + line * s0, start + line * s1
+            (p1, p2), (w1, w2) = _project(persmat, width, height,
+                                          (start, end))
+            offset += sign * np.linalg.norm(line) * s0
+        result = _clip_box(p1, p2, box_min, box_max)
+        if result is None:
+            return None
+        f0, f1 = result
+        if f0 == f1:
+            return None
+        # 透視投影の補正をしてWorld座標での位置を求める
+        s0 = f0 * w1 / ((1.0 - f0) * w2 + f0 * w1)
+        s1 = f1 * w1 / ((1.0 - f1) * w2 + f1 * w1)
+        line = end - start
+        offset += sign * np.linalg.norm(line) * s0
+        return start + line * s0, start + line * s1, offset
+
+    else:
+        result = _clip_box(start, end, box_min, box_max)
+        if result is None:
+            return None
+        f0, f1 = result
+        if f0 == f1:
+            return None
+        line = end - start
+        length = np.linalg.norm(line)
+        offset += sign * f0 * length * bupd
+        return start + line * f0, start + line * f1, offset
+
+
+def scale_points(start, end, offset, negative, bupg, dpbu, dpg):
+    """目盛のカウントと座標。
+    :param start: Region座標なら(2,)、World座標なら(3,)
+    :return: (counts, points)。pointsはstartと同じ次元
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    dim = len(start)
+    empty = np.zeros(0, dtype=np.int64), np.zeros((0, dim))
+    sign = -1 if negative else 1
+
+    length = np.linalg.norm(end - start)
+    if length == 0.0:
+        line = np.zeros(dim)
+    else:
+        line = (end - start) / length
+
+    count, val = divmod(offset, bupg)
+    count = int(count)
+    if val == 0.0:
+        scale_start = start
+    else:
+        if sign == 1:
+            count += 1
+        count_offset = count * bupg
+        if dim == 3:
+            v = sign * (count_offset - offset) * line
+        else:
+            v = sign * (count_offset - offset) * dpbu * line
+        scale_start = start + v
+
+    if np.linalg.norm(scale_start - start) > length:
+        return empty
+
+    remain = np.linalg.norm(end - scale_start)
+    if dim == 3:
+        step = bupg
+    else:
+        step = dpg
+    num = int(remain / step) + 1
+    k = np.arange(num)
+    counts = count + sign * k
+    points = scale_start + (k * step)[:, None] * line
+    return counts, points
+
+
+def line_kinds(counts, magnification):
+    """LINE_MAJOR, LINE_MINOR, LINE_SUB の配列"""
+    counts = np.asarray(counts, dtype=np.int64)
+    kinds = np.where(counts % 2 == 0, LINE_MINOR, LINE_SUB)
+    if magnification:
+        kinds[counts % magnification == 0] = LINE_MAJOR
+    return kinds
+
+
+def scale_sizes(kinds, scale_size):
+    """目盛の長さと線幅。
+    :param scale_size: (main, even, odd)
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    ssmain, sseven, ssodd = scale_size
+    sizes = np.array((ssmain, min(ssmain, sseven), min(ssmain, ssodd)),
+                     dtype=float)
+    widths = np.array((3, 1, 1))
+    return sizes[kinds], widths[kinds]
+
+
+def five_markers(counts, system, scale_size):
+    """5の位置に三角形を描く目盛"""
+    counts = np.asarray(counts, dtype=np.int64)
+    if system == 'IMPERIAL' or scale_size[0] < 3:
+        return np.zeros(len(counts), dtype=bool)
+    return (counts % 5 == 0) & (counts % 10 != 0)
+
+
+def label_intervals(counts, magnification, system, dpg, number_min_px):
+    """目盛の数値の間隔。0なら数値を描かない。
+    magnificationの倍数は10、5の倍数(NONE, METRIC)はdpgがnumber_min_px[0]
+    以上なら5、それ以外はdpgがnumber_min_px[1]以上なら1
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    result = np.zeros(len(counts), dtype=np.int64)
+    if magnification:
+        major = counts % magnification == 0
+    else:
+        major = np.zeros(len(counts), dtype=bool)
+    result[major] = 10
+    rest = ~major
+    if system in ('NONE', 'METRIC'):
+        five = rest & (counts % 5 == 0)
+        if dpg >= number_min_px[0]:
+            result[five] = 5
+        rest &= ~five
+    if dpg >= number_min_px[1]:
+        result[rest] = 1
+    return result
+
+
+class RulerTicks:
+    """ruler_ticks()の結果。
+    start, end, offset: 切り取り後の値
+    start_rco, end_rco: start, endのRegion座標
+    counts: (N,)
+    points: (N, 2)。Region座標
+    kinds: (N,)。LINE_MAJOR, LINE_MINOR, LINE_SUB
+    sizes, widths: (N,)。目盛の長さと線幅
+    markers: (N,)。5の位置の三角形
+    mask: (N,)。regionの内側にある目盛
+    """
+
+    __slots__ = ('start', 'end', 'offset', 'start_rco', 'end_rco',
+                 'counts', 'points', 'kinds', 'sizes', 'widths', 'markers',
+                 'mask')
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def ruler_ticks(start, end, offset, negative, unit_system, magnification,
+                width, height, persmat=None, scale_size=(8, 4, 4)):
+    """clip_ruler()とscale_points()以降をまとめて行う。
+    :param unit_system: bupg, dpbu, dpg, system属性を持つ物
+    :param persmat: World座標の場合のperspective_matrix
+    :rtype: RulerTicks | None
+    """
+    if persmat is not None:
+        persmat = np.asarray(persmat, dtype=float)
+    result = clip_ruler(start, end, offset, negative, width, height,
+                        1.0 / unit_system.dpbu, persmat)
+    if result is None:
+        return None
+    start, end, offset = result
+
+    ticks = RulerTicks()
+    ticks.start, ticks.end, ticks.offset = start, end, offset
+    counts, points = scale_points(start, end, offset, negative,
+                                  unit_system.bupg, unit_system.dpbu,
+                                  unit_system.dpg)
+    if len(start) == 3:
+        points, _ = _project(persmat, width, height, points)
+        rco, _ = _project(persmat, width, height, (start, end))
+        ticks.start_rco, ticks.end_rco = rco
+    else:
+        ticks.start_rco, ticks.end_rco = start, end
+    ticks.counts = counts
+    ticks.points = points
+    ticks.kinds = line_kinds(counts, magnification)
+    ticks.sizes, ticks.widths = scale_sizes(ticks.kinds, scale_size)
+    ticks.markers = five_markers(counts, unit_system.system, scale_size)
+    ticks.mask = ((points[:, 0] >= -1.0) & (points[:, 0] <= width + 1.0) &
+                  (points[:, 1] >= -1.0) & (points[:, 1] <= height + 1.0))
+    return ticks
+
+
+#==============================================================================
+# Test
+#==============================================================================
+def _generate_scale_points_reference(start, end, offset, negative, bupg,
+                                     dpbu, dpg):
+    """ループによる従来の実装"""
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    sign = -1 if negative else 1
+    count, val = divmod(offset, bupg)
+    count = int(count)
+    line = (end - start) / np.linalg.norm(end - start)
+    if val == 0.0:
+        scale_start = start.copy()
+    else:
+        if sign == 1:
+            count += 1
+        count_offset = count * bupg
+        if len(start) == 3:
+            v = sign * (count_offset - offset) * line
+        else:
+            v = sign * (count_offset - offset) * dpbu * line
+        scale_start = start + v
+    if np.linalg.norm(scale_start - start) > np.linalg.norm(end - start):
+        return []
+    if len(start) == 3:
+        offset_vec = line * bupg
+        num = int(np.linalg.norm(end - scale_start) / bupg) + 1
+    else:
+        offset_vec = line * dpg
+        num = int(np.linalg.norm(end - scale_start) * (1.0 / dpg)) + 1
+    result = []
+    for _ in range(num):
+        result.append((count, scale_start.copy()))
+        count += sign
+        scale_start = scale_start + offset_vec
+    return result
+
+
+def _scale_label_interval_reference(cnt, magnification, system, dpg,
+                                    number_min_px):
+    interval = 0
+    if magnification and cnt % magnification == 0:
+        interval = 10
+    elif cnt % 5 == 0 and system in ('NONE', 'METRIC'):
+        if dpg >= number_min_px[0]:
+            interval = 5
+    elif dpg >= number_min_px[1]:
+        interval = 1
+    return interval
+
+
+def test():
+    class Unit:
+        bupg = 0.1
+        dpbu = 120.0
+        dpg = 12.0
+        system = 'METRIC'
+
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        start = rng.uniform(0, 500, 2)
+        end = rng.uniform(0, 500, 2)
+        offset = float(rng.uniform(-3, 3))
+        for negative in (False, True):
+            ref = _generate_scale_points_reference(
+                start, end, offset, negative, Unit.bupg, Unit.dpbu, Unit.dpg)
+            counts, points = scale_points(start, end, offset, negative,
+                                          Unit.bupg, Unit.dpbu, Unit.dpg)
+            assert len(ref) == len(counts)
+            if ref:
+                assert [c for c, _ in ref] == counts.tolist()
+                assert np.allclose([p for _, p in ref], points)
+
+    # World座標
+    start = np.array((0.0, 0.0, 0.0))
+    end = np.array((1.0, 0.5, 0.25))
+    ref = _generate_scale_points_reference(start, end, 0.05, False, 0.1,
+                                           1.0, 1.0)
+    counts, points = scale_points(start, end, 0.05, False, 0.1, 1.0, 1.0)
+    assert [c for c, _ in ref] == counts.tolist()
+    assert np.allclose([p for _, p in ref], points)
+
+    # 線の種類
+    counts = np.arange(-12, 13)
+    kinds = line_kinds(counts, 10)
+    assert kinds[counts == 0][0] == LINE_MAJOR
+    assert kinds[counts == 4][0] == LINE_MINOR
+    assert kinds[counts == 3][0] == LINE_SUB
+    sizes, widths = scale_sizes(kinds, (8, 5, 3))
+    assert sizes[counts == 10][0] == 8 and widths[counts == 10][0] == 3
+    assert sizes[counts == -3][0] == 3 and widths[counts == -3][0] == 1
+    for system in ('NONE', 'METRIC', 'IMPERIAL'):
+        for dpg in (3.0, 12.0, 40.0):
+            for mag in (10, 12):
+                intervals = label_intervals(counts, mag, system, dpg,
+                                            (10, 30))
+                ref = [_scale_label_interval_reference(
+                    int(c), mag, system, dpg, (10, 30)) for c in counts]
+                assert intervals.tolist() == ref
+    markers = five_markers(counts, 'METRIC', (8, 4, 4))
+    assert counts[markers].tolist() == [-5, 5]
+
+    # Region座標の切り取り
+    start, end, offset = clip_ruler((-99.0, 10.0), (300.0, 10.0), 0.0, False,
+                                    200, 100, 0.5)
+    assert np.allclose(start, (-1, 10)) and np.allclose(end, (201, 10))
+    assert np.isclose(offset, 98 * 0.5)
+    assert clip_ruler((-50.0, -50.0), (-10.0, -10.0), 0.0, False,
+                      200, 100, 1.0) is None
+
+    # World座標の切り取り: 透視投影
+    f, n, far = 1.0, 0.1, 100.0
+    winmat = np.zeros((4, 4))
+    winmat[0, 0] = winmat[1, 1] = f
+    winmat[2, 2] = (far + n) / (n - far)
+    winmat[2, 3] = 2 * far * n / (n - far)
+    winmat[3, 2] = -1.0
+    viewmat = np.identity(4)
+    viewmat[2, 3] = -5.0
+    persmat = np.dot(winmat, viewmat)
+    start = np.array((-50.0, 0.0, 0.0))
+    end = np.array((50.0, 0.0, -20.0))
+    result = clip_ruler(start, end, 0.0, False, 200, 200, 1.0, persmat)
+    assert result is not None
+    s, e, offset = result
+    rco, _ = _project(persmat, 200, 200, (s, e))
+    assert np.isclose(rco[0, 0], -1.0) or np.isclose(rco[1, 0], 201.0)
+    line = (end - start) / np.linalg.norm(end - start)
+    assert np.allclose(np.cross(s - start, line), 0.0)
+    assert np.isclose(offset, np.linalg.norm(s - start))
+
+    ticks = ruler_ticks(start, end, 0.0, False, Unit, 10, 200, 200,
+                        persmat=persmat)
+    assert len(ticks) and ticks.mask.all()
+    assert np.allclose(ticks.start_rco, rco[0])
+
+
+if __name__ == '__main__':
+    test()
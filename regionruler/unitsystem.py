@@ -17,7 +17,9 @@
 # ##### END GPL LICENSE BLOCK #####
 
 
+import copy
 import math
+from collections import OrderedDict
 
 from mathutils import Vector
 import bgl
@@ -209,12 +211,8 @@ class UnitSystem:
                     image_sx, image_sy = image.size
         return [image_sx, image_sy]
 
-    def update(self, context):
-        """contextの要素でself._***を更新した上でdpbu等を計算する。
-        IMAGE_EDITORの場合、グリッド分割は画像のpixelの大きさ迄とする
-        """
-        # read context --------------------------------------------------------
-
+    def read_context(self, context):
+        """contextの要素でself._***を更新する"""
         if context.area.type == 'VIEW_3D':
             scene = context.scene
             unit_settings = scene.unit_settings
@@ -236,6 +234,12 @@ class UnitSystem:
             self._grid_subdivisions = 10
             self._view_location = Vector((0, 0, 0))
 
+    def update(self, context):
+        """contextの要素でself._***を更新した上でdpbu等を計算する。
+        IMAGE_EDITORの場合、グリッド分割は画像のpixelの大きさ迄とする
+        """
+        self.read_context(context)
+
         region = context.region
         sx, sy = region.width, region.height
         system = self.system
@@ -365,6 +369,15 @@ class UnitSystem:
 
         return True
 
+    def fingerprint(self):
+        """目盛の数値の文字列に影響する値。ラベルのキャッシュのキーに使う。
+        dpbuはマウス座標のラベルにのみ影響するので含まない。
+        :rtype: tuple
+        """
+        unit = self.unit
+        return (self.system, self.scale_length, self.use_separate,
+                unit.symbol if unit else None, self.grid_view)
+
     # String <-> Numeric ------------------------------------------------------
     def unit_to_num(self, string, system=None, system_rotation=None,
                     scale_length=None, use_decimal=False, fallback=None):
@@ -520,3 +533,115 @@ class UnitSystem:
                            None if not self.unit else self.unit.name,
                            self.dpbu, self.dx, self.grid_view, self.unit_pow)
         return text
+
+
+def _key_value(value):
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return tuple(value)
+
+
+class UnitSystemCache:
+    """UnitSystemを再利用する。
+    キーはシーンの単位設定、グリッド設定、ウィンドウ行列、透視投影なら
+    view_locationの視点からの深度、及びoverrideの値から作るので、
+    視点の回転や平行移動ではdpbu等を計算し直さない。
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+
+    def _view3d_key(self, context, override):
+        unit_settings = context.scene.unit_settings
+        v3d = context.space_data
+        rv3d = context.region_data
+        if rv3d is None:
+            return None
+        key = [unit_settings.system, unit_settings.system_rotation,
+               unit_settings.scale_length, unit_settings.use_separate,
+               v3d.grid_scale, v3d.grid_subdivisions,
+               tuple(tuple(row) for row in rv3d.window_matrix)]
+        if rv3d.is_perspective:
+            view_location = override.get('view_location')
+            if view_location is None:
+                view_location = rv3d.view_location
+            depth = (rv3d.view_matrix * Vector(view_location))[2]
+            key.append(depth)
+        return tuple(key)
+
+    def _view2d_key(self, context):
+        for region in context.area.regions:
+            if region.type == 'WINDOW':
+                break
+        v2d = region.view2d
+        # 計算結果は表示範囲の大きさにだけ依存するので、平行移動では
+        # キーが変わらないよう原点からの差を使う
+        x1, y1 = v2d.region_to_view(0, 0)
+        x2, y2 = v2d.region_to_view(region.width, region.height)
+        key = [region.width, region.height,
+               float(format(x2 - x1, '.9g')), float(format(y2 - y1, '.9g'))]
+        if context.area.type == 'IMAGE_EDITOR':
+            space = context.area.spaces.active
+            image = space.image
+            if image:
+                key.extend((image.name, image.type, tuple(image.size),
+                            tuple(space.zoom)))
+        return tuple(key)
+
+    def make_key(self, context, override=None, axis='x', use_view2d=False):
+        """キャッシュ出来ない場合はNoneを返す"""
+        override = {} if override is None else override
+        area_type = context.area.type
+        if area_type == 'VIEW_3D':
+            context_key = self._view3d_key(context, override)
+        elif area_type in ('IMAGE_EDITOR', 'NODE_EDITOR'):
+            context_key = self._view2d_key(context)
+        else:
+            return None
+        if context_key is None:
+            return None
+        region = context.region
+        override_key = tuple(sorted(
+            (k, _key_value(v)) for k, v in override.items()
+            if not (area_type == 'VIEW_3D' and k == 'view_location')))
+        return (area_type, region.width, region.height, axis.lower(),
+                use_view2d, override_key, context_key)
+
+    def get(self, context, override=None, axis='x', use_view2d=False):
+        """UnitSystem(context, override, axis, use_view2d)と同じ結果を返す。
+        返り値はキャッシュの複製なので、変更しても他に影響しない。
+        :rtype: UnitSystem
+        """
+        key = self.make_key(context, override, axis, use_view2d)
+        if key is not None:
+            cached = self.data.get(key)
+            if cached is not None:
+                self.hits += 1
+                self.data.move_to_end(key)
+                unit_system = copy.copy(cached)
+                # 計算結果に影響しない値を現在の物にする
+                unit_system.override = dict(override or {})
+                unit_system.image_size = list(cached.image_size)
+                unit_system.read_context(context)
+                return unit_system
+        self.misses += 1
+        unit_system = UnitSystem(context, dict(override or {}), axis,
+                                 use_view2d)
+        if key is not None:
+            cached = copy.copy(unit_system)
+            cached.override = dict(unit_system.override)
+            cached.image_size = list(unit_system.image_size)
+            self.data[key] = cached
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+        return unit_system
+
+    def invalidate(self):
+        """シーンの単位設定を変更した場合等に呼ぶ"""
+        self.data.clear()
+        self.generation += 1
+
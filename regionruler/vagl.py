@@ -27,6 +27,8 @@ import blf
 from mathutils import Vector, Matrix
 import bgl
 
+from .drawbatch import *
+
 
 """
 RegionView3D.view_matrix == modelview_matrix
@@ -446,3 +448,41 @@ def blf_draw(fontid, txt):
     blf.draw(fontid, txt)
     glSwitch(bgl.GL_BLEND, blend)
     glSwitch(bgl.GL_TEXTURE_2D, tex2d)
+
+
+class GLBackend:
+    """DrawBatch.flush()用。状態の同じ組毎にglBegin()を一回だけ呼ぶ。
+    2.78のbglには頂点配列が無いので、glVertexの呼び出し自体は減らない。
+    """
+
+    modes = {LINES: bgl.GL_LINES, TRIANGLES: bgl.GL_TRIANGLES}
+
+    def draw(self, call):
+        if not len(call.vertices):
+            return
+        current_color = Buffer('double', 4, bgl.GL_CURRENT_COLOR)
+        line_width = Buffer('double', 0, bgl.GL_LINE_WIDTH)
+        if call.mode == LINES:
+            bgl.glLineWidth(call.width)
+        bgl.glBegin(self.modes[call.mode])
+        prev = None
+        for co, col in zip(call.vertices.tolist(), call.colors.tolist()):
+            if col != prev:
+                bgl.glColor4f(*col)
+                prev = col
+            bgl.glVertex2f(*co)
+        bgl.glEnd()
+        bgl.glLineWidth(line_width)
+        bgl.glColor4f(*current_color)
+
+    def draw_text(self, call):
+        current_color = Buffer('double', 4, bgl.GL_CURRENT_COLOR)
+        bgl.glColor4f(*call.color)
+        if call.angle:
+            blf.enable(call.font_id, blf.ROTATION)
+            blf.rotation(call.font_id, call.angle)
+        blf.position(call.font_id, call.x, call.y, 0)
+        blf_draw(call.font_id, call.text)
+        if call.angle:
+            blf.disable(call.font_id, blf.ROTATION)
+        bgl.glColor4f(*current_color)
@@ -20,6 +20,7 @@
 import math
 from collections import OrderedDict
 
+import numpy as np
 from mathutils import Quaternion, Vector
 
 
@@ -100,6 +101,179 @@ def unproject(region, rv3d, vec, depth_location:"world coords"=None):
     return v.to_3d()
 
 
+class ProjectionContext:
+    """World Coords <-> Region Coords の変換をnumpyでまとめて行う。
+    行列は(region, rv3d)毎にキャッシュし、perspective_matrixとregionの大きさ
+    が変わった時だけ作り直す。
+    pctx = ProjectionContext.get(region, rv3d)
+    coords, mask = pctx.project(points, clip=True)
+    origins, directions = pctx.ray(mouse_coords)
+    Region座標は左手系で、Zのクリッピング範囲は0~1。
+    """
+
+    _cache = {}
+    CACHE_SIZE = 16
+
+    def __init__(self, width, height, perspective_matrix, view_matrix=None,
+                 is_perspective=True):
+        """
+        :type width: int
+        :type height: int
+        :param perspective_matrix: window_matrix * view_matrix
+        :type perspective_matrix: mathutils.Matrix | numpy.ndarray
+        :type view_matrix: mathutils.Matrix | numpy.ndarray
+        :type is_perspective: bool
+        """
+        self.width = width
+        self.height = height
+        self.is_perspective = is_perspective
+        self.persmat = np.array(perspective_matrix, dtype=np.float64)
+        self.persinv = np.linalg.inv(self.persmat)
+        if view_matrix is not None:
+            self.viewmat = np.array(view_matrix, dtype=np.float64)
+            self.viewinv = np.linalg.inv(self.viewmat)
+            # window_matrix = perspective_matrix * view_matrix^-1
+            self.winmat = np.dot(self.persmat, self.viewinv)
+        else:
+            self.viewmat = self.viewinv = self.winmat = None
+        # Region座標 -> 正規化デバイス座標 の変換を含めた行列
+        ndc = np.identity(4)
+        ndc[0, 0] = 2.0 / width if width else 0.0
+        ndc[1, 1] = 2.0 / height if height else 0.0
+        ndc[2, 2] = 2.0
+        ndc[:3, 3] = -1.0
+        self.region_to_world = np.dot(self.persinv, ndc)
+        self._matrix_key = None
+
+    @classmethod
+    def get(cls, region, rv3d):
+        """キャッシュ済みの物を返す。
+        :type region: bpy.types.Region
+        :type rv3d: bpy.types.RegionView3D
+        :rtype: ProjectionContext
+        """
+        key = (region.as_pointer(), rv3d.as_pointer())
+        pmat = rv3d.perspective_matrix
+        pctx = cls._cache.get(key)
+        if pctx is not None:
+            width, height, matrix = pctx._matrix_key
+            if (width == region.width and height == region.height and
+                    matrix == pmat):
+                return pctx
+        pctx = cls(region.width, region.height, pmat, rv3d.view_matrix,
+                   rv3d.is_perspective)
+        pctx._matrix_key = (region.width, region.height, pmat.copy())
+        if key not in cls._cache and len(cls._cache) >= cls.CACHE_SIZE:
+            cls._cache.pop(next(iter(cls._cache)))
+        cls._cache[key] = pctx
+        return pctx
+
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+
+    @staticmethod
+    def _to_homogeneous(array, max_dim):
+        array = np.asarray(array, dtype=np.float64)
+        if array.ndim == 1:
+            array = array.reshape((1, -1))
+        if array.ndim != 2 or not 2 <= array.shape[1] <= max_dim:
+            raise ValueError('expected (N, 2) - (N, {}) array'.format(max_dim))
+        arr = np.zeros((len(array), 4))
+        arr[:, 3] = 1.0
+        arr[:, :array.shape[1]] = array
+        return arr
+
+    @staticmethod
+    def _dehomogenize(arr):
+        w = arr[:, 3:]
+        flags = np.abs(w[:, 0]) > PROJECT_MIN_NUMBER
+        arr[flags] /= w[flags]
+        return arr
+
+    def project(self, array, clip=False):
+        """World Coords -> Region Coords.
+        :param array: (N, 3) 又は (N, 4)。(3,)等の一次元でも可
+        :param clip: 真なら視錐台の内側かどうかの真偽値配列も返す
+        :return: (N, 3) 又は ((N, 3), (N,))
+        :rtype: numpy.ndarray | (numpy.ndarray, numpy.ndarray)
+        """
+        one = np.ndim(array) == 1
+        arr = np.dot(self._to_homogeneous(array, 4), self.persmat.T)
+        if clip:
+            w = arr[:, 3]
+            mask = ((w > PROJECT_MIN_NUMBER) &
+                    np.all(np.abs(arr[:, :3]) <= w[:, None], axis=1))
+        self._dehomogenize(arr)
+        arr += 1.0
+        arr[:, 0] *= self.width * 0.5
+        arr[:, 1] *= self.height * 0.5
+        arr[:, 2] *= 0.5
+        coords = arr[0, :3] if one else arr[:, :3]
+        if clip:
+            return coords, (mask[0] if one else mask)
+        return coords
+
+    def project_2d(self, array, clip=False):
+        """project()のXY成分のみ"""
+        if clip:
+            coords, mask = self.project(array, True)
+            return coords[..., :2], mask
+        return self.project(array)[..., :2]
+
+    def depth(self, locations):
+        """World Coordsの点のRegion Coordsでの深度(0~1)"""
+        return self.project(locations)[..., 2]
+
+    def unproject(self, array, depth_location=None):
+        """Region Coords -> World Coords.
+        :param array: (N, 2) 又は (N, 3)。二次元ならZは0.5
+        :param depth_location: World Coords。深度をこの点に合わせる。
+            (3,) 又は (N, 3)
+        :rtype: numpy.ndarray
+        """
+        one = np.ndim(array) == 1
+        dim = np.shape(array)[-1]
+        arr = self._to_homogeneous(array, 3)
+        if depth_location is not None:
+            arr[:, 2] = self.depth(np.reshape(depth_location, (-1, 3)))
+        elif dim == 2:
+            arr[:, 2] = 0.5
+        arr = self._dehomogenize(np.dot(arr, self.region_to_world.T))
+        return arr[0, :3] if one else arr[:, :3]
+
+    def ray(self, array, normalize=True):
+        """Region Coordsの各点を通る視線。
+        :param array: (N, 2)
+        :return: 始点(クリッピング範囲の手前側)と方向。共に(N, 3)
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        one = np.ndim(array) == 1
+        arr = self._to_homogeneous(array, 2)
+        num = len(arr)
+        both = np.vstack((arr, arr))
+        both[:num, 2] = 0.0
+        both[num:, 2] = 1.0
+        both = self._dehomogenize(np.dot(both, self.region_to_world.T))
+        origins = both[:num, :3]
+        directions = both[num:, :3] - origins
+        if normalize:
+            lengths = np.linalg.norm(directions, axis=1)
+            lengths[lengths == 0.0] = 1.0
+            directions /= lengths[:, None]
+        if one:
+            return origins[0], directions[0]
+        return origins, directions
+
+    def inside(self, array, margin=0.0):
+        """Region Coordsの点がregionの内側にあるか"""
+        arr = np.asarray(array, dtype=np.float64)
+        return ((arr[..., 0] >= -margin) &
+                (arr[..., 0] <= self.width + margin) &
+                (arr[..., 1] >= -margin) &
+                (arr[..., 1] <= self.height + margin))
+
+
 def project_v3(sx, sy, persmat, vec) -> "3D Vector":
     """World Coords -> Window Coords. projectより少しだけ速い。"""
     v = persmat * vec.to_4d()